@@ -0,0 +1,118 @@
+"""Synthetic table generators for migration benchmarks"""
+
+
+class SyntheticTable(object):
+    """
+    Describes a reproducible synthetic table.
+    Rows are generated server side from a sequence, so the same spec always produces the same data.
+
+    rows: number of rows
+    width: number of payload columns, alternating integer and varchar
+    payload_size: length of the varchar payload columns
+    pk_stride: distance between consecutive primary keys, 1 for dense keys
+    hole_every, hole_size: every hole_every rows, skip hole_size keys
+    indexes: number of secondary indexes on the payload columns
+    """
+
+    def __init__(self, name='bench_source', rows=1000000, width=8, payload_size=32,
+                 pk_stride=1, hole_every=0, hole_size=0, indexes=1):
+        """Set the table spec"""
+        self.name = name
+        self.rows = rows
+        self.width = width
+        self.payload_size = payload_size
+        self.pk_stride = pk_stride
+        self.hole_every = hole_every
+        self.hole_size = hole_size
+        self.indexes = min(indexes, width)
+
+    @property
+    def payload_columns(self):
+        return ['c{}'.format(i) for i in range(self.width)]
+
+    def spec(self):
+        """Return the spec as a dictionary"""
+        return {
+            'rows': self.rows,
+            'width': self.width,
+            'payload_size': self.payload_size,
+            'pk_stride': self.pk_stride,
+            'hole_every': self.hole_every,
+            'hole_size': self.hole_size,
+            'indexes': self.indexes,
+        }
+
+    def pk_expression(self, n):
+        """Primary key for sequence number n"""
+        expression = '{} * {}'.format(n, self.pk_stride)
+        if self.hole_every and self.hole_size:
+            expression += ' + ({} DIV {}) * {}'.format(n, self.hole_every, self.hole_size)
+        return expression
+
+    def column_types(self, dialect):
+        """Return the (column, type) pairs of the payload"""
+        varchar = 'varchar({})'.format(self.payload_size)
+        return [(col, 'integer' if i % 2 == 0 else varchar) for i, col in enumerate(self.payload_columns)]
+
+    def column_expressions(self, dialect, n):
+        """Return the sql expressions generating each payload column from sequence number n"""
+        expressions = []
+        for i, col in enumerate(self.payload_columns):
+            if i % 2 == 0:
+                expressions.append('({} * {}) % 1000003'.format(n, 7919 + i))
+            elif dialect == 'sqlite':
+                expressions.append("substr(printf('%0{0}d', {1} * {2}), 1, {0})".format(
+                    self.payload_size, n, 104729 + i))
+            else:
+                expressions.append("LEFT(REPEAT(MD5(CAST({} + {} AS CHAR(20))), {}), {})".format(
+                    n, i, self.payload_size // 32 + 1, self.payload_size))
+        return expressions
+
+    def create_statement(self, dialect):
+        """Return the create table statement"""
+        pk_type = 'integer' if dialect == 'sqlite' else 'bigint'
+        cols = ['id {} NOT NULL PRIMARY KEY'.format(pk_type)]
+        cols += ['{} {}'.format(col, col_type) for col, col_type in self.column_types(dialect)]
+        return 'CREATE TABLE {} ({})'.format(self.name, ', '.join(cols))
+
+    def index_statements(self):
+        """Return the secondary index statements"""
+        return ['CREATE INDEX {0}_{1}_idx ON {0} ({1})'.format(self.name, col)
+                for col in self.payload_columns[:self.indexes]]
+
+    def sequence(self, dialect, first, last):
+        """Return a sql row source yielding n from first to last inclusive"""
+        if dialect == 'postgres':
+            return 'generate_series({}, {}) AS s(n)'.format(first, last)
+        return '''(WITH RECURSIVE seq(n) AS (
+                      SELECT {} UNION ALL SELECT n + 1 FROM seq WHERE n < {}
+                   ) SELECT n FROM seq) AS s'''.format(first, last)
+
+    def insert_statements(self, dialect, batch_size=100000):
+        """Yield the statements populating the table, batch_size rows at a time"""
+        pk = self.pk_expression('s.n')
+        if dialect in ('postgres', 'sqlite'):
+            pk = pk.replace(' DIV ', ' / ')
+        cols = ', '.join(['id'] + self.payload_columns)
+        values = ', '.join([pk] + self.column_expressions(dialect, 's.n'))
+        for first in range(1, self.rows + 1, batch_size):
+            last = min(first + batch_size - 1, self.rows)
+            yield 'INSERT INTO {} ({}) SELECT {} FROM {}'.format(self.name, cols, values, self.sequence(dialect, first, last))
+
+    def build(self, db, dialect, batch_size=100000):
+        """Drop, create and populate the table, then create its indexes"""
+        table = db.table(self.name)
+        table.drop()
+        db.table(table.migrate_name).drop()
+        db.table(table.archive_name).drop()
+        if dialect == 'mysql':
+            db.execute('SET SESSION cte_max_recursion_depth = {}'.format(batch_size + 1))
+        db.execute(self.create_statement(dialect))
+        db.commit()
+        for sql in self.insert_statements(dialect, batch_size):
+            db.execute(sql)
+            db.commit()
+        for sql in self.index_statements():
+            db.execute(sql)
+        db.commit()
+        return table
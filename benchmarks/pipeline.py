@@ -0,0 +1,153 @@
+"""
+Round trip benchmark of batch_execute, statement by statement against pipelined.
+
+    python -m benchmarks.pipeline --dialects postgres mysql --rtt 1 10 --statements 1000 --depths 10 100
+
+The network round trip is simulated by a connection wrapper sleeping rtt milliseconds for every
+query sent, on top of the real round trip to the test database. For a real network delay,
+run with --rtt 0 against a server behind tc netem.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from benchmarks.suite import connect
+
+
+class LatencyCursor(object):
+    """Cursor sleeping one round trip before every query it sends"""
+
+    def __init__(self, cursor, connection):
+        self.cursor = cursor
+        self.connection = connection
+
+    def execute(self, sql, *args):
+        self.connection.round_trip()
+        return self.cursor.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cursor.close()
+
+
+class LatencyConnection(object):
+    """Connection wrapper adding rtt seconds to every query, commit and rollback"""
+
+    def __init__(self, connection, rtt):
+        self.connection = connection
+        self.rtt = rtt
+        self.round_trips = 0
+
+    def round_trip(self):
+        self.round_trips += 1
+        time.sleep(self.rtt)
+
+    def cursor(self, *args):
+        return LatencyCursor(self.connection.cursor(*args), self)
+
+    def commit(self):
+        self.round_trip()
+        return self.connection.commit()
+
+    def rollback(self):
+        self.round_trip()
+        return self.connection.rollback()
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+def statements(table, count):
+    """Single row inserts and updates, as a bulk load of small rows would send them"""
+    sql = []
+    for i in range(count):
+        if i % 4 == 3:
+            sql.append('UPDATE {} SET value = value + 1 WHERE id = {}'.format(table, i - 1))
+        else:
+            sql.append("INSERT INTO {} (id, value) VALUES ({}, {})".format(table, i, i % 97))
+    return sql
+
+
+def run_case(db, dialect, rtt, count, depth=None):
+    """Time one batch of count statements, sent one by one without depth, else pipelined"""
+    table = 'bench_pipeline'
+    db.table(table).drop()
+    db.execute('CREATE TABLE {} (id integer PRIMARY KEY, value integer)'.format(table))
+    db.commit()
+    connection = db.connection
+    db.connection = LatencyConnection(connection, rtt / 1000.0)
+    try:
+        started = time.time()
+        if depth:
+            results = db.batch_execute(statements(table, count), pipeline=True, depth=depth)
+            failed = [x for x in results if not x.ok]
+            if failed:
+                raise failed[0].error
+        else:
+            db.batch_execute(statements(table, count))
+        db.commit()
+        seconds = time.time() - started
+        round_trips = db.connection.round_trips
+    finally:
+        db.connection = connection
+    db.table(table).drop()
+    return {
+        'key': '{}/rtt={}ms/statements={}/depth={}'.format(dialect, rtt, count, depth or 1),
+        'dialect': dialect,
+        'rtt_ms': rtt,
+        'statements': count,
+        'depth': depth or 1,
+        'seconds': seconds,
+        'statements_per_second': count / seconds if seconds else None,
+        'round_trips': round_trips,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='batch_execute pipelining benchmark')
+    parser.add_argument('--dialects', nargs='+', default=['postgres'], choices=['postgres', 'mysql', 'sqlite'])
+    parser.add_argument('--rtt', nargs='+', type=float, default=[1, 10], help='simulated round trip in ms')
+    parser.add_argument('--statements', type=int, default=1000)
+    parser.add_argument('--depths', nargs='+', type=int, default=[10, 100])
+    parser.add_argument('--config', default='tests/.config.test')
+    parser.add_argument('--sqlite-path', default=':memory:')
+    parser.add_argument('--output', default='bench_pipeline.json')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    for dialect in args.dialects:
+        db = connect(dialect, args.config, args.sqlite_path)
+        for rtt in args.rtt:
+            for depth in [None] + args.depths:
+                result = run_case(db, dialect, rtt, args.statements, depth)
+                print('{}: {:.3f}s, {} round trips, {:.0f} statements/s'.format(
+                    result['key'], result['seconds'], result['round_trips'], result['statements_per_second'] or 0))
+                results.append(result)
+
+    report = {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+Run the migration benchmark suite.
+
+    python -m benchmarks.run --dialects postgres mysql --rows 1000000 10000000 --chunk-sizes 1000 10000
+
+Results are written as JSON. With --baseline, each case is compared against the stored
+baseline and the run exits non-zero when a metric regresses by more than --tolerance.
+A missing baseline file is an error, record one first with --save-baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from benchmarks.generators import SyntheticTable
+from benchmarks.suite import compare, connect, run_case
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Migration benchmark suite')
+    parser.add_argument('--dialects', nargs='+', default=['postgres'], choices=['postgres', 'mysql', 'sqlite'])
+    parser.add_argument('--rows', nargs='+', type=int, default=[1000000])
+    parser.add_argument('--widths', nargs='+', type=int, default=[8])
+    parser.add_argument('--payload-size', type=int, default=32)
+    parser.add_argument('--pk-stride', type=int, default=1)
+    parser.add_argument('--hole-every', type=int, default=0)
+    parser.add_argument('--hole-size', type=int, default=0)
+    parser.add_argument('--indexes', nargs='+', type=int, default=[1])
+    parser.add_argument('--chunk-sizes', nargs='+', type=int, default=[1000, 10000])
+    parser.add_argument('--trigger-writes', type=int, default=1000)
+    parser.add_argument('--config', default='tests/.config.test')
+    parser.add_argument('--sqlite-path', default=':memory:')
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args(argv)
+    if args.save_baseline and not args.baseline:
+        parser.error('--save-baseline needs --baseline')
+    if args.baseline and not args.save_baseline and not os.path.exists(args.baseline):
+        parser.error('baseline {} not found, record it with --save-baseline'.format(args.baseline))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    for dialect in args.dialects:
+        db = connect(dialect, args.config, args.sqlite_path)
+        for rows in args.rows:
+            for width in args.widths:
+                for indexes in args.indexes:
+                    spec = SyntheticTable(rows=rows, width=width, payload_size=args.payload_size,
+                                          pk_stride=args.pk_stride, hole_every=args.hole_every,
+                                          hole_size=args.hole_size, indexes=indexes)
+                    for chunk_size in args.chunk_sizes:
+                        result = run_case(db, dialect, spec, chunk_size, args.trigger_writes)
+                        print('{}: {:.0f} rows/s, cutover {:.3f}s'.format(
+                            result['key'], result['rows_per_second'] or 0, result['cutover_seconds']))
+                        results.append(result)
+
+    report = {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    status = 0
+    if args.baseline and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for key, metric, before, after in regressions:
+            print('REGRESSION {} {}: {:.4f} -> {:.4f}'.format(key, metric, before, after))
+        status = 1 if regressions else 0
+    elif args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
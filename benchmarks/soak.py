@@ -0,0 +1,277 @@
+"""
+Soak harness measuring how much a migration slows the application writing to its table.
+
+    python -m benchmarks.soak --dialects postgres --rows 100000 --modes triggers filtered shadow \
+        --chunk-sizes 1000 10000 --throttles 0 0.05 --rate 200 --mix 60 30 10
+
+A synthetic OLTP workload of single row inserts, updates and deletes runs on its own connection
+while the table is migrated. Its latency is recorded per phase: baseline before the migration,
+triggers once the capture is installed, copying while the rows are copied, cutover while
+the tables are swapped, and post_cutover on the new table once they are. Each case reports the latency
+of every phase and its overhead over the baseline, and the chunk latency of the copy or backfill.
+
+Capture modes are the ways a migration keeps up with the writes: triggers copies every change,
+filtered and transformed capture through filter_rows and transform_column,
+shadow syncs a shadow column of the table itself.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from benchmarks.generators import SyntheticTable
+from benchmarks.suite import connect, sample_pks
+from src.core.metrics import Histogram
+
+# Application statement latency buckets in seconds, from half a millisecond to 10 seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PHASES = ('baseline', 'triggers', 'copying', 'cutover', 'post_cutover')
+MODES = ('triggers', 'filtered', 'transformed', 'shadow')
+
+
+class Workload(object):
+    """
+    Synthetic OLTP writes to a synthetic table, run on a connection of its own in a background thread.
+    Statements are scheduled open loop, rate per second, and their latency is measured from their
+    scheduled start, so a statement stalled behind a lock also counts against those queued after it.
+    mix is the relative weight of inserts, updates and deletes.
+    """
+
+    def __init__(self, connect, spec, rate=100, mix=(60, 30, 10), seed=0):
+        """Initialize the workload, connect is a callable returning a Database"""
+        self.connect = connect
+        self.spec = spec
+        self.rate = rate
+        self.mix = mix
+        self.random = random.Random(seed)
+        self.pks = sample_pks(spec, min(spec.rows, 10000))
+        self.next_pk = None
+        self.phase = None
+        self.histograms = {}
+        self.errors = defaultdict(int)
+        self.durations = defaultdict(float)
+        self._phase_start = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, phase):
+        """Start writing, recording under phase"""
+        self.set_phase(phase)
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def set_phase(self, phase):
+        """Record the following statements under phase"""
+        now = time.time()
+        with self._lock:
+            if self.phase:
+                self.durations[self.phase] += now - self._phase_start
+            self.phase, self._phase_start = phase, now
+
+    def stop(self):
+        """Stop writing and wait for the last statement"""
+        self._stop.set()
+        self._thread.join()
+        self.set_phase(None)
+
+    def statement(self):
+        """Return the next insert, update or delete"""
+        kind = self.random.choices(('insert', 'update', 'delete'), self.mix)[0]
+        table = self.spec.name
+        if kind == 'insert' or not self.pks:
+            pk, self.next_pk = self.next_pk, self.next_pk + self.spec.pk_stride
+            self.pks.append(pk)
+            return 'INSERT INTO {} (id, c0) VALUES ({}, {})'.format(table, pk, self.random.randint(0, 1000))
+        if kind == 'update':
+            return 'UPDATE {} SET c0 = c0 + 1 WHERE id = {}'.format(table, self.random.choice(self.pks))
+        pk = self.pks.pop(self.random.randrange(len(self.pks)))
+        return 'DELETE FROM {} WHERE id = {}'.format(table, pk)
+
+    def run(self):
+        """Write until stopped"""
+        db = self.connect()
+        self.next_pk = db.table(self.spec.name).max_pk + self.spec.pk_stride
+        started = time.time()
+        count = 0
+        while not self._stop.is_set():
+            scheduled = started + count / float(self.rate)
+            count += 1
+            if self._stop.wait(max(scheduled - time.time(), 0)):
+                break
+            sql = self.statement()
+            error = False
+            try:
+                db.execute(sql)
+                db.commit()
+            except Exception:
+                error = True
+                db.rollback()
+            latency = time.time() - scheduled
+            with self._lock:
+                self.histograms.setdefault(self.phase, Histogram(LATENCY_BUCKETS)).observe(latency)
+                self.errors[self.phase] += error
+        db.connection.close()
+
+    def summary(self):
+        """Return the latency of each phase in milliseconds"""
+        phases = {}
+        with self._lock:
+            for phase, histogram in self.histograms.items():
+                phases[phase] = {
+                    'statements': histogram.count,
+                    'errors': self.errors[phase],
+                    'seconds': self.durations.get(phase),
+                    'mean_ms': histogram.sum / histogram.count * 1000,
+                    'p50_ms': histogram.p50 * 1000,
+                    'p99_ms': histogram.p99 * 1000,
+                    'max_ms': histogram.max * 1000,
+                }
+        return phases
+
+
+def overhead(phases):
+    """Latency added by each phase over the baseline, in milliseconds"""
+    baseline = phases.get('baseline')
+    if not baseline:
+        return {}
+    return dict((phase, {
+        'p50_ms': stats['p50_ms'] - baseline['p50_ms'],
+        'p99_ms': stats['p99_ms'] - baseline['p99_ms'],
+        'max_ms': stats['max_ms'] - baseline['max_ms'],
+    }) for phase, stats in phases.items() if phase != 'baseline')
+
+
+def chunk_stats(progress, phase):
+    """Chunk count and latency of a chunked phase of the migration"""
+    stats = progress.summary()['phases'].get(phase, {})
+    return {'chunks': stats.get('chunks'), 'chunk_p50': stats.get('latency_p50'), 'chunk_p99': stats.get('latency_p99')}
+
+
+def migrate(db, source, mode, workload, chunk_size, throttle, settle_seconds):
+    """Migrate source with the capture mode, moving the workload through the phases.
+    cutover only covers the swap, the workload then runs settle_seconds against the new table
+    """
+    if mode == 'shadow':
+        shadow = source.shadow_column('c0', 'bigint')
+        shadow.add()
+        workload.set_phase('triggers')
+        shadow.create_triggers()
+        time.sleep(settle_seconds)
+        workload.set_phase('copying')
+        shadow.backfill(chunk_size, throttle)
+        shadow.add_indexes()
+        workload.set_phase('cutover')
+        shadow.swap(drop_old=False)
+        workload.set_phase('post_cutover')
+        shadow.drop_old()
+        time.sleep(settle_seconds)
+        return chunk_stats(source.progress, 'update')
+
+    migration = db.migration_table(source)
+    if mode == 'filtered':
+        migration.filter_rows('{row}.c0 % 2 = 0')
+    elif mode == 'transformed':
+        migration.transform_column('c1', 'UPPER({row}.c1)')
+    migration.create_from_source()
+    workload.set_phase('triggers')
+    migration.create_triggers()
+    time.sleep(settle_seconds)
+    workload.set_phase('copying')
+    migration.copy_in_chunks(chunk_size=chunk_size, throttle=throttle)
+    workload.set_phase('cutover')
+    migration.rename_tables()
+    workload.set_phase('post_cutover')
+    time.sleep(settle_seconds)
+    return chunk_stats(migration.progress, 'copy')
+
+
+def run_case(db, dialect, spec, connect_workload, mode, chunk_size, throttle, rate, mix,
+             baseline_seconds=10, settle_seconds=5):
+    """Build the synthetic table, then migrate it under the workload"""
+    source = spec.build(db, dialect)
+    workload = Workload(connect_workload, spec, rate, mix)
+    result = {'dialect': dialect, 'mode': mode, 'chunk_size': chunk_size, 'throttle': throttle,
+              'rate': rate, 'mix': list(mix)}
+    result.update(spec.spec())
+
+    workload.start('baseline')
+    started = time.time()
+    try:
+        time.sleep(baseline_seconds)
+        result.update(migrate(db, source, mode, workload, chunk_size, throttle, settle_seconds))
+    finally:
+        workload.stop()
+    result['migration_seconds'] = time.time() - started - baseline_seconds
+    result['phases'] = workload.summary()
+    result['overhead'] = overhead(result['phases'])
+
+    for name in (source.archive_name, source.migrate_name, source.name):
+        db.table(name).drop()
+    result['key'] = '{dialect}/rows={rows}/mode={mode}/chunk={chunk_size}/throttle={throttle}/rate={rate}'.format(
+        **result)
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Application write latency under a migration')
+    parser.add_argument('--dialects', nargs='+', default=['postgres'], choices=['postgres', 'mysql', 'sqlite'])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--width', type=int, default=8)
+    parser.add_argument('--payload-size', type=int, default=32)
+    parser.add_argument('--indexes', type=int, default=1)
+    parser.add_argument('--modes', nargs='+', default=['triggers'], choices=MODES)
+    parser.add_argument('--chunk-sizes', nargs='+', type=int, default=[1000, 10000])
+    parser.add_argument('--throttles', nargs='+', type=float, default=[0])
+    parser.add_argument('--rate', type=float, default=100, help='workload statements per second')
+    parser.add_argument('--mix', nargs=3, type=int, default=[60, 30, 10], metavar=('INSERT', 'UPDATE', 'DELETE'))
+    parser.add_argument('--baseline-seconds', type=float, default=10)
+    parser.add_argument('--settle-seconds', type=float, default=5)
+    parser.add_argument('--config', default='tests/.config.test')
+    parser.add_argument('--sqlite-path', default=os.path.join(tempfile.gettempdir(), 'sooty_soak.db'),
+                        help='the workload needs a second connection, so sqlite runs on a file')
+    parser.add_argument('--output', default='bench_soak.json')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    for dialect in args.dialects:
+        db = connect(dialect, args.config, args.sqlite_path)
+        spec = SyntheticTable(rows=args.rows, width=max(args.width, 2), payload_size=args.payload_size,
+                              indexes=args.indexes)
+        for mode in args.modes:
+            for chunk_size in args.chunk_sizes:
+                for throttle in args.throttles:
+                    result = run_case(db, dialect, spec, lambda: connect(dialect, args.config, args.sqlite_path),
+                                      mode, chunk_size, throttle, args.rate, args.mix,
+                                      args.baseline_seconds, args.settle_seconds)
+                    print(result['key'])
+                    for phase in PHASES:
+                        stats = result['phases'].get(phase)
+                        if stats:
+                            print('  {:<12} p50 {:8.2f}ms  p99 {:8.2f}ms  max {:8.2f}ms  errors {}'.format(
+                                phase, stats['p50_ms'], stats['p99_ms'], stats['max_ms'], stats['errors']))
+                    results.append(result)
+
+    report = {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Measures the migration pipeline against synthetic tables"""
+import configparser
+import time
+from src import CONFIG, DatabaseFactory
+
+
+SECTIONS = {
+    'postgres': 'POSTGRES_TEST_DB',
+    'mysql': 'MYSQL_TEST_DB',
+}
+
+# Metrics where a higher value is a regression, and where a lower value is
+TIME_METRICS = ('setup_seconds', 'copy_seconds', 'chunk_p50', 'chunk_p99', 'trigger_overhead_ms', 'cutover_seconds')
+RATE_METRICS = ('rows_per_second',)
+
+
+def connect(dialect, config_path='tests/.config.test', sqlite_path=':memory:'):
+    """Return a database for the dialect, using the test database settings"""
+    config = dict(CONFIG)
+    config.update({'DIALECT': dialect, 'DEFAULT_THROTTLE': 0, 'PROGRESS_CONSOLE': False})
+    if dialect == 'sqlite':
+        import sqlite3
+        return DatabaseFactory('main', sqlite3.connect(sqlite_path), config).fetch()
+
+    parser = configparser.ConfigParser()
+    parser.read(config_path)
+    section = SECTIONS[dialect]
+    settings = {
+        'user': parser.get(section, 'user'),
+        'host': parser.get(section, 'host'),
+        'password': parser.get(section, 'password'),
+    }
+    dbname = parser.get(section, 'dbname')
+    if dialect == 'postgres':
+        import psycopg2
+        connection = psycopg2.connect(dbname=dbname, **settings)
+    else:
+        import MySQLdb
+        connection = MySQLdb.connect(db=dbname, **settings)
+    return DatabaseFactory(dbname, connection, config).fetch()
+
+
+def sample_pks(spec, count):
+    """Return count primary keys spread evenly over the synthetic table"""
+    step = max(spec.rows // count, 1)
+    pks = []
+    for n in range(1, spec.rows + 1, step)[:count]:
+        pk = n * spec.pk_stride
+        if spec.hole_every and spec.hole_size:
+            pk += (n // spec.hole_every) * spec.hole_size
+        pks.append(pk)
+    return pks
+
+
+def time_writes(table, pks):
+    """Update each pk in its own transaction, return the mean latency in milliseconds"""
+    if not pks:
+        return 0.0
+    started = time.time()
+    for i, pk in enumerate(pks):
+        table.update_row(pk, {'c0': i})
+        table.commit()
+    return (time.time() - started) * 1000 / len(pks)
+
+
+def case_key(result):
+    """Identify a benchmark case across runs"""
+    return '{dialect}/rows={rows}/width={width}/payload={payload_size}/stride={pk_stride}/' \
+           'holes={hole_every}x{hole_size}/indexes={indexes}/chunk={chunk_size}'.format(**result)
+
+
+def run_case(db, dialect, spec, chunk_size, trigger_writes=1000):
+    """Build the synthetic table, then time setup, trigger overhead, copy and cutover"""
+    source = spec.build(db, dialect)
+    result = {'dialect': dialect, 'chunk_size': chunk_size}
+    result.update(spec.spec())
+    pks = sample_pks(spec, trigger_writes)
+
+    migration = db.migration_table(source)
+    started = time.time()
+    migration.create_from_source()
+    result['setup_seconds'] = time.time() - started
+
+    baseline_write = time_writes(source, pks)
+    migration.create_triggers()
+    result['trigger_overhead_ms'] = time_writes(source, pks) - baseline_write
+
+    started = time.time()
+    migration.copy_in_chunks(chunk_size=chunk_size)
+    result['copy_seconds'] = time.time() - started
+    result['rows_per_second'] = spec.rows / result['copy_seconds'] if result['copy_seconds'] else None
+    copy = migration.progress.summary()['phases'].get('copy', {})
+    result['chunks'] = copy.get('chunks')
+    result['chunk_p50'] = copy.get('latency_p50')
+    result['chunk_p99'] = copy.get('latency_p99')
+
+    started = time.time()
+    migration.rename_tables()
+    result['cutover_seconds'] = time.time() - started
+
+    db.table(source.archive_name).drop()
+    db.table(source.name).drop()
+    result['key'] = case_key(result)
+    return result
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Return the regressions of results against a baseline, as (key, metric, baseline, current) tuples"""
+    previous = {r['key']: r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        before = previous.get(result['key'])
+        if not before:
+            continue
+        for metric in TIME_METRICS:
+            if before.get(metric) and result.get(metric) is not None:
+                if result[metric] > before[metric] * (1 + tolerance):
+                    regressions.append((result['key'], metric, before[metric], result[metric]))
+        for metric in RATE_METRICS:
+            if before.get(metric) and result.get(metric) is not None:
+                if result[metric] < before[metric] * (1 - tolerance):
+                    regressions.append((result['key'], metric, before[metric], result[metric]))
+    return regressions
@@ -2,6 +2,7 @@
 
 from src.postgres.base import PostgresDatabase
 from src.mysql.base import MySqlDatabase
+from src.sqlite.base import SqliteDatabase
 
 
 CONFIG = {
@@ -10,6 +11,12 @@ CONFIG = {
     "MAX_LENGTH_NAME": 60,
     "MAX_RENAME_RETRIES": 10,
     "RETRY_SLEEP_TIME": 10,
+    "CHUNK_RETRIES": 5,
+    "CHUNK_RETRY_BACKOFF": 0.5,
+    "CHUNK_TIMEOUT": None,
+    "PLAN_GUARD_INTERVAL": 100,
+    "PROGRESS_CONSOLE": True,
+    "PIPELINE_DEPTH": 100,
     "DIALECT": 'postgres'
 }
 
@@ -17,21 +24,26 @@ CONFIG = {
 class DatabaseFactory(object):
     """Model representing a database"""
 
-    def __init__(self, name, connection, config=CONFIG):
+    def __init__(self, name, connection, config=CONFIG, pool=None):
         """Initialize the database"""
         self.name = name
         self.connection = connection
         self.config = config
-        self.POSTGRES, self.MYSQL = False, False
+        self.pool = pool
+        self.POSTGRES, self.MYSQL, self.SQLITE = False, False, False
         if self.config['DIALECT'] == 'postgres':
             self.POSTGRES = True
         elif self.config['DIALECT'] == 'mysql':
             self.MYSQL = True
+        elif self.config['DIALECT'] == 'sqlite':
+            self.SQLITE = True
         else:
             raise Exception('Database dialect %s not supported' % self.config['DIALECT'])
 
     def fetch(self):
         if self.POSTGRES:
-            return PostgresDatabase(self.name, self.connection, self.config)
+            return PostgresDatabase(self.name, self.connection, self.config, self.pool)
         if self.MYSQL:
-            return MySqlDatabase(self.name, self.connection, self.config)
+            return MySqlDatabase(self.name, self.connection, self.config, self.pool)
+        if self.SQLITE:
+            return SqliteDatabase(self.name, self.connection, self.config, self.pool)
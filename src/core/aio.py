@@ -0,0 +1,197 @@
+"""asyncio API for the migration tool.
+Statements are built by the same Commands classes as the blocking API, and run on connections
+checked out of an async driver pool, so many migrations can share one event loop.
+"""
+import asyncio
+import time
+from collections import namedtuple
+from src.core.progress import Progress, ConsoleReporter
+from src.core.tables import Table, Intersection
+
+
+# Column lists handed to Intersection, which only needs .columns and .renames
+ColumnSet = namedtuple('ColumnSet', ['columns', 'renames'])
+
+
+class AsyncDatabase(object):
+    """
+    Model representing a database reached through an async connection pool.
+    Each statement checks out its own connection and commits on its own,
+    so independent statements can be in flight at the same time.
+    Dialects implement _fetch and _execute for their driver.
+    """
+
+    def __init__(self, name, pool, config):
+        """Initialize the database with an asyncpg/aiomysql style pool"""
+        self.name = name
+        self.pool = pool
+        self.config = config
+        self.commands = None
+        self.table_class = AsyncTable
+        self.migration_table_class = AsyncMigrationTable
+
+    async def _fetch(self, connection, sql):
+        """Run sql on connection, return the rows as a list of tuples"""
+        raise NotImplementedError
+
+    async def _execute(self, connection, sql):
+        """Run sql on connection and commit, return the number of rows affected"""
+        raise NotImplementedError
+
+    async def fetch(self, sql):
+        """Run a query against the database, return the rows as a list of tuples"""
+        async with self.pool.acquire() as connection:
+            return await self._fetch(connection, sql)
+
+    async def execute(self, sql):
+        """Run a statement against the database, return the number of rows affected"""
+        async with self.pool.acquire() as connection:
+            return await self._execute(connection, sql)
+
+    async def tables(self):
+        """Get a list of non-system database table names"""
+        result = await self.fetch(self.commands.get_tables(self.name))
+        return [x[0] for x in result]
+
+    async def table_exists(self, table_name):
+        """Check if table exists in database"""
+        return table_name in await self.tables()
+
+    def table(self, tablename, primary_key_column='id'):
+        return self.table_class(database=self, name=tablename, primary_key_column=primary_key_column)
+
+    def migration_table(self, source_table):
+        return self.migration_table_class(database=self, source_table=source_table, primary_key_column=source_table.primary_key_column)
+
+
+class AsyncTable(object):
+    """Represents a table in a database reached through an AsyncDatabase"""
+
+    def __init__(self, database, name, primary_key_column='id'):
+        """Initialize the table with database object and name"""
+        self.db = database
+        self.name = name
+        self.primary_key_column = primary_key_column
+        self.progress = Progress(name)
+
+    @property
+    def commands(self):
+        return self.db.commands
+
+    @property
+    def migrate_name(self):
+        return 'migrate_{}'.format(self.name)
+
+    @property
+    def archive_name(self):
+        return 'archive_{}'.format(self.name)
+
+    async def _scalar(self, sql):
+        ans = await self.db.fetch(sql)
+        return ans[0][0] if ans else None
+
+    async def count(self):
+        """Get the count for the table"""
+        return await self._scalar(self.commands.table_count(self.name))
+
+    async def columns(self):
+        """Return list of column names"""
+        result = await self.db.fetch(self.commands.table_columns(self.name))
+        return [x[0] for x in result]
+
+    async def min_pk(self):
+        """Return the minimum id for the table rows"""
+        return await self._scalar(self.commands.min_pk(self.name, self.primary_key_column))
+
+    async def max_pk(self):
+        """Return the maximum id for the table rows"""
+        return await self._scalar(self.commands.max_pk(self.name, self.primary_key_column))
+
+    async def average_row_size(self):
+        """Return the estimated average row size in bytes"""
+        ans = await self.db.fetch(self.commands.table_size(self.db.name, self.name))
+        if not ans:
+            return 0
+        size, rows = ans[0]
+        return int(size or 0) / float(rows) if rows and rows > 0 else 0
+
+
+class AsyncMigrationTable(AsyncTable):
+    """
+    Async copy of a source table into its migrate_ table.
+    Schema changes, triggers and the cutover are short and stay on the blocking MigrationTable,
+    this runs the long copy phase without holding a thread.
+    """
+
+    def __init__(self, database, source_table, primary_key_column='id'):
+        """Initialize table with parent"""
+        self.source = source_table
+        super(AsyncMigrationTable, self).__init__(database, source_table.migrate_name, primary_key_column)
+        self.renames = []
+        if self.db.config.get('PROGRESS_CONSOLE', True):
+            self.progress.add_listener(ConsoleReporter())
+
+    def rename_column(self, original_column_name, new_column_name):
+        """Map a column renamed on the migrate_ table, the rename itself is done by the blocking API"""
+        self.renames.append((original_column_name, new_column_name))
+
+    async def intersection(self):
+        """Returns an intersection object, with the columns of both tables looked up concurrently"""
+        origin, destination = await asyncio.gather(self.source.columns(), self.columns())
+        return Intersection(ColumnSet(origin, []), ColumnSet(destination, self.renames))
+
+    async def copy_in_chunks(self, chunk_size=None, throttle=None, start=None, limit=None):
+        """
+        Copy the data from the source table to the destination table in chunks.
+        The next chunk boundary is looked up on the source table while the current chunk is being copied,
+        so each chunk costs one round trip instead of two.
+        Rows in [pointer, boundary) are at most chunk_size, so the copy from pointer covers all of them,
+        and rows at or after the boundary are left to the next chunk.
+        """
+        self.chunk_size = chunk_size if chunk_size else self.db.config['DEFAULT_CHUNK_SIZE']
+        throttle = throttle if throttle else self.db.config['DEFAULT_THROTTLE']
+
+        source_count, count, row_size, intersection = await asyncio.gather(
+            self.source.count(), self.count(), self.source.average_row_size(), self.intersection())
+        if count and count == source_count:
+            return True
+
+        dest_cols = ', '.join(intersection.dest_columns)
+        origin_cols = Table._qualify(self.source.name, intersection.origin_columns)
+        pointer = start if start is not None else await self.source.min_pk()
+        limit = limit if limit is not None else await self.source.max_pk()
+
+        self.progress.expect(source_count - count, row_size)
+        with self.progress.phase('copy'):
+            while pointer is not None and pointer <= limit:
+                (rows, latency), boundary = await asyncio.gather(
+                    self._timed_copy_chunk(dest_cols, origin_cols, pointer),
+                    self._next_boundary(pointer)
+                )
+                pointer = boundary
+                await asyncio.sleep(throttle)
+                self.progress.chunk(rows, latency, throttle, position=pointer)
+        return True
+
+    async def _next_boundary(self, last_pk):
+        """Return the first pk of the next chunk, None after the last chunk"""
+        return await self._scalar(self.commands.next_pk(
+            self.source.name,
+            self.primary_key_column,
+            last_pk,
+            self.chunk_size
+        ))
+
+    async def _timed_copy_chunk(self, dest_cols, origin_cols, last_pk):
+        """Copy a chunk, return the (rows copied, seconds taken)"""
+        chunk_start = time.time()
+        rows = await self.db.execute(self.commands.copy_chunk(
+            self.name,
+            dest_cols,
+            origin_cols,
+            self.source.name,
+            self.primary_key_column,
+            last_pk,
+            self.chunk_size
+        ))
+        return rows, time.time() - chunk_start
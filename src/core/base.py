@@ -1,50 +1,300 @@
 """Migration tool"""
+import copy
+import os
+import shutil
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from src.core.profiling import PhaseProfiler
+from src.core.shadow import ShadowColumn
 from src.core.tables import Table, MigrationTable
+from src.core.tracing import QueryTracer, TracedCommands
+
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+
+class StatementSkipped(Exception):
+    """Error of a batch statement that was not run because an earlier statement failed"""
+    pass
+
+
+class StatementResult(namedtuple('StatementResult', ['sql', 'rows', 'rowcount', 'error'])):
+    """
+    Outcome of one statement of a pipelined batch. rows is None for a statement returning no rows,
+    and rowcount None where the driver does not report it. error is the exception the statement raised,
+    a StatementSkipped when it did not run.
+    """
+    __slots__ = ()
+
+    def __new__(cls, sql, rows=None, rowcount=None, error=None):
+        return super(StatementResult, cls).__new__(cls, sql, rows, rowcount, error)
+
+    @property
+    def ok(self):
+        return self.error is None
 
 
 class Database(object):
     """Model representing a database"""
 
-    def __init__(self, name, connection, config):
-        """Initialize the database"""
+    def __init__(self, name, connection, config, pool=None):
+        """Initialize the database.
+        With a pool and no connection, the control connection is checked out of the pool.
+        """
         self.name = name
-        self.connection = connection
+        self.pool = pool
+        self.parent = None
+        self.owns_connection = connection is None and pool is not None
+        self.connection = pool.acquire() if self.owns_connection else connection
         self.config = config
         self.commands = None
         self.table_class = Table
         self.migration_table_class = MigrationTable
+        self.shadow_column_class = ShadowColumn
         self.last_row = None
+        self.last_rowcount = None
+        self.tracer = None
+        self.profiler = None
+
+    @contextmanager
+    def session(self, timeout=None):
+        """Check out a separate pooled connection for data work,
+        yields a copy of this database bound to it
+        """
+        if not self.pool:
+            raise ValueError('Database {} has no connection pool'.format(self.name))
+        with self.pool.connection(timeout) as connection:
+            yield self.bind(connection)
+
+    def bind(self, connection):
+        """Return a copy of this database running its statements on connection"""
+        bound = copy.copy(self)
+        bound.connection = connection
+        bound.parent = self
+        bound.owns_connection = False
+        bound.last_row = None
+        bound.last_rowcount = None
+        return bound
+
+    def close(self):
+        """Return the control connection to the pool"""
+        if self.owns_connection and self.connection is not None:
+            self.pool.release(self.connection)
+            self.connection = None
+
+    def enable_tracing(self, slow_threshold=1.0, slow_log_path=None):
+        """
+        Trace every statement run through execute and batch_execute.
+        Sql is labelled with the commands method that built it. Enable before creating tables,
+        so migration phases label their statements as well.
+        """
+        if not isinstance(self.commands, TracedCommands):
+            self.commands = TracedCommands(self.commands)
+        self.tracer = QueryTracer(slow_threshold=slow_threshold, slow_log_path=slow_log_path)
+        return self.tracer
+
+    def disable_tracing(self):
+        """Stop tracing, return the tracer with the collected statistics"""
+        tracer, self.tracer = self.tracer, None
+        if isinstance(self.commands, TracedCommands):
+            self.commands = self.commands.wrapped
+        return tracer
+
+    def enable_profiling(self, profile=None, path=None, sampler=False, interval=0.005, profiler=None):
+        """
+        Account wall, database wait and CPU time and memory to each migration section, see PhaseProfiler.
+        profile is the name of a section to profile with cProfile, or with a stack sampler every
+        interval seconds when sampler is set, the profile is written to path by disable_profiling.
+        Pass the profiler of another database to account the waits on both, as the two sides of a transfer.
+        """
+        self.profiler = profiler or PhaseProfiler(profile, path, sampler, interval)
+        return self.profiler
+
+    def disable_profiling(self):
+        """Stop profiling, write the profile of the profiled section, return the profiler"""
+        profiler, self.profiler = self.profiler, None
+        if profiler:
+            profiler.dump()
+        return profiler
+
+    def _trace(self, sql, started, rows=None, label=None, error=None):
+        if self.tracer or self.profiler:
+            duration = time.time() - started
+            if self.profiler:
+                self.profiler.wait(duration)
+            if self.tracer:
+                self.tracer.record(sql, duration, rows, label=label or getattr(sql, 'label', None), error=error)
+
+    def cursor(self):
+        """Return a cursor usable as a context manager"""
+        return self.connection.cursor()
+
+    def stream_cursor(self):
+        """Return the cursor stream reads its rows from"""
+        return self.cursor()
 
     def commit(self):
+        started = time.time()
         self.connection.commit()
+        self._trace('COMMIT', started, label='Database.commit')
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def error_code(self, error):
+        """Driver code of a database error, None if the driver gives none"""
+        return None
+
+    def classify_error(self, error):
+        """Return 'timeout' for a lock or statement timeout, 'retry' for another transient error
+        such as a deadlock or serialization failure, None for an error that is fatal
+        """
+        code = self.error_code(error)
+        if code in self.commands.TIMEOUT_ERRORS:
+            return 'timeout'
+        if code in self.commands.RETRIABLE_ERRORS:
+            return 'retry'
+        return None
 
     def execute(self, sql):
         """Execute a query against the database. Returns empty tuple if no result"""
-        with self.connection.cursor() as dbc:
+        label = getattr(sql, 'label', None)
+        with self.cursor() as dbc:
+            sql = sql.rstrip()
             if sql[-1] != ';':
                 sql += ';'
-            dbc.execute(sql)
+            started = time.time()
+            try:
+                dbc.execute(sql)
+            except Exception as e:
+                self._trace(sql, started, label=label, error=e)
+                raise
             self.last_row = dbc.lastrowid
+            self.last_rowcount = dbc.rowcount
             try:
-                return dbc.fetchall()
+                result = dbc.fetchall()
             except:
-                return
+                result = None
+            self._trace(sql, started, dbc.rowcount, label=label)
+            return result
 
-    def batch_execute(self, sql_list):
-        """Execute a list of sql statements"""
-        with self.connection.cursor() as dbc:
+    def batch_execute(self, sql_list, pipeline=False, depth=None):
+        """Execute a list of sql statements, return the rows of each.
+        With pipeline, up to depth statements (PIPELINE_DEPTH by default) are sent in one round trip
+        where the dialect can, and a StatementResult is returned for each statement instead of its rows.
+        Errors do not raise then: the statements after the first failed one are skipped,
+        and the transaction is rolled back.
+        """
+        if pipeline:
+            return self._pipeline(sql_list, depth or self.config.get('PIPELINE_DEPTH', 100))
+        with self.cursor() as dbc:
             responses = []
             for sql in sql_list:
-                dbc.execute(sql)
+                started = time.time()
+                try:
+                    dbc.execute(sql)
+                except Exception as e:
+                    self._trace(sql, started, label=getattr(sql, 'label', None), error=e)
+                    raise
                 responses.append(dbc.fetchall())
+                self._trace(sql, started, dbc.rowcount, label=getattr(sql, 'label', None))
             return responses
 
+    def _pipeline(self, sql_list, depth):
+        """Send the statements depth at a time, stop at the first failed send"""
+        results = []
+        for i in range(0, len(sql_list), depth):
+            results += self.send_pipeline(sql_list[i:i + depth], results)
+            if not results[-1].ok:
+                break
+        if any(not x.ok for x in results):
+            self.rollback()
+            skipped = StatementSkipped('Not run, an earlier statement of the batch failed')
+            results += [StatementResult(sql, error=skipped) for sql in sql_list[len(results):]]
+        return results
+
+    def send_pipeline(self, sql_list, previous=()):
+        """Run statements of a pipelined batch, previous are the results of those already sent.
+        Return the result of each statement up to the first failed one.
+        Dialects without a way to pipeline statements send them one at a time.
+        """
+        results = []
+        with self.cursor() as dbc:
+            for sql in sql_list:
+                started = time.time()
+                try:
+                    dbc.execute(sql)
+                    results.append(StatementResult(sql, dbc.fetchall() if dbc.description else None, dbc.rowcount))
+                except Exception as e:
+                    results.append(StatementResult(sql, error=e))
+                self._trace_pipeline(results[-1:], started)
+                if results[-1].error:
+                    break
+        return results
+
+    def _trace_pipeline(self, results, started):
+        """Trace statements sent in one round trip, sharing its time"""
+        if not results:
+            return
+        if self.profiler:
+            self.profiler.wait(time.time() - started)
+        if not self.tracer:
+            return
+        duration = (time.time() - started) / len(results)
+        for i, result in enumerate(results):
+            self.tracer.record(result.sql, duration, result.rowcount, round_trips=1 if i == 0 else 0,
+                               label=getattr(result.sql, 'label', None), error=result.error)
+
+    def stream(self, sql, batch_size=1000):
+        """Yield the rows of a query batch_size at a time, without holding the whole result"""
+        label = getattr(sql, 'label', None)
+        with self.stream_cursor() as dbc:
+            started = time.time()
+            dbc.execute(sql)
+            rows = 0
+            # Only the time in the driver is traced, not the time the consumer holds each row
+            waited = time.time() - started
+            while True:
+                fetch_start = time.time()
+                batch = dbc.fetchmany(batch_size)
+                waited += time.time() - fetch_start
+                if not batch:
+                    break
+                rows += len(batch)
+                for row in batch:
+                    yield row
+            self._trace(sql, time.time() - waited, rows, label=label)
+
     @property
     def tables(self):
         """Get a list of non-system database table names"""
         result = self.execute(self.commands.get_tables(self.name))
         return [x[0] for x in result]
 
+    @property
+    def is_local(self):
+        """True when the server runs on this host, so its paths are paths of this host"""
+        return False
+
+    @staticmethod
+    def _local_host(host):
+        """True for an empty host, a unix socket path or a loopback address"""
+        return not host or host.startswith('/') or host in LOCAL_HOSTS
+
+    @property
+    def free_disk_bytes(self):
+        """Free bytes on the volume holding the data directory,
+        None when it cannot be read or the server is not on this host
+        """
+        if not self.is_local:
+            # The same path on this host is another volume, or nothing
+            return None
+        ans = self.execute(self.commands.data_directory())
+        path = ans[0][0] if ans else None
+        if not path or not os.path.exists(path):
+            return None
+        return shutil.disk_usage(path).free
+
     def table_exists(self, table_name):
         """Check if table exists in database"""
         return table_name in self.tables
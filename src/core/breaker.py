@@ -0,0 +1,85 @@
+"""Latency circuit breaker protecting the application while a migration runs"""
+import time
+from collections import deque
+from src.core.control import MigrationAborted
+
+
+class MigrationDetached(MigrationAborted):
+    """Raised when the circuit breaker dropped the capture triggers, the migration needs a resync"""
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Watches application latency against an SLO between chunks.
+    latency is a callable returning the current latency in seconds, e.g. the p99 of the application,
+    by default the time of a probe query on the source table.
+
+    While the median of the last window samples is over slo the copy pauses. Once it has stayed
+    over for detach_after seconds the capture triggers are dropped, so source writes stop paying
+    for them, and the migration raises MigrationDetached. Its checkpoint is marked as needing
+    a resync, which the next copy_in_chunks runs, re-copying every chunk with the triggers back on.
+    """
+
+    def __init__(self, slo, latency=None, window=3, detach_after=30, poll_interval=1.0, clock=None, sleep=None):
+        """Initialize the breaker, slo and detach_after in seconds"""
+        self.slo = slo
+        self.latency = latency
+        self.detach_after = detach_after
+        self.poll_interval = poll_interval
+        self.samples = deque(maxlen=window)
+        self.clock = clock or time.monotonic
+        self.sleep = sleep or time.sleep
+        self.breached_since = None
+        self.pauses = 0
+        self.detached = False
+
+    def sample(self, table):
+        """Read one latency sample"""
+        if self.latency:
+            value = self.latency()
+        else:
+            probe_start = time.time()
+            table.max_pk
+            value = time.time() - probe_start
+        self.samples.append(value)
+        return value
+
+    @property
+    def breached(self):
+        ordered = sorted(self.samples)
+        return bool(ordered) and ordered[len(ordered) // 2] > self.slo
+
+    def wait(self, migration, checkpoint=None):
+        """Called between chunks of migration: pause while the SLO is breached,
+        detach the capture triggers when it stays breached for detach_after seconds.
+        Once detached, every worker stops at its next chunk, not only the one that detached
+        """
+        if self.detached:
+            raise MigrationDetached('Capture triggers of {} were dropped, the copy needs a resync'.format(
+                migration.source.name))
+        self.sample(migration.source)
+        if self.breached:
+            self.pauses += 1
+        while self.breached:
+            now = self.clock()
+            self.breached_since = self.breached_since if self.breached_since is not None else now
+            if now - self.breached_since >= self.detach_after:
+                self.detach(migration, checkpoint)
+            self.sleep(self.poll_interval)
+            self.sample(migration.source)
+        self.breached_since = None
+
+    def detach(self, migration, checkpoint=None):
+        """Drop the capture triggers and mark the migration as needing a resync"""
+        migration.delete_triggers()
+        migration.commit()
+        migration.needs_resync = True
+        if checkpoint:
+            # Every chunk copied so far can go stale from here on
+            checkpoint.needs_resync = True
+            checkpoint.completed = set()
+            checkpoint.save()
+        self.detached = True
+        raise MigrationDetached('Latency of {} stayed over {}s for {}s, capture triggers dropped'.format(
+            migration.source.name, self.slo, self.detach_after))
@@ -0,0 +1,280 @@
+"""Chunk boundary planning for copies"""
+import json
+import math
+import os
+from bisect import bisect_right
+from collections import namedtuple
+
+
+class ChunkRange(namedtuple('ChunkRange', ['start', 'end', 'partition'])):
+    """
+    Primary key range [start, end) copied as one chunk, from one partition when partition is set.
+    A start of None is unbounded below, an end of None is unbounded above,
+    so a plan always covers rows inserted past either end while it runs.
+    """
+    __slots__ = ()
+
+    def __new__(cls, start, end, partition=None):
+        return super(ChunkRange, cls).__new__(cls, start, end, partition)
+
+    @property
+    def key(self):
+        return json.dumps([self.start, self.end, self.partition] if self.partition else [self.start, self.end])
+
+
+class ChunkPlanner(object):
+    """
+    Computes every chunk boundary of a table in advance.
+    scan walks the pk index once with a window function and gives exact chunk sizes,
+    stats reads the planner's histogram of the pk and sample reads a sample of pks,
+    neither of which scans the table, at the cost of approximate chunk sizes.
+
+    With a PlanGuard, a scan whose pk seek plans as a full table scan is refused,
+    and auto samples instead of scanning.
+    """
+
+    METHODS = ('auto', 'scan', 'stats', 'sample')
+
+    def __init__(self, table, chunk_size, partition=None, guard=None):
+        """Initialize the planner for the source table, or one of its partitions"""
+        self.table = table
+        self.chunk_size = chunk_size
+        self.partition = partition
+        self.guard = guard
+
+    @property
+    def commands(self):
+        return self.table.commands
+
+    @property
+    def relation(self):
+        """The table or partition the boundaries are read from"""
+        if self.partition:
+            return self.commands.partition_relation(self.table.name, self.partition)
+        return self.table.name
+
+    def plan(self, method='auto', start=None, limit=None):
+        """Return the list of ChunkRange covering the pks from start to limit inclusive.
+        auto uses the statistics when there are any, and scans otherwise.
+        """
+        if method not in self.METHODS:
+            raise ValueError('Unknown chunking method {}, expected one of {}'.format(method, ', '.join(self.METHODS)))
+        stop = self.pk_after(limit) if limit is not None else None
+        if method == 'auto':
+            boundaries = self.stats(start, stop)
+            if not boundaries:
+                boundaries = self.scan(start, stop) if self.indexed(start) else self.sample(start, stop)
+        else:
+            if method == 'scan':
+                self.indexed(start, strict=True)
+            boundaries = getattr(self, method)(start, stop)
+        return self.ranges(boundaries, start, stop, self.partition)
+
+    def split(self, span):
+        """Plan the chunks inside one range, scanning only that range"""
+        return self.ranges(self.scan(span.start, span.end), span.start, span.end, span.partition)
+
+    def halve(self, span):
+        """Split one range in two at its middle pk, [span] when it holds a single row"""
+        ans = self.table.execute(self.commands.count_range(
+            self.relation, self.table.primary_key_column, span.start, span.end))
+        rows = ans[0][0]
+        if rows < 2:
+            return [span]
+        return ChunkPlanner(self.table, int(math.ceil(rows / 2.0)), self.partition).split(span)
+
+    @staticmethod
+    def ranges(boundaries, start=None, stop=None, partition=None):
+        """Turn sorted boundaries into consecutive ranges from start to stop"""
+        points = [start]
+        for boundary in boundaries:
+            if (start is None or boundary > start) and (stop is None or boundary < stop) \
+                    and (points[-1] is None or boundary > points[-1]):
+                points.append(boundary)
+        points.append(stop)
+        return [ChunkRange(points[i], points[i + 1], partition) for i in range(len(points) - 1)]
+
+    def indexed(self, start=None, strict=False):
+        """False if the guard finds the pk seek plans as a full scan, raises UnsafePlan instead when strict"""
+        if not self.guard:
+            return True
+        probe = start if start is not None else self.table.min_pk
+        if probe is None:
+            return True
+        sql = self.commands.seek_pk(self.relation, self.table.primary_key_column, probe)
+        return self.guard.check('seek_pk {}'.format(self.relation), sql, [self.table.name, self.partition],
+                                strict=strict)
+
+    def pk_after(self, pk):
+        """Return the first pk greater than pk, None if there is none"""
+        ans = self.table.execute(self.commands.seek_pk(self.relation, self.table.primary_key_column, pk))
+        return ans[0][0] if ans else None
+
+    def scan(self, start=None, stop=None):
+        """Exact boundaries from one pass over the pk index, the first pk of every chunk_size rows"""
+        ans = self.table.execute(self.commands.chunk_boundaries(
+            self.relation,
+            self.table.primary_key_column,
+            self.chunk_size,
+            start,
+            stop
+        ))
+        return [x[0] for x in ans][1:]
+
+    def stats(self, start=None, stop=None):
+        """Boundaries interpolated from the pk histogram of the table statistics, [] without statistics"""
+        bounds = self.table.pk_histogram
+        if len(bounds) < 2:
+            return []
+        return self._between(bounds, start, stop)
+
+    def sample(self, start=None, stop=None):
+        """Boundaries from the quantiles of a sample of pks,
+        or an even split of the pk span where the dialect cannot sample without scanning
+        """
+        sample = self.table.pk_sample(max(self._chunk_count() * 10, 100))
+        if len(sample) < 2:
+            sample = [self.table.min_pk, self.table.max_pk]
+            if None in sample:
+                return []
+        return self._between(sample, start, stop)
+
+    def _between(self, bounds, start, stop):
+        """Boundaries of the part of the equal population bounds from start to stop,
+        in chunks of that part's share of the estimated rows
+        """
+        bounds = sorted(bounds)
+        low = self.position(bounds, start) if start is not None else 0.0
+        high = self.position(bounds, stop) if stop is not None else float(len(bounds) - 1)
+        if high <= low:
+            return []
+        share = (high - low) / (len(bounds) - 1)
+        return self.quantiles(bounds, self._chunk_count(share), low, high)
+
+    def _chunk_count(self, share=1.0):
+        """Number of chunks the estimated row count, or share of it, splits into"""
+        rows = self.table.size_estimate[1] * share
+        return max(int(math.ceil(rows / float(self.chunk_size))), 1)
+
+    @staticmethod
+    def position(bounds, value):
+        """Fractional index of value among sorted bounds, interpolating between numeric bounds
+        and clipped to their ends
+        """
+        i = bisect_right(bounds, value)
+        if i == 0:
+            return 0.0
+        if i == len(bounds):
+            return float(len(bounds) - 1)
+        low, high = bounds[i - 1], bounds[i]
+        if isinstance(low, (int, float)) and isinstance(high, (int, float)) and high > low:
+            return i - 1 + (value - low) / float(high - low)
+        return float(i - 1)
+
+    @staticmethod
+    def quantiles(bounds, chunks, low=0.0, high=None):
+        """Split sorted equal population bounds into chunks boundaries,
+        between the positions low and high of the bounds, interpolating between numeric bounds
+        """
+        bounds = sorted(bounds)
+        high = float(len(bounds) - 1) if high is None else high
+        boundaries = []
+        for i in range(1, chunks):
+            position = low + i * (high - low) / float(chunks)
+            low_bound = bounds[int(math.floor(position))]
+            high_bound = bounds[int(math.ceil(position))]
+            if isinstance(low_bound, (int, float)) and isinstance(high_bound, (int, float)):
+                value = low_bound + (high_bound - low_bound) * (position - math.floor(position))
+                boundary = int(math.ceil(value)) if isinstance(low_bound, int) and isinstance(high_bound, int) \
+                    else value
+            else:
+                boundary = low_bound
+            if not boundaries or boundary > boundaries[-1]:
+                boundaries.append(boundary)
+        return boundaries
+
+
+def merge_ranges(ranges):
+    """Merge consecutive ranges of the same partition into the spans they cover"""
+    spans = []
+    for chunk in ranges:
+        if spans and spans[-1].partition == chunk.partition and spans[-1].end is not None \
+                and spans[-1].end == chunk.start:
+            spans[-1] = ChunkRange(spans[-1].start, chunk.end, chunk.partition)
+        else:
+            spans.append(chunk)
+    return spans
+
+
+class Checkpoint(object):
+    """
+    Chunk plan and completed chunks of a copy, persisted as json after every chunk.
+    A restarted copy reuses the stored plan and skips the completed chunks.
+    skipped holds the pks a SKIP LOCKED copy left for its catch-up pass,
+    needs_resync is set when the capture triggers were dropped part way.
+    """
+
+    def __init__(self, path):
+        """Load the checkpoint from path if it exists"""
+        self.path = path
+        self.ranges = []
+        self.completed = set()
+        self.skipped = set()
+        self.needs_resync = False
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.ranges = [ChunkRange(*r) for r in state.get('ranges', [])]
+            self.completed = set(state.get('completed', []))
+            self.skipped = set(state.get('skipped', []))
+            self.needs_resync = state.get('needs_resync', False)
+
+    def start(self, ranges):
+        """Store the plan, keeping the completed chunks of a previous run of the same plan"""
+        if [r.key for r in ranges] != [r.key for r in self.ranges]:
+            self.completed = set()
+            self.skipped = set()
+        self.ranges = list(ranges)
+        self.save()
+        return self.ranges
+
+    def replan(self, replaced, ranges):
+        """Swap the replaced pending ranges for their new plan, keeping everything else"""
+        replaced = set(r.key for r in replaced)
+        self.ranges = [r for r in self.ranges if r.key not in replaced] + list(ranges)
+        self.save()
+
+    def is_done(self, chunk):
+        return chunk.key in self.completed
+
+    def mark(self, chunk, skipped=()):
+        """Record the chunk as copied, but for the skipped pks"""
+        self.completed.add(chunk.key)
+        self.skipped.update(skipped)
+        self.save()
+
+    def resolve(self, pks):
+        """Record skipped pks as copied by a catch-up pass"""
+        self.skipped.difference_update(pks)
+        self.save()
+
+    @property
+    def remaining(self):
+        return [r for r in self.ranges if not self.is_done(r)]
+
+    def save(self):
+        """Write the checkpoint atomically"""
+        temp = '{}.tmp'.format(self.path)
+        with open(temp, 'w') as f:
+            json.dump({'ranges': [list(r) for r in self.ranges], 'completed': sorted(self.completed),
+                       'skipped': sorted(self.skipped), 'needs_resync': self.needs_resync}, f, default=str)
+        os.replace(temp, self.path)
+
+    def clear(self):
+        """Remove the checkpoint once the copy is complete"""
+        self.ranges = []
+        self.completed = set()
+        self.skipped = set()
+        self.needs_resync = False
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -80,3 +80,24 @@ class Index(object):
     def __repr__(self):
         """String representation"""
         return 'Index {}: {}'.format(self.name, self.column)
+
+
+class Partition(object):
+    """Represents a declarative partition of a table"""
+    def __init__(self, table_name, name, bound, rows=0):
+        """Set the initial data"""
+        self.table = table_name
+        self.name = name
+        self.bound = bound
+        self.rows = rows
+
+    def __eq__(self, other):
+        """Partitions are equal when they hold the same values"""
+        return self.bound == other.bound
+
+    def __hash__(self):
+        return hash(self.bound)
+
+    def __repr__(self):
+        """String representation"""
+        return 'Partition {}: {}'.format(self.name, self.bound)
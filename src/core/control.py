@@ -0,0 +1,181 @@
+"""Runtime control of a running migration through a control file or a Unix socket"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+
+class MigrationAborted(Exception):
+    """Raised between chunks when a migration is aborted through its control channel"""
+    pass
+
+
+class Controller(object):
+    """
+    Control channel checked by the copy between chunks.
+    Commands are lines of text, from a control file that is consumed when read,
+    or from a Unix socket that answers every command with the status as json:
+
+        pause | resume | abort | status
+        chunk_size <rows> | throttle <seconds> | workers <count>
+
+    Changes apply from the next chunk, an abort stops the copy at a chunk boundary
+    with every completed chunk recorded in its checkpoint.
+    """
+
+    def __init__(self, control_file=None, socket_path=None, poll_interval=0.5):
+        """Initialize the channel, call serve to listen on socket_path"""
+        self.control_file = control_file
+        self.socket_path = socket_path
+        self.poll_interval = poll_interval
+        self.paused = False
+        self.aborted = False
+        self.chunk_size = None
+        self.throttle = None
+        self.workers = None
+        self.progress = None
+        self._lock = threading.RLock()
+        self._server = None
+
+    def attach(self, progress, chunk_size, throttle, workers):
+        """Start reporting on progress, with the settings the copy starts from"""
+        with self._lock:
+            self.progress = progress
+            self.chunk_size = self.chunk_size or chunk_size
+            self.throttle = self.throttle if self.throttle is not None else throttle
+            self.workers = self.workers or workers
+
+    def handle(self, line):
+        """Apply one command, return the status, with an error for a command it cannot apply"""
+        parts = line.strip().split()
+        if not parts:
+            return self.status()
+        command, args = parts[0].lower(), parts[1:]
+        with self._lock:
+            try:
+                if command == 'pause':
+                    self.paused = True
+                elif command == 'resume':
+                    self.paused = False
+                elif command == 'abort':
+                    self.aborted = True
+                elif command == 'chunk_size' and args:
+                    self.chunk_size = max(int(args[0]), 1)
+                elif command == 'throttle' and args:
+                    self.throttle = max(float(args[0]), 0.0)
+                elif command == 'workers' and args:
+                    self.workers = max(int(args[0]), 1)
+                elif command != 'status':
+                    return dict(self.status(), error='Unknown command {}'.format(line.strip()))
+            except ValueError:
+                # A typo must not stop the copy it is meant to steer
+                return dict(self.status(), error='Invalid value in {}'.format(line.strip()))
+        return self.status()
+
+    def status(self):
+        """Return the settings and progress of the migration"""
+        status = {
+            'paused': self.paused,
+            'aborted': self.aborted,
+            'chunk_size': self.chunk_size,
+            'throttle': self.throttle,
+            'workers': self.workers,
+        }
+        if self.progress:
+            status.update({
+                'table': self.progress.table_name,
+                'phase': self.progress.current_phase,
+                'done': self.progress.done,
+                'total': self.progress.total,
+                'rate': self.progress.rate,
+                'eta': self.progress.eta,
+            })
+        return status
+
+    def poll(self):
+        """Apply the commands waiting in the control file, then write the status next to it"""
+        if not self.control_file:
+            return
+        if os.path.exists(self.control_file):
+            consumed = '{}.{}'.format(self.control_file, os.getpid())
+            os.replace(self.control_file, consumed)
+            with open(consumed) as f:
+                for line in f:
+                    status = self.handle(line)
+                    if 'error' in status:
+                        print('Control: {}'.format(status['error']))
+            os.remove(consumed)
+        temp = '{}.status.tmp'.format(self.control_file)
+        with open(temp, 'w') as f:
+            json.dump(self.status(), f, default=str)
+        os.replace(temp, '{}.status'.format(self.control_file))
+
+    def wait(self):
+        """Called between chunks: apply commands, block while paused, raise MigrationAborted on abort"""
+        self.poll()
+        while self.paused and not self.aborted:
+            time.sleep(self.poll_interval)
+            self.poll()
+        if self.aborted:
+            raise MigrationAborted('Migration of {} aborted through its control channel'.format(
+                self.progress.table_name if self.progress else 'table'))
+
+    def serve(self):
+        """Listen for commands on the Unix socket in a daemon thread"""
+        controller = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    response = controller.handle(line.decode())
+                    self.wfile.write((json.dumps(response, default=str) + '\n').encode())
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+        return self.socket_path
+
+    def stop(self):
+        """Stop listening on the socket"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def send(socket_path, command, timeout=5.0):
+    """Send one command to a running migration, return its status"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(socket_path)
+        client.sendall((command.strip() + '\n').encode())
+        response = b''
+        while not response.endswith(b'\n'):
+            data = client.recv(4096)
+            if not data:
+                break
+            response += data
+        return json.loads(response.decode())
+    finally:
+        client.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Control a running migration')
+    parser.add_argument('socket', help='Control socket of the migration')
+    parser.add_argument('command', nargs='+', help='pause, resume, abort, status, chunk_size N, throttle S or workers N')
+    args = parser.parse_args(argv)
+    print(json.dumps(send(args.socket, ' '.join(args.command)), indent=2, default=str))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Query plan guard for chunk statements"""
+import threading
+
+
+class UnsafePlan(Exception):
+    """Raised when a chunk statement plans as a full scan of the table it should seek into"""
+    pass
+
+
+class PlanGuard(object):
+    """
+    Explains chunk statements before they run, on the first of each kind and every interval after,
+    since plans change with the statistics. A statement reading a guarded relation with a full scan
+    instead of the key index turns a chunk of milliseconds into one of minutes.
+
+    Tables of fewer than min_rows estimated rows are not guarded,
+    the planner rightly scans small tables whatever the statement.
+    """
+
+    def __init__(self, table, interval=100, min_rows=0):
+        """Initialize the guard for the statements reading table"""
+        self.table = table
+        self.interval = interval
+        self.min_rows = min_rows
+        self.counts = {}
+        self.checks = []
+        self.guarded = not min_rows or (table.size_estimate[1] or 0) >= min_rows
+        self._lock = threading.Lock()
+
+    def due(self, label):
+        """True for the first statement of label and every interval after"""
+        with self._lock:
+            count = self.counts.get(label, 0)
+            self.counts[label] = count + 1
+        return count == 0 or (self.interval > 0 and count % self.interval == 0)
+
+    def check(self, label, sql, relations, db=None, strict=True):
+        """Explain sql when due, return False if it fully scans one of relations.
+        Raises UnsafePlan instead when strict.
+        """
+        if not self.guarded or not self.due(label):
+            return True
+        scanned = [x for x in self.table.full_scans(sql, db) if x in relations]
+        with self._lock:
+            self.checks.append({'label': label, 'scanned': scanned})
+        if scanned and strict:
+            raise UnsafePlan('{} plans as a full scan of {}, check the index on {} and the type of the bounds'.format(
+                label, ', '.join(scanned), self.table.primary_key_column))
+        return not scanned
@@ -0,0 +1,220 @@
+"""Metric primitives and exporters for migration progress"""
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+# Chunk latency buckets in seconds, roughly exponential from 5ms to 10 minutes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class Ewma(object):
+    """Exponentially weighted moving average"""
+
+    def __init__(self, alpha=0.3):
+        """Alpha is the weight given to the newest observation"""
+        if not 0 < alpha <= 1:
+            raise ValueError('Alpha must be in (0, 1], got {}'.format(alpha))
+        self.alpha = alpha
+        self.value = None
+
+    def update(self, observation):
+        """Fold an observation into the average, return the new value"""
+        if self.value is None:
+            self.value = float(observation)
+        else:
+            self.value = self.alpha * observation + (1 - self.alpha) * self.value
+        return self.value
+
+
+class Histogram(object):
+    """
+    Fixed bucket histogram, in the same shape Prometheus uses.
+    Quantiles are interpolated within buckets, so memory stays bounded
+    no matter how many chunks are observed.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """Initialize empty buckets"""
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """Record a single observation"""
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate the q quantile (0 <= q <= 1), None if nothing was observed"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, bucket_count in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.max
+            if bucket_count and seen + bucket_count >= rank:
+                fraction = (rank - seen) / float(bucket_count)
+                return min(lower + (upper - lower) * fraction, self.max)
+            seen += bucket_count
+            lower = upper
+        return self.max
+
+    @property
+    def p50(self):
+        return self.quantile(0.5)
+
+    @property
+    def p99(self):
+        return self.quantile(0.99)
+
+    def cumulative(self):
+        """Return (upper bound, cumulative count) pairs, ending with +Inf"""
+        total = 0
+        pairs = []
+        for i, bucket_count in enumerate(self.counts):
+            total += bucket_count
+            bound = self.buckets[i] if i < len(self.buckets) else float('inf')
+            pairs.append((bound, total))
+        return pairs
+
+
+class PrometheusExporter(object):
+    """
+    Renders Progress objects in the Prometheus text exposition format.
+    Register it as a progress listener to rewrite a textfile collector file
+    on every event, and/or call serve() to expose /metrics on a local port.
+    """
+
+    def __init__(self, path=None, port=None, host='127.0.0.1', prefix='sooty'):
+        """Set the output file and/or port"""
+        self.path = path
+        self.port = port
+        self.host = host
+        self.prefix = prefix
+        self.progresses = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    def watch(self, progress):
+        """Export the given progress object, and listen to its events"""
+        if progress not in self.progresses:
+            self.progresses.append(progress)
+            progress.add_listener(self)
+        return self
+
+    def __call__(self, event):
+        """Progress listener, rewrites the metrics file"""
+        if self.path:
+            self.write()
+
+    def write(self):
+        """Atomically write the metrics file"""
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.rename(tmp_path, self.path)
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def _labels(self, **labels):
+        return ','.join('{}="{}"'.format(k, self._escape(v)) for k, v in sorted(labels.items()))
+
+    def _line(self, name, value, **labels):
+        return '{}_{}{{{}}} {}'.format(self.prefix, name, self._labels(**labels), self._format(value))
+
+    @staticmethod
+    def _format(value):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(float(value))
+
+    def render(self):
+        """Return the text exposition of all watched progress objects"""
+        with self._lock:
+            lines = []
+            counters = (
+                ('rows_total', 'Rows processed', 'rows'),
+                ('bytes_total', 'Estimated bytes processed', 'bytes'),
+                ('throttle_seconds_total', 'Seconds spent throttling', 'throttle'),
+                ('chunks_total', 'Chunks processed', 'chunks'),
+            )
+            for name, help_text, attr in counters:
+                lines.append('# HELP {}_{} {}'.format(self.prefix, name, help_text))
+                lines.append('# TYPE {}_{} counter'.format(self.prefix, name))
+                for progress in self.progresses:
+                    for phase, value in sorted(getattr(progress, attr).items()):
+                        lines.append(self._line(name, value, table=progress.table_name, phase=phase))
+
+            lines.append('# HELP {}_chunk_latency_seconds Chunk statement latency'.format(self.prefix))
+            lines.append('# TYPE {}_chunk_latency_seconds histogram'.format(self.prefix))
+            for progress in self.progresses:
+                for phase, histogram in sorted(progress.histograms.items()):
+                    labels = {'table': progress.table_name, 'phase': phase}
+                    for bound, count in histogram.cumulative():
+                        lines.append(self._line('chunk_latency_seconds_bucket', count,
+                                                le=self._format(bound), **labels))
+                    lines.append(self._line('chunk_latency_seconds_sum', histogram.sum, **labels))
+                    lines.append(self._line('chunk_latency_seconds_count', histogram.count, **labels))
+
+            gauges = (
+                ('rows_per_second', 'Smoothed throughput', 'rate'),
+                ('eta_seconds', 'Estimated seconds remaining', 'eta'),
+                ('progress_ratio', 'Fraction of expected rows processed', 'ratio'),
+            )
+            for name, help_text, attr in gauges:
+                lines.append('# HELP {}_{} {}'.format(self.prefix, name, help_text))
+                lines.append('# TYPE {}_{} gauge'.format(self.prefix, name))
+                for progress in self.progresses:
+                    value = getattr(progress, attr)
+                    if value is not None:
+                        lines.append(self._line(name, value, table=progress.table_name))
+
+            lines.append('# HELP {}_phase_active Phase currently running'.format(self.prefix))
+            lines.append('# TYPE {}_phase_active gauge'.format(self.prefix))
+            for progress in self.progresses:
+                if progress.current_phase:
+                    lines.append(self._line('phase_active', 1, table=progress.table_name,
+                                            phase=progress.current_phase))
+            return '\n'.join(lines) + '\n'
+
+    def serve(self):
+        """Serve /metrics on host:port from a daemon thread"""
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = exporter.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = HTTPServer((self.host, self.port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self._server.server_address
+
+    def stop(self):
+        """Stop the http server"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,102 @@
+"""Dry-run cost estimates for migrations"""
+import json
+import math
+
+
+class MigrationPlan(object):
+    """
+    Machine-readable estimate of what a migration will cost.
+    Sizes are in bytes and durations in seconds.
+    """
+
+    def __init__(self, table, dialect, chunk_size, throttle):
+        """Initialize an empty plan"""
+        self.table = table
+        self.dialect = dialect
+        self.chunk_size = chunk_size
+        self.throttle = throttle
+        self.estimated_rows = 0
+        self.table_bytes = 0
+        self.index_bytes = 0
+        self.index_count = 0
+        self.min_pk = None
+        self.max_pk = None
+        self.samples = []
+        self.locking_steps = []
+        self.log_name = None
+
+    @property
+    def pk_density(self):
+        """Rows per primary key value, 1.0 for a table without gaps"""
+        try:
+            span = self.max_pk - self.min_pk + 1
+        except TypeError:
+            return None
+        return min(self.estimated_rows / float(span), 1.0) if span > 0 else None
+
+    @property
+    def chunks(self):
+        """Number of chunks the copy will take"""
+        return int(math.ceil(self.estimated_rows / float(self.chunk_size))) if self.chunk_size else 0
+
+    @property
+    def chunk_seconds(self):
+        """Mean seconds per sampled chunk, scaled to a full chunk"""
+        timed = [s for s in self.samples if s['rows']]
+        if not timed:
+            return None
+        return sum(s['seconds'] * self.chunk_size / float(s['rows']) for s in timed) / len(timed)
+
+    @property
+    def copy_seconds(self):
+        """Expected duration of the copy phase, including throttling"""
+        if self.chunk_seconds is None:
+            return None
+        return self.chunks * (self.chunk_seconds + self.throttle)
+
+    @property
+    def extra_disk_bytes(self):
+        """Space needed for the migrate_ copy of the data and its indexes"""
+        return self.table_bytes + self.index_bytes
+
+    @property
+    def log_bytes(self):
+        """Expected WAL/binlog volume, every copied row and index entry is logged once"""
+        return self.table_bytes + self.index_bytes
+
+    def fits(self, window_seconds):
+        """True if the copy is expected to finish inside the window"""
+        return self.copy_seconds is not None and self.copy_seconds <= window_seconds
+
+    def as_dict(self):
+        """Return the plan as a dictionary"""
+        return {
+            'table': self.table,
+            'dialect': self.dialect,
+            'chunk_size': self.chunk_size,
+            'throttle': self.throttle,
+            'estimated_rows': self.estimated_rows,
+            'table_bytes': self.table_bytes,
+            'index_bytes': self.index_bytes,
+            'index_count': self.index_count,
+            'min_pk': self.min_pk,
+            'max_pk': self.max_pk,
+            'pk_density': self.pk_density,
+            'chunks': self.chunks,
+            'samples': self.samples,
+            'chunk_seconds': self.chunk_seconds,
+            'copy_seconds': self.copy_seconds,
+            'extra_disk_bytes': self.extra_disk_bytes,
+            'log_name': self.log_name,
+            'log_bytes': self.log_bytes,
+            'locking_steps': self.locking_steps,
+        }
+
+    def to_json(self, **kwargs):
+        """Return the plan as json"""
+        return json.dumps(self.as_dict(), default=str, **kwargs)
+
+    def __repr__(self):
+        """String representation"""
+        return 'MigrationPlan {}: {} rows, {} chunks, ~{}s copy, {} extra bytes'.format(
+            self.table, self.estimated_rows, self.chunks, self.copy_seconds, self.extra_disk_bytes)
@@ -0,0 +1,131 @@
+"""Bounded connection pool for Database"""
+import queue
+import threading
+from contextlib import closing, contextmanager
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out in time"""
+    pass
+
+
+class ConnectionPool(object):
+    """
+    Bounded pool of connections made by a factory callable.
+    Each new connection runs the session setup statements (or callable) once,
+    and idle connections are health checked before they are handed out again.
+    """
+
+    def __init__(self, factory, size=4, session_setup=None, health_check='SELECT 1', timeout=None):
+        """Initialize an empty pool, connections are created on demand"""
+        self.factory = factory
+        self.size = size
+        self.session_setup = session_setup or []
+        self.health_check = health_check
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.created = 0
+        self.discarded = 0
+
+    @staticmethod
+    def _run(connection, sql):
+        with closing(connection.cursor()) as dbc:
+            dbc.execute(sql)
+            try:
+                return dbc.fetchall()
+            except Exception:
+                return None
+
+    def _connect(self):
+        """Open and set up a new connection"""
+        connection = self.factory()
+        if callable(self.session_setup):
+            self.session_setup(connection)
+        else:
+            for sql in self.session_setup:
+                self._run(connection, sql)
+            connection.commit()
+        with self._lock:
+            self.created += 1
+        return connection
+
+    def _healthy(self, connection):
+        """Return True if the connection still answers the health check"""
+        if not self.health_check:
+            return True
+        try:
+            self._run(connection, self.health_check)
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, connection):
+        with self._lock:
+            self.discarded += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def acquire(self, timeout=None):
+        """Check out a connection, blocking while all size connections are in use"""
+        timeout = timeout if timeout is not None else self.timeout
+        acquired = self._slots.acquire(True, timeout) if timeout is not None else self._slots.acquire()
+        if not acquired:
+            raise PoolTimeout('No connection available after {}s'.format(timeout))
+        try:
+            while True:
+                try:
+                    connection = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if self._healthy(connection):
+                    return connection
+                self._discard(connection)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, connection, discard=False):
+        """Return a connection, rolling back anything left uncommitted"""
+        try:
+            if not discard:
+                try:
+                    connection.rollback()
+                except Exception:
+                    discard = True
+            if discard:
+                self._discard(connection)
+            else:
+                self._idle.put(connection)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Check out a connection for the duration of the block"""
+        connection = self.acquire(timeout)
+        discard = False
+        try:
+            yield connection
+        except Exception:
+            discard = not self._healthy(connection)
+            raise
+        finally:
+            self.release(connection, discard)
+
+    @property
+    def idle(self):
+        """Number of idle connections"""
+        return self._idle.qsize()
+
+    def close(self):
+        """Close the idle connections"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,60 @@
+"""Pre-flight checks run before a migration starts"""
+import json
+
+
+class PreflightReport(object):
+    """
+    Problems found in the database before a migration starts.
+    A blocking finding will make the migration fail or lose changes, a warning may slow it down
+    or needs a look. Sizes are in bytes.
+    """
+
+    BLOCKING = 'blocking'
+    WARNING = 'warning'
+
+    def __init__(self, table, dialect):
+        """Initialize an empty report"""
+        self.table = table
+        self.dialect = dialect
+        self.findings = []
+        self.extra_disk_bytes = 0
+        self.log_bytes = 0
+        self.free_disk_bytes = None
+
+    def add(self, level, check, message, **detail):
+        """Record a finding of check"""
+        self.findings.append({'level': level, 'check': check, 'message': message, 'detail': detail})
+
+    @property
+    def blocking(self):
+        return [x for x in self.findings if x['level'] == self.BLOCKING]
+
+    @property
+    def warnings(self):
+        return [x for x in self.findings if x['level'] == self.WARNING]
+
+    @property
+    def ok(self):
+        """True if nothing blocks the migration"""
+        return not self.blocking
+
+    def as_dict(self):
+        """Return the report as a dictionary"""
+        return {
+            'table': self.table,
+            'dialect': self.dialect,
+            'ok': self.ok,
+            'extra_disk_bytes': self.extra_disk_bytes,
+            'log_bytes': self.log_bytes,
+            'free_disk_bytes': self.free_disk_bytes,
+            'findings': self.findings,
+        }
+
+    def to_json(self, **kwargs):
+        """Return the report as json"""
+        return json.dumps(self.as_dict(), default=str, **kwargs)
+
+    def __repr__(self):
+        """String representation"""
+        return 'PreflightReport {}: {} blocking, {} warnings'.format(
+            self.table, len(self.blocking), len(self.warnings))
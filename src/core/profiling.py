@@ -0,0 +1,212 @@
+"""Per phase client profiling: wall, database wait and CPU time, memory, and profiler dumps"""
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+def peak_rss():
+    """Peak resident set size of the process so far in bytes, None where it cannot be read"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StackSampler(object):
+    """
+    Sampling profiler of a set of threads, reading their stacks every interval seconds.
+    Stacks are kept folded, one 'outer;...;inner count' line per distinct stack,
+    the input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=0.005):
+        """Initialize the sampler, it runs while threads are watched"""
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.watched = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, thread_id):
+        """Sample thread_id until unwatch, starting the sampler thread if needed"""
+        with self._lock:
+            self.watched[thread_id] += 1
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self.run, daemon=True)
+                self._thread.start()
+
+    def unwatch(self, thread_id):
+        """Stop sampling thread_id, the sampler thread ends with the last watched thread"""
+        thread = None
+        with self._lock:
+            self.watched[thread_id] -= 1
+            if self.watched[thread_id] <= 0:
+                del self.watched[thread_id]
+            if not self.watched and self._thread is not None:
+                self._stop.set()
+                thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id in self.watched:
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        self.stacks[self.fold(frame)] += 1
+                        self.samples += 1
+
+    @staticmethod
+    def fold(frame):
+        """Folded stack of frame, outermost first"""
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def dump(self, path):
+        """Write the folded stacks to path"""
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('{} {}\n'.format(stack, count))
+
+
+class PhaseProfiler(object):
+    """
+    Accounts the client time of each section of a migration: setup, triggers, chunk, indexes,
+    foreign_keys, cutover, verify. For every section it records the wall time, the time spent
+    waiting on the database, the CPU time of the thread running it and of the whole process,
+    and the peak RSS of the process, so a slow migration can be told client bound from server bound.
+    Chunks copied by worker threads are accounted on their own threads.
+
+    With profile set to a section name, every run of that section is profiled into path,
+    as cProfile stats readable with pstats, or as folded stacks with sampler.
+    """
+
+    def __init__(self, profile=None, path=None, sampler=False, interval=0.005):
+        """Initialize empty accounts"""
+        self.profile = profile
+        self.path = path or ('{}.{}'.format(profile, 'folded' if sampler else 'pstats') if profile else None)
+        self.stats = {}
+        self.profiler = None
+        self.sampler = None
+        if profile:
+            self.sampler = StackSampler(interval) if sampler else None
+            self.profiler = None if sampler else cProfile.Profile()
+        self._profiling = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def section(self, name):
+        """Account the block as a run of section name"""
+        account = {'wait': 0.0}
+        self._stack.append(account)
+        profiled = name == self.profile and self._start_profile()
+        rss = peak_rss()
+        wall, cpu, process_cpu = time.perf_counter(), time.thread_time(), time.process_time()
+        try:
+            yield account
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            process_cpu = time.process_time() - process_cpu
+            if profiled:
+                self._stop_profile()
+            # Sections nest within a thread, this one is the innermost
+            self._stack.pop()
+            self.record(name, wall, account['wait'], cpu, process_cpu, rss, peak_rss())
+
+    def _start_profile(self):
+        """Profile the current thread, False when another thread already runs cProfile"""
+        if self.sampler:
+            self.sampler.watch(threading.get_ident())
+            return True
+        with self._lock:
+            if self._profiling is not None:
+                return False
+            self._profiling = threading.get_ident()
+        self.profiler.enable()
+        return True
+
+    def _stop_profile(self):
+        if self.sampler:
+            self.sampler.unwatch(threading.get_ident())
+            return
+        self.profiler.disable()
+        with self._lock:
+            self._profiling = None
+
+    def wait(self, seconds):
+        """Account seconds spent waiting on the database to the open sections of this thread"""
+        for account in self._stack:
+            account['wait'] += seconds
+
+    def record(self, name, wall, wait, cpu, process_cpu, rss_before=None, rss_after=None):
+        """Add a run of section name"""
+        with self._lock:
+            stat = self.stats.setdefault(name, {
+                'runs': 0,
+                'wall': 0.0,
+                'db_wait': 0.0,
+                'cpu': 0.0,
+                'process_cpu': 0.0,
+                'max_wall': 0.0,
+                'peak_rss': None,
+                'rss_growth': 0,
+            })
+            stat['runs'] += 1
+            stat['wall'] += wall
+            stat['db_wait'] += min(wait, wall)
+            stat['cpu'] += cpu
+            stat['process_cpu'] += process_cpu
+            stat['max_wall'] = max(stat['max_wall'], wall)
+            if rss_after is not None:
+                stat['peak_rss'] = max(stat['peak_rss'] or 0, rss_after)
+                stat['rss_growth'] += rss_after - rss_before
+
+    def summary(self):
+        """Return the accounts of each section, with the client time, wall time not spent on the database,
+        and the fraction of the wall time spent on the database
+        """
+        with self._lock:
+            sections = dict((name, dict(stat)) for name, stat in self.stats.items())
+        for stat in sections.values():
+            stat['client'] = stat['wall'] - stat['db_wait']
+            stat['db_ratio'] = stat['db_wait'] / stat['wall'] if stat['wall'] else None
+        return sections
+
+    def dump(self, path=None):
+        """Write the profile of the profiled section, return its path, None when nothing was profiled"""
+        path = path or self.path
+        if self.sampler and self.sampler.samples:
+            self.sampler.dump(path)
+            return path
+        if self.profiler and self.profile in self.stats:
+            self.profiler.dump_stats(path)
+            return path
+        return None
@@ -0,0 +1,176 @@
+"""Structured progress events for migration phases"""
+import datetime
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from src.core.metrics import Ewma, Histogram
+
+
+class ProgressEvent(object):
+    """A single progress event, delivered to every registered listener"""
+
+    PHASE_START = 'phase_start'
+    PHASE_END = 'phase_end'
+    CHUNK = 'chunk'
+
+    def __init__(self, kind, table, phase, rows=0, bytes=0, latency=0.0, throttle=0.0,
+                 position=None, done=0, total=None, rate=None, eta=None):
+        """Set the event data"""
+        self.kind = kind
+        self.table = table
+        self.phase = phase
+        self.rows = rows
+        self.bytes = bytes
+        self.latency = latency
+        self.throttle = throttle
+        self.position = position
+        self.done = done
+        self.total = total
+        self.rate = rate
+        self.eta = eta
+        self.timestamp = time.time()
+
+    def as_dict(self):
+        """Return the event as a plain dictionary"""
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        """String representation"""
+        return 'ProgressEvent {} {}.{}: {} rows in {:.3f}s'.format(
+            self.kind, self.table, self.phase, self.rows, self.latency)
+
+
+class Progress(object):
+    """
+    Tracks rows, bytes, chunk latency and throttle time per phase of work on a table.
+    The ETA is computed from an EWMA of throughput, not from the PK distance covered,
+    so gaps in the primary key do not skew it.
+    """
+
+    def __init__(self, table_name, alpha=0.3):
+        """Initialize empty counters"""
+        self.table_name = table_name
+        self.listeners = []
+        self.alpha = alpha
+        self.rows = defaultdict(int)
+        self.bytes = defaultdict(int)
+        self.throttle = defaultdict(float)
+        self.chunks = defaultdict(int)
+        self.histograms = {}
+        self.durations = {}
+        self.current_phase = None
+        self.total = None
+        self.row_size = 0
+        self._rate = Ewma(alpha)
+        self._phase_start = None
+
+    def add_listener(self, listener):
+        """Register a callable that receives ProgressEvent objects"""
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Unregister a listener"""
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def emit(self, event):
+        """Deliver an event to the listeners"""
+        for listener in self.listeners:
+            listener(event)
+
+    def expect(self, total, row_size=0):
+        """Set the number of rows, and their average size, the next phase is expected to process"""
+        self.total = total
+        self.row_size = row_size
+        self._rate = Ewma(self.alpha)
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager marking the start and end of a phase"""
+        previous, previous_start = self.current_phase, self._phase_start
+        self.current_phase, self._phase_start = name, time.time()
+        self.emit(self._event(ProgressEvent.PHASE_START, name))
+        try:
+            yield self
+        finally:
+            duration = time.time() - self._phase_start
+            self.durations[name] = self.durations.get(name, 0.0) + duration
+            self.emit(self._event(ProgressEvent.PHASE_END, name, latency=duration))
+            self.current_phase, self._phase_start = previous, previous_start
+
+    def chunk(self, rows, latency, throttle=0.0, position=None, phase=None):
+        """Record a processed chunk"""
+        phase = phase or self.current_phase
+        rows = max(rows or 0, 0)
+        chunk_bytes = int(rows * self.row_size)
+        self.rows[phase] += rows
+        self.bytes[phase] += chunk_bytes
+        self.throttle[phase] += throttle
+        self.chunks[phase] += 1
+        self.histograms.setdefault(phase, Histogram()).observe(latency)
+        elapsed = latency + throttle
+        if elapsed > 0:
+            self._rate.update(rows / elapsed)
+        self.emit(self._event(ProgressEvent.CHUNK, phase, rows=rows, bytes=chunk_bytes,
+                              latency=latency, throttle=throttle, position=position))
+
+    def _event(self, kind, phase, **kwargs):
+        return ProgressEvent(kind, self.table_name, phase, done=self.rows[phase],
+                             total=self.total, rate=self.rate, eta=self.eta, **kwargs)
+
+    @property
+    def rate(self):
+        """Smoothed rows per second"""
+        return self._rate.value
+
+    @property
+    def done(self):
+        """Rows processed by the current phase"""
+        return self.rows[self.current_phase] if self.current_phase else 0
+
+    @property
+    def ratio(self):
+        """Fraction of the expected rows processed"""
+        if not self.total:
+            return None
+        return min(self.done / float(self.total), 1.0)
+
+    @property
+    def eta(self):
+        """Estimated seconds remaining in the current phase, None if unknown"""
+        if self.total is None or not self.rate:
+            return None
+        return max(self.total - self.done, 0) / self.rate
+
+    def summary(self):
+        """Return the collected metrics as a dictionary"""
+        phases = {}
+        for phase in set(self.rows) | set(self.durations):
+            histogram = self.histograms.get(phase)
+            phases[phase] = {
+                'rows': self.rows[phase],
+                'bytes': self.bytes[phase],
+                'chunks': self.chunks[phase],
+                'throttle': self.throttle[phase],
+                'duration': self.durations.get(phase),
+                'latency_p50': histogram.p50 if histogram else None,
+                'latency_p99': histogram.p99 if histogram else None,
+            }
+        return {'table': self.table_name, 'rate': self.rate, 'eta': self.eta, 'phases': phases}
+
+
+class ConsoleReporter(object):
+    """Progress listener printing copy status lines"""
+
+    def __call__(self, event):
+        """Print chunk and phase events"""
+        if event.kind == ProgressEvent.CHUNK:
+            if event.total:
+                percent = min(event.done / float(event.total), 1.0) * 100
+                eta = str(datetime.timedelta(seconds=int(event.eta))) if event.eta is not None else 'unknown'
+                print('Processed %d/%d rows %.2f%% - time left: %s' % (event.done, event.total, percent, eta))
+            else:
+                print('Processed {} rows, pk {}'.format(event.done, event.position))
+        elif event.kind == ProgressEvent.PHASE_END:
+            print('{} {} complete in {:.2f}s'.format(event.table, event.phase, event.latency))
@@ -0,0 +1,110 @@
+"""Maintenance windows for the copy and cutover phases"""
+import datetime
+import time
+
+
+DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+
+class Window(object):
+    """
+    Daily window of allowed work, on some days of the week.
+    A window ending before it starts runs past midnight, into the next day.
+    """
+
+    def __init__(self, start, end, days=None):
+        """start and end are datetime.time, days are weekday numbers with monday as 0, None for every day"""
+        self.start = start
+        self.end = end
+        self.days = set(days) if days is not None else set(range(7))
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse a window like '01:00-06:00', 'sat,sun' or 'mon-fri 22:00-04:00'"""
+        days, hours = None, '00:00-00:00'
+        for part in spec.split():
+            if ':' in part:
+                hours = part
+            else:
+                days = cls._parse_days(part)
+        start, end = [datetime.datetime.strptime(x, '%H:%M').time() for x in hours.split('-')]
+        return cls(start, end, days)
+
+    @staticmethod
+    def _parse_days(spec):
+        days = set()
+        for part in spec.lower().split(','):
+            if '-' in part:
+                first, last = [DAYS.index(x[:3]) for x in part.split('-')]
+                days.update((first + i) % 7 for i in range((last - first) % 7 + 1))
+            else:
+                days.add(DAYS.index(part[:3]))
+        return days
+
+    @property
+    def overnight(self):
+        return self.end <= self.start
+
+    def contains(self, moment):
+        """True if moment falls inside the window"""
+        now, weekday = moment.time(), moment.weekday()
+        if self.start == self.end:
+            return weekday in self.days
+        if not self.overnight:
+            return weekday in self.days and self.start <= now < self.end
+        return (weekday in self.days and now >= self.start) or \
+            ((weekday - 1) % 7 in self.days and now < self.end)
+
+    def __repr__(self):
+        """String representation"""
+        return 'Window {}-{} {}'.format(self.start.strftime('%H:%M'), self.end.strftime('%H:%M'),
+                                        ','.join(DAYS[d] for d in sorted(self.days)))
+
+
+class Schedule(object):
+    """
+    Windows in which a phase may run, minus blackout dates.
+    wait is called at chunk boundaries and sleeps until a window is open.
+    """
+
+    def __init__(self, windows, blackout_dates=(), poll_interval=60, clock=None, sleep=None):
+        """windows are Window objects or specs for Window.parse, blackout dates are dates or 'YYYY-MM-DD'"""
+        self.windows = [Window.parse(w) if isinstance(w, str) else w for w in windows]
+        self.blackout_dates = set(
+            datetime.datetime.strptime(d, '%Y-%m-%d').date() if isinstance(d, str) else d
+            for d in blackout_dates)
+        self.poll_interval = poll_interval
+        self.clock = clock or datetime.datetime.now
+        self.sleep = sleep or time.sleep
+
+    def is_open(self, moment=None):
+        """True if work may run at moment, now by default"""
+        moment = moment or self.clock()
+        if moment.date() in self.blackout_dates:
+            return False
+        return any(window.contains(moment) for window in self.windows)
+
+    def next_open(self, moment=None):
+        """Return when the schedule next opens, moment itself if it is open, None if it never does"""
+        moment = moment or self.clock()
+        if self.is_open(moment):
+            return moment
+        candidates = []
+        for offset in range(8 + len(self.blackout_dates)):
+            day = moment.date() + datetime.timedelta(days=offset)
+            candidates += [datetime.datetime.combine(day, window.start) for window in self.windows]
+            candidates.append(datetime.datetime.combine(day, datetime.time()))
+        for candidate in sorted(c for c in candidates if c > moment):
+            if self.is_open(candidate):
+                return candidate
+        return None
+
+    def wait(self, control=None):
+        """Sleep until the schedule is open, still answering the control channel"""
+        while not self.is_open():
+            if control:
+                control.wait()
+            opens = self.next_open()
+            if opens is None:
+                raise ValueError('Schedule never opens: {}'.format(self.windows))
+            self.sleep(max(min(self.poll_interval, (opens - self.clock()).total_seconds()), 0))
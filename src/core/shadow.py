@@ -0,0 +1,162 @@
+"""Shadow column strategy for changing the type of a single column"""
+import hashlib
+import re
+
+
+class ShadowColumn(object):
+    """
+    Changes the definition of one column without copying the table.
+    A shadow column with the new definition is added and kept in sync by a trigger,
+    backfilled in primary key chunks, then swapped in by renaming both columns.
+    Only the changed column is rewritten.
+
+    expression converts the original column to the new definition, with {column} standing
+    for the column, e.g. 'CAST({column} AS bigint)'. The default is the column itself.
+
+    The swapped in column has definition and nothing else of the original: the primary key
+    and a sequence cannot be moved this way and are refused, a default has to be restated in
+    definition, and so does NOT NULL, which can only be added along with a default.
+    """
+
+    SEQUENCE = 'nextval('
+
+    def __init__(self, table, column, definition, expression=None):
+        """Initialize the shadow column of table.column"""
+        self.table = table
+        self.db = table.db
+        self.column = column
+        self.definition = definition
+        self.expression = expression or '{column}'
+        self.name = self.identifier('{}_shadow'.format(column))
+        self.old_name = self.identifier('{}_old'.format(column))
+        self.trigger = self.trigger_name()
+        self.function = self.identifier('shadow_{}_{}'.format(table.name, column))
+
+    @property
+    def commands(self):
+        return self.db.commands
+
+    def identifier(self, name):
+        """name, or when it is over MAX_LENGTH_NAME, its start and a hash of the whole,
+        so names cut to the same start stay apart
+        """
+        max_length = self.db.config['MAX_LENGTH_NAME']
+        if len(name) <= max_length:
+            return name
+        digest = hashlib.md5(name.encode('utf-8')).hexdigest()[:8]
+        return '{}_{}'.format(name[:max_length - len(digest) - 1], digest)
+
+    def trigger_name(self, suffix=None):
+        """Name of the sync trigger, or of the one for suffix where each event has its own"""
+        name = 'shadow_trigger_{}_{}'.format(self.table.name, self.column)
+        return self.identifier('{}_{}'.format(name, suffix) if suffix else name)
+
+    @property
+    def progress(self):
+        return self.table.progress
+
+    def value(self, row=None):
+        """The new value of the column, for the row reference row ('NEW' in triggers)"""
+        column = '{}.{}'.format(row, self.column) if row else self.column
+        return self.expression.format(column=column)
+
+    def run(self, chunk_size=None, throttle=None, checkpoint=None, drop_old=True):
+        """Add, sync, backfill and swap in the shadow column"""
+        with self.progress.phase('ddl'):
+            self.add()
+            self.create_triggers()
+        self.backfill(chunk_size, throttle, checkpoint)
+        with self.progress.phase('ddl'):
+            self.add_indexes()
+        self.swap(drop_old)
+
+    def check(self):
+        """Refuse a column the swap would lose its primary key, sequence or default from"""
+        column = '{}.{}'.format(self.table.name, self.column)
+        if self.column == self.table.primary_key_column:
+            raise ValueError('{} is the primary key, which a shadow column cannot carry over, '
+                             'rebuild the table instead'.format(column))
+        default = self.old_default()
+        if default is None:
+            return
+        if self.SEQUENCE in default.lower():
+            raise ValueError('{} is filled by a sequence, which a shadow column cannot carry over, '
+                             'rebuild the table instead'.format(column))
+        if not re.search(r'\bdefault\b', self.definition, re.IGNORECASE):
+            raise ValueError('{} has the default {}, restate it in the new definition'.format(column, default))
+
+    def old_default(self):
+        """Default of the original column, None without one"""
+        match = re.search(r' default (.+)$', self.table.get_column_definition(self.column), re.IGNORECASE)
+        return match.group(1) if match else None
+
+    def add(self):
+        """Add the shadow column with the new definition"""
+        self.check()
+        self.table.add_column(self.name, self.definition)
+        self.table.commit()
+
+    def create_triggers(self):
+        """Keep the shadow column in sync with every insert and update"""
+        if self.trigger not in self.table.get_triggers():
+            with self.table.profiled('triggers'):
+                self.table.execute(self.commands.shadow_function(self.function, self.name, self.value('NEW')))
+                self.table.execute(self.commands.shadow_trigger(self.trigger, self.table.name, self.function))
+                self.table.commit()
+
+    def drop_triggers_statements(self):
+        """Statements removing the sync trigger"""
+        return [self.commands.drop_trigger(self.trigger, self.table.name),
+                self.commands.drop_function(self.function)]
+
+    def backfill(self, chunk_size=None, throttle=None, checkpoint=None):
+        """Fill the shadow column of the existing rows in chunks, return the rows updated"""
+        return self.table.update_where('{} = {}'.format(self.name, self.value()),
+                                       chunk_size=chunk_size, throttle=throttle, checkpoint=checkpoint)
+
+    def _single_column_indexes(self, column):
+        """Names and uniqueness of the indexes on column alone"""
+        indexes = self.table.indexes
+        names = [x.name for x in indexes]
+        return [(x.name, x.unique) for x in indexes if x.column == column and names.count(x.name) == 1]
+
+    def add_indexes(self):
+        """Index the shadow column like the original, before the swap"""
+        existing = [name for name, _ in self._single_column_indexes(self.name)]
+        if not existing:
+            with self.table.profiled('indexes'):
+                for name, unique in self._single_column_indexes(self.column):
+                    self.table.add_index([self.name], unique=bool(unique))
+
+    def swap_statements(self):
+        """Statements dropping the sync trigger and swapping the columns by name"""
+        return self.drop_triggers_statements() + self.commands.swap_columns(
+            self.table.name,
+            self.column,
+            self.old_name,
+            self.name,
+            self.old_definition(),
+            self.definition
+        )
+
+    def old_definition(self):
+        """Definition the original column keeps under old_name, where the rename restates it"""
+        return self.table.get_column_definition(self.column)
+
+    def swap(self, drop_old=True):
+        """Drop the sync trigger and swap the columns in one short transaction"""
+        statements = self.swap_statements()
+        with self.progress.phase('cutover'), self.table.profiled('cutover'):
+            for sql in statements:
+                self.table.execute(sql)
+            self.table.commit()
+        if drop_old:
+            self.drop_old()
+
+    def drop_old(self):
+        """Drop the original column, now renamed to old_name"""
+        if self.table.column_exists(self.old_name):
+            for name, _ in self._single_column_indexes(self.old_name):
+                self.table.drop_index(name)
+            self.table.drop_column(self.old_name)
+            self.table.commit()
@@ -1,9 +1,18 @@
-import datetime
 import re
 import time
 import random
 import string
-from src.core.constraints import Constraint, ForeignKey, Index
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import zip_longest
+from src.core.chunking import ChunkPlanner, Checkpoint, merge_ranges
+from src.core.constraints import Constraint, ForeignKey, Index, Partition
+from src.core.guard import PlanGuard
+from src.core.plan import MigrationPlan
+from src.core.preflight import PreflightReport
+from src.core.progress import Progress, ConsoleReporter
 
 
 class Table(object):
@@ -14,9 +23,24 @@ class Table(object):
     def __init__(self, database, name, primary_key_column='id'):
         """Initialize the table with database object and name"""
         self.db = database
-        self.commands = database.commands
         self.name = name
         self.primary_key_column = primary_key_column
+        self.progress = Progress(name)
+        if database.tracer:
+            self.progress.add_listener(database.tracer)
+
+    @property
+    def commands(self):
+        return self.db.commands
+
+    def profiled(self, section):
+        """Account the block to section when the database is profiling"""
+        return self.db.profiler.section(section) if self.db.profiler else nullcontext()
+
+    @staticmethod
+    def _quote(name):
+        """Quote an identifier, dialects with reserved words to escape override this"""
+        return name
 
     @staticmethod
     def _join_cols(cols):
@@ -69,6 +93,11 @@ class Table(object):
         """Qualify, join and equate"""
         return ', '.join('{}={}.{}'.format(cols[i], new_table, new_cols[i]) for i in range(len(cols)))
 
+    @classmethod
+    def _assign(cls, cols, vals):
+        """Join column=value pairs, the columns quoted"""
+        return ', '.join('{}={}'.format(cls._quote(col), vals[i]) for i, col in enumerate(cols))
+
     @staticmethod
     def _dictify(cols, vals):
         """Return columns, values as dictionary"""
@@ -156,12 +185,122 @@ class Table(object):
         """Delete a row by pk"""
         return self.execute(self.commands.delete_row(self.name, self.primary_key_column, pk))
 
+    # Chunked DML
+    def delete_where(self, where=None, chunk_size=None, throttle=None, checkpoint=None, method='auto'):
+        """Delete the rows matching the where clause in primary key range chunks,
+        committing and throttling after every chunk. Returns the number of rows deleted.
+        """
+        return self._in_chunks('delete', lambda chunk: self.commands.delete_range(
+            self.name, self.primary_key_column, where, chunk.start, chunk.end
+        ), chunk_size, throttle, checkpoint, method)
+
+    def update_where(self, values, where=None, chunk_size=None, throttle=None, checkpoint=None, method='auto'):
+        """Update the rows matching the where clause in primary key range chunks.
+        values is a dictionary of column values, or a sql SET list for computed backfills.
+        Returns the number of rows updated.
+        """
+        col_val = values if isinstance(values, str) else self._join_equality(values)
+        return self._in_chunks('update', lambda chunk: self.commands.update_range(
+            self.name, col_val, self.primary_key_column, where, chunk.start, chunk.end
+        ), chunk_size, throttle, checkpoint, method)
+
+    def drop_in_chunks(self, chunk_size=None, throttle=None, checkpoint=None, cascade=False):
+        """Empty the table chunk by chunk before dropping it,
+        so no single transaction has to log or lock the whole table
+        """
+        if self.db.table_exists(self.name):
+            self.delete_where(chunk_size=chunk_size, throttle=throttle, checkpoint=checkpoint)
+            self.drop(cascade)
+
+    def _in_chunks(self, phase, statement, chunk_size=None, throttle=None, checkpoint=None, method='auto'):
+        """Run statement(chunk) for every planned chunk, return the total rows affected"""
+        chunk_size = chunk_size if chunk_size else self.db.config['DEFAULT_CHUNK_SIZE']
+        throttle = throttle if throttle else self.db.config['DEFAULT_THROTTLE']
+        if isinstance(checkpoint, str):
+            checkpoint = Checkpoint(checkpoint)
+        if checkpoint and checkpoint.ranges:
+            ranges = checkpoint.ranges
+        else:
+            ranges = ChunkPlanner(self, chunk_size).plan(method)
+            if checkpoint:
+                checkpoint.start(ranges)
+
+        total = 0
+        self.progress.expect(None)
+        with self.progress.phase(phase):
+            for chunk in ranges:
+                if checkpoint and checkpoint.is_done(chunk):
+                    continue
+                chunk_start = time.time()
+                self.execute(statement(chunk))
+                self.commit()
+                rows = max(self.db.last_rowcount or 0, 0)
+                latency = time.time() - chunk_start
+                total += rows
+                if checkpoint:
+                    checkpoint.mark(chunk)
+                time.sleep(throttle)
+                self.progress.chunk(rows, latency, throttle, position=chunk.end)
+        if checkpoint:
+            checkpoint.clear()
+        return total
+
     @property
     def count(self):
         """Get the count for the table"""
         ans = self.execute(self.commands.table_count(self.name))
         return ans[0][0]
 
+    @property
+    def size_estimate(self):
+        """Return the (bytes, rows) estimate for the table from the catalog, without scanning it"""
+        ans = self.execute(self.commands.table_size(self.db.name, self.name))
+        if not ans:
+            return 0, 0
+        size, rows = ans[0]
+        return int(size or 0), max(int(rows or 0), 0)
+
+    @property
+    def bloat(self):
+        """Return the bytes, rows and estimated bloat bytes of the table, as fresh as its statistics.
+        rows is None where the catalog cannot tell them without a scan
+        """
+        size, rows, bloat = self._bloat_stats()
+        size, bloat = int(size or 0), int(bloat or 0)
+        return {
+            'bytes': size,
+            'rows': max(int(rows), 0) if rows is not None else None,
+            'bloat_bytes': bloat,
+            'bloat_ratio': bloat / float(size) if size else 0.0,
+        }
+
+    def _bloat_stats(self):
+        """The (bytes, rows, bloat bytes) row of the catalog"""
+        ans = self.execute(self.commands.table_bloat(self.db.name, self.name))
+        return ans[0] if ans else (0, 0, 0)
+
+    def analyze(self):
+        """Refresh the statistics of the table"""
+        self.execute(self.commands.analyze(self.name))
+        self.commit()
+
+    def set_storage(self, params):
+        """Set storage parameters of the table, like {'fillfactor': 70}"""
+        self.execute(self.commands.set_storage(self.name, params))
+        self.commit()
+
+    @property
+    def index_size(self):
+        """Return the estimated size of the table's indexes in bytes"""
+        ans = self.execute(self.commands.index_size(self.db.name, self.name))
+        return int(ans[0][0] or 0) if ans else 0
+
+    @property
+    def average_row_size(self):
+        """Return the estimated average row size in bytes"""
+        size, rows = self.size_estimate
+        return size / float(rows) if rows else 0
+
     # Column Methods
     @property
     def columns(self):
@@ -197,6 +336,10 @@ class Table(object):
         """Rename a column"""
         self.execute(self.commands.rename_column(self.name, old_name, new_name))
 
+    def shadow_column(self, column, definition, expression=None):
+        """Return a ShadowColumn changing column to definition in place, without copying the table"""
+        return self.db.shadow_column_class(self, column, definition, expression)
+
     # Constraints
     @property
     def constraints(self):
@@ -378,6 +521,31 @@ class Table(object):
         end = self.execute(self.commands.max_pk(self.name, self.primary_key_column))
         return end[0][0]
 
+    @property
+    def partitions(self):
+        """Return the declarative partitions of the table, empty for a plain table"""
+        ans = self.execute(self.commands.get_partitions(self.db.name, self.name))
+        return [Partition(self.name, x[0], x[1], x[2] or 0) for x in ans]
+
+    @property
+    def pk_histogram(self):
+        """Return the equal population bounds of the primary key from the table statistics,
+        empty where the dialect keeps none
+        """
+        return []
+
+    def pk_sample(self, size):
+        """Return a sorted sample of about size primary keys read without a scan,
+        empty where the dialect cannot sample
+        """
+        return []
+
+    def full_scans(self, sql, db=None):
+        """Return the relations the plan of sql reads with a full scan,
+        empty where the dialect cannot tell
+        """
+        return []
+
     # Table Triggers
     def get_triggers(self, table_name=None):
         """Get triggers on table"""
@@ -397,6 +565,10 @@ class Table(object):
         self.execute(self.commands.remove_sequence_from_col(self.name, column))
         self.commit()
 
+    def set_sequence_default(self, name, col):
+        self.execute(self.commands.set_sequence_default(self.name, col, name))
+        self.commit()
+
     def set_sequence_owner(self, name, table, col):
         self.execute(self.commands.set_sequence_owner(
             name,
@@ -414,25 +586,70 @@ class MigrationTable(Table):
         self.source = source_table
         super(MigrationTable, self).__init__(database, self.source.migrate_name, primary_key_column)
         self.renames = []
+        self.partition_map = {}
+        self.chunk_timeout = None
+        self.skip_locked = False
+        self.skipped_pks = set()
+        self.guard = None
+        self.needs_resync = False
+        self.order_by = None
+        self.where = None
+        self.transforms = {}
+        self.cutover_names = None
+        self.grace_ends = None
         self.triggers = {}
         for type in ['INSERT', 'UPDATE', 'DELETE']:
             self.triggers[type] = self._trigger_name(type)
+        if self.db.config.get('PROGRESS_CONSOLE', True):
+            self.progress.add_listener(ConsoleReporter())
 
     def create_from_source(self):
         """Create new table like source_table"""
-        create_statement = self.source.create_statement
-        self.create_from_statement(create_statement)
-        # Add constraints
-        constraints = self.source.constraints
-        self.add_constraints(constraints)
-
-        # Add indexes
-        indexes = self.source.indexes
-        self.add_indexes(indexes)
-
-        # Add the non-referenced foreign keys
-        non_referenced_fks = [x for x in self.source.foreign_keys if not x.referenced]
-        self.add_foreign_keys(non_referenced_fks, override_table=self.name)
+        with self.progress.phase('ddl'), self.profiled('setup'):
+            create_statement = self.source.create_statement
+            self.create_from_statement(create_statement)
+            # Add constraints
+            constraints = self.source.constraints
+            self.add_constraints(constraints)
+
+            # Add indexes
+            indexes = self.source.indexes
+            with self.profiled('indexes'):
+                self.add_indexes(indexes)
+
+            # Add the non-referenced foreign keys
+            non_referenced_fks = [x for x in self.source.foreign_keys if not x.referenced]
+            with self.profiled('foreign_keys'):
+                self.add_foreign_keys(non_referenced_fks, override_table=self.name)
+
+    def rebuild(self, order_by=None, storage=None, cutover=True, schedule=None, **copy_options):
+        """Rebuild the source table without schema change, to reclaim its bloat, cluster it or change
+        its storage parameters online, where VACUUM FULL or CLUSTER lock it for the whole rebuild.
+
+        order_by is the name of an index of the source table, rows are inserted in its order
+        within each chunk, so larger chunks cluster the table closer to the index.
+        storage are the storage parameters of the new table, copy_options go to copy_in_chunks.
+        Without cutover the tables are left for rename_tables, to check the copy first.
+        Returns the bloat of the table before and after the rebuild.
+        """
+        if order_by:
+            columns = [x.column for x in self.source.indexes if x.name == order_by]
+            if not columns:
+                raise ValueError('{} has no index {}'.format(self.source.name, order_by))
+            self.order_by = columns
+        self.source.analyze()
+        report = {'before': self.source.bloat}
+        self.create_from_source()
+        if storage:
+            self.set_storage(storage)
+        self.copy_in_chunks(**copy_options)
+        self.analyze()
+        report['after'] = self.bloat
+        if cutover:
+            self.rename_tables(schedule)
+        print('Rebuild complete! {} bytes of bloat reclaimed'.format(
+            report['before']['bloat_bytes'] - report['after']['bloat_bytes']))
+        return report
 
     def rename_column(self, original_column_name, new_column_name):
         """Map renamed columns across tables"""
@@ -440,6 +657,27 @@ class MigrationTable(Table):
         if not self.column_exists(new_column_name):
             super(MigrationTable, self).rename_column(original_column_name, new_column_name)
 
+    def filter_rows(self, predicate):
+        """Copy and capture only the source rows matching predicate, a condition on the source row {row},
+        e.g. '{row}.deleted_at IS NULL'. Rows updated out of it are deleted from the new table.
+        """
+        self.where = predicate
+
+    def transform_column(self, column, expression):
+        """Write column of the new table from an expression of the source row {row},
+        e.g. 'CAST({row}.zip AS text)', in place of the source column it maps to.
+        A column missing from the source is computed from the expression alone.
+        """
+        self.transforms[column] = expression
+
+    def _condition(self, row):
+        """The row predicate on row, None without one"""
+        return '({})'.format(self.where.format(row=row)) if self.where else None
+
+    def _values(self, row):
+        """The values written to the new table, read from row"""
+        return ', '.join(self.intersection.origin_values(row))
+
     @property
     def intersection(self):
         """Returns an intersection object"""
@@ -454,10 +692,11 @@ class MigrationTable(Table):
         """create triggers for source table"""
         triggers = self.get_source_triggers()
         if not triggers:
-            self.create_insert_trigger()
-            self.create_update_trigger()
-            self.create_delete_trigger()
-            self.commit()
+            with self.progress.phase('ddl'), self.profiled('triggers'):
+                self.create_insert_trigger()
+                self.create_update_trigger()
+                self.create_delete_trigger()
+                self.commit()
 
     def create_insert_trigger(self):
         """Set insert Triggers.
@@ -467,7 +706,8 @@ class MigrationTable(Table):
         self.execute(self.commands.insert_function(
                     self.name,
                     cols=self._join_cols(self.intersection.dest_columns),
-                    vals=self._qualify('NEW', self.intersection.origin_columns)
+                    vals=self._values('NEW'),
+                    condition=self._condition('NEW')
         ))
 
         self.execute(self.commands.insert_trigger(
@@ -483,12 +723,15 @@ class MigrationTable(Table):
         """
         self.execute(self.commands.update_function(
             self.name,
-            self._equals(
+            self._assign(
                 self.intersection.dest_columns,
-                'NEW',
-                self.intersection.origin_columns
+                self.intersection.origin_values('NEW')
             ),
-            self.primary_key_column
+            self.primary_key_column,
+            self._condition('NEW'),
+            self._condition('OLD'),
+            self._join_cols(self.intersection.dest_columns),
+            self._values('NEW')
         ))
 
         self.execute(self.commands.update_trigger(
@@ -520,83 +763,599 @@ class MigrationTable(Table):
                 function_name = '{}_{}'.format(trigger_method.lower(), self.name)
                 self.execute(self.commands.drop_function(function_name))
 
-    def copy_in_chunks(self, chunk_size=None, throttle=None, start=None, limit=None):
-        """Copy the data from the original table to the destination table in chunks"""
+    def chunk_ranges(self, chunk_size=None, method='auto', start=None, limit=None):
+        """Plan the chunks of the copy from the source table, see ChunkPlanner.
+        A partitioned source is planned partition by partition. Statistics cover the whole table,
+        so partitions are scanned unless another method is asked for.
+        """
+        chunk_size = chunk_size if chunk_size else self.db.config['DEFAULT_CHUNK_SIZE']
+        partitions = self.source.partitions
+        if not partitions:
+            return ChunkPlanner(self.source, chunk_size, guard=self.guard).plan(method, start, limit)
+        ranges = []
+        for partition in partitions:
+            planner = ChunkPlanner(self.source, chunk_size, partition.name, self.guard)
+            ranges += planner.plan('scan' if method == 'auto' else method, start, limit)
+        return ranges
+
+    def map_partitions(self, partition_map=None):
+        """Map source partitions to the partitions of a partitioned migrate_ table,
+        so their chunks are written straight to the partition holding the same values.
+        Without a map, partitions are matched by their bounds.
+        """
+        if partition_map is None:
+            destination = self.partitions
+            partition_map = {p.name: d.name for p in self.source.partitions for d in destination if p == d}
+        self.partition_map = partition_map
+        return partition_map
+
+    def hot_partition(self, partitions):
+        """The partition of the source holding its highest primary key, the one new rows go to.
+        Partitions are listed in the order of their bound text, which is not the order of their values.
+        """
+        hot, highest = None, None
+        for partition in sorted(set(partitions)):
+            relation = self.commands.partition_relation(self.source.name, partition)
+            max_pk = self.execute(self.commands.max_pk(relation, self.primary_key_column))[0][0]
+            if max_pk is not None and (highest is None or max_pk > highest):
+                hot, highest = partition, max_pk
+        return hot or (partitions[-1] if partitions else None)
+
+    def _partition_count(self, table_name, partition):
+        ans = self.execute(self.commands.table_count(self.commands.partition_relation(table_name, partition)))
+        return ans[0][0]
+
+    def copied_partitions(self):
+        """Return the source partitions whose mapped destination partition already holds all their rows"""
+        return [source for source, dest in self.partition_map.items()
+                if self._partition_count(self.source.name, source) == self._partition_count(self.name, dest)]
+
+    def copy_in_chunks(self, chunk_size=None, throttle=None, start=None, limit=None,
+                       method='auto', checkpoint=None, workers=1, partition_map=None, hot_partition=None,
+                       control=None, schedule=None, chunk_timeout=None, skip_locked=False, guard=None,
+                       breaker=None, resync=False):
+        """Copy the data from the original table to the destination table in chunks.
+        Chunk boundaries are planned up front from the source table, with method as in ChunkPlanner.
+        checkpoint is a Checkpoint or a path, a restarted copy skips the chunks it recorded.
+        With a connection pool, workers sessions copy chunks in parallel.
+
+        A partitioned source is copied partition by partition, skipping partitions already copied.
+        The cold partitions are copied first, in parallel, then the hot partition (the last one
+        unless hot_partition is given) on its own, so the copy does not compete with itself
+        for the partition the application is writing to.
+
+        control is a Controller checked between chunks, to pause, resume, retune or abort the copy.
+        schedule is a Schedule of the windows the copy may run in, checked before every chunk.
+
+        Every chunk runs under a statement timeout of chunk_timeout seconds when one is set.
+        Lock timeouts, deadlocks, serialization failures and statement timeouts are retried
+        with exponential backoff, and a chunk that keeps timing out is split in half.
+
+        With skip_locked, chunks skip the source rows other transactions hold locks on
+        and record their pks, which catch_up copies once every chunk is done.
+        Sqlite has no row locks and copies every row as usual.
+
+        guard is a PlanGuard explaining the chunk statements, by default one re-checking
+        every PLAN_GUARD_INTERVAL chunks of tables over ten chunks. A copy chunk planned
+        as a full scan of the source stops the copy with UnsafePlan.
+
+        breaker is a CircuitBreaker pausing the copy while the application latency is over its SLO,
+        and dropping the capture triggers if it stays over. A migration whose triggers were dropped
+        needs a resync: the next copy, or one with resync, re-copies every chunk, replacing the rows
+        of each range in the destination table.
+
+        Only the rows matching filter_rows are copied, with the expressions of transform_column.
+        """
         # On restart, foreign_keys exist, don't remake them
         self.create_triggers()
 
         self.chunk_size = chunk_size if chunk_size else self.db.config['DEFAULT_CHUNK_SIZE']
         throttle = throttle if throttle else self.db.config['DEFAULT_THROTTLE']
-
-        if self.count == 0 or self.count != self.source.count:
-            if not start:
-                start = self.source.min_pk
-            if not limit:
-                limit = self.source.max_pk
-
-            self.start_time = datetime.datetime.now()
-
-            pointer = start
-            if not (pointer and limit):
-                pass
+        self.chunk_timeout = chunk_timeout if chunk_timeout else self.db.config.get('CHUNK_TIMEOUT')
+        self.skip_locked = skip_locked and self.commands.SKIP_LOCKED
+        if isinstance(checkpoint, str):
+            checkpoint = Checkpoint(checkpoint)
+        self.skipped_pks = set(checkpoint.skipped) if checkpoint else set()
+        interval = self.db.config.get('PLAN_GUARD_INTERVAL', 100)
+        if guard is None and interval:
+            guard = PlanGuard(self.source, interval, self.chunk_size * 10)
+        self.guard = guard
+        self.needs_resync = resync or self.needs_resync or bool(checkpoint and checkpoint.needs_resync)
+
+        source_count = self.source.count
+        # A filtered copy leaves the counts apart, its copy skips the rows already copied
+        if self.count == 0 or self.count != source_count or self.needs_resync or self.where:
+            if checkpoint and checkpoint.ranges:
+                ranges = checkpoint.ranges
             else:
-                while pointer < limit:
-                    self._copy_chunk(pointer)
-                    pointer = self._get_next_pk(pointer)
-                    self.log(start, pointer, limit)
-                    time.sleep(throttle)
-                if pointer == limit:
-                    self._copy_chunk(pointer)
-                    self.log(start, pointer, limit)
+                ranges = self.chunk_ranges(self.chunk_size, method, start, limit)
+                if checkpoint:
+                    checkpoint.start(ranges)
+            partitions = [r.partition for r in ranges if r.partition]
+            mapped = partitions and self.map_partitions(partition_map)
+            # A resync copies every partition again, the rows of a complete one can be stale
+            copied = self.copied_partitions() if mapped and not self.needs_resync else []
+            pending = [r for r in ranges if not (checkpoint and checkpoint.is_done(r)) and r.partition not in copied]
+            hot = hot_partition or self.hot_partition(partitions)
+            columns = self._copy_columns()
+
+            self.progress.expect(source_count - self.count, self.source.average_row_size)
+            with self.progress.phase('copy'), self.profiled('copy'):
+                cold = self._interleave([r for r in pending if r.partition != hot or hot is None])
+                self._copy_ranges(cold, columns, throttle, checkpoint, workers, control, schedule, breaker)
+                self._copy_ranges([r for r in pending if hot and r.partition == hot],
+                                  columns, throttle, checkpoint, 1, control, schedule, breaker)
+                if self.skipped_pks:
+                    self.catch_up(self.chunk_size, throttle, checkpoint=checkpoint)
+            self.needs_resync = False
+            if checkpoint:
+                checkpoint.clear()
 
         print('Copy complete! Adding referenced foreign keys')
-        referenced_fks = [x for x in self.source.foreign_keys if x.referenced]
-        self.add_foreign_keys(referenced_fks, override_table=self.name)
+        with self.progress.phase('ddl'), self.profiled('foreign_keys'):
+            referenced_fks = [x for x in self.source.foreign_keys if x.referenced]
+            self.add_foreign_keys(referenced_fks, override_table=self.name)
         return True
 
-    def _get_next_pk(self, last_pk):
-        """Return the next id"""
-        ans = self.execute(self.commands.next_pk(
+    @staticmethod
+    def _interleave(ranges):
+        """Order ranges round robin over their partitions, so parallel workers copy different partitions"""
+        groups = {}
+        for chunk in ranges:
+            groups.setdefault(chunk.partition, []).append(chunk)
+        if len(groups) < 2:
+            return ranges
+        ordered = zip_longest(*groups.values())
+        return [chunk for group in ordered for chunk in group if chunk is not None]
+
+    def _copy_ranges(self, ranges, columns, throttle, checkpoint, workers=1, control=None, schedule=None,
+                     breaker=None):
+        """Copy the ranges in order, or on up to workers pooled sessions.
+        With a control channel, the chunk size, throttle and worker count can change between chunks,
+        and up to the pool size of workers can be brought in.
+        With a schedule, no chunk starts outside its windows, with a breaker none starts over the SLO.
+        """
+        work = deque(ranges)
+        lock = threading.RLock()
+        settings = {'throttle': throttle, 'workers': workers}
+        if control:
+            control.attach(self.progress, self.chunk_size, throttle, workers)
+        parallel = self.db.pool is not None and (workers > 1 or control is not None)
+        threads = max(workers, self.db.pool.size if control else 0) if parallel else 1
+
+        def take(index):
+            """Return the next chunk, False while this worker is not wanted, None when done"""
+            with lock:
+                if breaker and breaker.detached:
+                    # Another worker detached, it raises MigrationDetached, this one stops quietly
+                    return None
+                if schedule:
+                    schedule.wait(control)
+                if breaker:
+                    breaker.wait(self, checkpoint)
+                if control:
+                    control.wait()
+                    self._retune(control, work, checkpoint, settings)
+                if not work:
+                    return None
+                if index >= settings['workers']:
+                    return False
+                return work.popleft()
+
+        def run(index):
+            while True:
+                chunk = take(index)
+                if chunk is None:
+                    return
+                if chunk is False:
+                    time.sleep(control.poll_interval)
+                elif parallel:
+                    with self.db.session() as db:
+                        self._copy_and_record(chunk, columns, settings['throttle'], checkpoint, db, lock, breaker)
+                else:
+                    self._copy_and_record(chunk, columns, settings['throttle'], checkpoint, lock=lock,
+                                          breaker=breaker)
+
+        if threads == 1 or len(work) < 2 and not control:
+            return run(0)
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            futures = [executor.submit(run, index) for index in range(threads)]
+            for future in futures:
+                future.result()
+
+    def _retune(self, control, work, checkpoint, settings):
+        """Apply the control channel settings, re-planning the pending chunks when the chunk size changed"""
+        settings['throttle'] = control.throttle
+        settings['workers'] = control.workers
+        if control.chunk_size and control.chunk_size != self.chunk_size:
+            self.chunk_size = control.chunk_size
+            pending = list(work)
+            replanned = []
+            for span in merge_ranges(pending):
+                replanned += ChunkPlanner(self.source, self.chunk_size, span.partition).split(span)
+            work.clear()
+            work.extend(replanned)
+            if checkpoint:
+                checkpoint.replan(pending, replanned)
+
+    def _copy_and_record(self, chunk, columns, throttle, checkpoint, db=None, lock=None, breaker=None):
+        """Copy one range, then checkpoint it, throttle and report progress.
+        A range that keeps timing out is split in half, and the halves are copied in its place.
+        A range finished after the breaker detached is not checkpointed, it copied without capture.
+        """
+        copied = self._retry_copy_range(chunk, columns, db)
+        if copied is None:
+            source = db.table(self.source.name, self.primary_key_column) if db else self.source
+            halves = ChunkPlanner(source, self.chunk_size, chunk.partition).halve(chunk)
+            if len(halves) > 1:
+                print('Splitting chunk {} after repeated timeouts'.format(chunk.key))
+                with lock or nullcontext():
+                    if checkpoint:
+                        checkpoint.replan([chunk], halves)
+                for half in halves:
+                    self._copy_and_record(half, columns, throttle, checkpoint, db, lock, breaker)
+                return
+            copied = self._retry_copy_range(chunk, columns, db, split=False)
+        rows, latency = copied
+        skipped = self._uncopied_pks(chunk, db=db) if self.skip_locked else []
+        with lock or nullcontext():
+            self.skipped_pks.update(skipped)
+            if checkpoint and not (breaker and breaker.detached):
+                checkpoint.mark(chunk, skipped)
+        time.sleep(throttle)
+        with lock or nullcontext():
+            self.progress.chunk(rows, latency, throttle, position=chunk.end)
+
+    def _retry_copy_range(self, chunk, columns=None, db=None, split=True):
+        """Copy a range, retrying transient errors with exponential backoff.
+        Return the (rows copied, seconds taken), or None when the range timed out twice in a row
+        and split is allowed. Fatal errors and errors past CHUNK_RETRIES are raised.
+        """
+        db = db or self.db
+        retries = self.db.config.get('CHUNK_RETRIES', 5)
+        backoff = self.db.config.get('CHUNK_RETRY_BACKOFF', 0.5)
+        timeouts = 0
+        for attempt in range(retries + 1):
+            try:
+                return self._timed_copy_range(chunk, columns, db)
+            except Exception as e:
+                kind = db.classify_error(e)
+                if kind is None or attempt == retries:
+                    raise
+                db.rollback()
+                timeouts = timeouts + 1 if kind == 'timeout' else 0
+                if split and timeouts == 2:
+                    return None
+                print('Chunk {} retry {}, error: {}'.format(chunk.key, attempt + 1, e))
+                time.sleep(backoff * 2 ** attempt)
+
+    def _copy_columns(self):
+        """Return the (destination, qualified origin) column lists of the copy"""
+        intersection = self.intersection
+        return (self._join_cols(intersection.dest_columns),
+                ', '.join(intersection.origin_values(self.source.name)))
+
+    def _copy_range(self, chunk, columns=None, db=None):
+        """Copy this range of the source to the destination table, return the rows copied"""
+        db = db or self.db
+        dest_cols, origin_cols = columns or self._copy_columns()
+        sql = self.commands.copy_range(
             self.name,
+            dest_cols,
+            origin_cols,
+            self.source.name,
             self.primary_key_column,
-            last_pk,
-            self.chunk_size
-        ))[0][0]
-        return ans
-
-    def _copy_chunk(self, last_pk):
-        """Copy this chunk to the destination table"""
-        self.execute(self.commands.copy_chunk(
+            chunk.start,
+            chunk.end,
+            chunk.partition,
+            self.partition_map.get(chunk.partition),
+            skip_locked=self.skip_locked,
+            order_by=self._qualify(self.source.name, self.order_by) if self.order_by else None,
+            condition=self._condition(self.source.name)
+        )
+        if self.guard and (chunk.start is not None or chunk.end is not None):
+            self.guard.check('copy_range', sql, [self.source.name, chunk.partition], db)
+        restore = self._set_chunk_timeout(db) if self.chunk_timeout else None
+        try:
+            if self.needs_resync:
+                db.execute(self._resync_delete(chunk))
+            db.execute(sql)
+            rows = db.last_rowcount
+            db.commit()
+        finally:
+            # The session may be pooled or run the cutover next, it gets its own timeout back
+            if restore:
+                db.execute(restore)
+        return rows
+
+    def _set_chunk_timeout(self, db):
+        """Run the next statements of db under chunk_timeout, return the statement restoring the previous timeout"""
+        current = self.commands.current_timeout()
+        previous = db.execute(current)[0][0] if current else None
+        db.execute(self.commands.statement_timeout(self.chunk_timeout))
+        return self.commands.restore_timeout(previous)
+
+    def _resync_delete(self, chunk):
+        """Statement deleting the destination rows of a range before a resync copies it again.
+        The ranges of a partition are open at its ends and overlap those of the other partitions,
+        so the delete is scoped to the mapped destination partition, or else to the rows of the source
+        partition and the rows gone from the source, leaving those the other partitions copied.
+        """
+        pk = self.primary_key_column
+        dest_partition = self.partition_map.get(chunk.partition)
+        if dest_partition:
+            return self.commands.delete_range(self.commands.partition_relation(self.name, dest_partition),
+                                              pk, None, chunk.start, chunk.end)
+        where = None
+        if chunk.partition:
+            where = '{pk} IN (SELECT {pk} FROM {partition}) OR {pk} NOT IN (SELECT {pk} FROM {source})'.format(
+                pk=pk,
+                partition=self.commands.partition_relation(self.source.name, chunk.partition),
+                source=self.source.name
+            )
+        return self.commands.delete_range(self.name, pk, where, chunk.start, chunk.end)
+
+    def _timed_copy_range(self, chunk, columns=None, db=None):
+        """Copy a range, return the (rows copied, seconds taken)"""
+        with self.profiled('chunk'):
+            chunk_start = time.time()
+            rows = self._copy_range(chunk, columns, db)
+        return rows, time.time() - chunk_start
+
+    def _uncopied_pks(self, chunk=None, pks=None, db=None):
+        """Pks of the source rows in a range, or among pks, missing from the destination table"""
+        ans = (db or self.db).execute(self.commands.uncopied_pks(
             self.name,
-            self._join_cols(self.intersection.dest_columns),
-            self._qualify(self.source.name, self.intersection.origin_columns),
             self.source.name,
             self.primary_key_column,
-            last_pk,
-            self.chunk_size
+            chunk.start if chunk else None,
+            chunk.end if chunk else None,
+            self._join_values(pks) if pks else None,
+            chunk.partition if chunk else None,
+            self._condition(self.source.name)
         ))
-        self.commit()
+        return [x[0] for x in ans]
+
+    def catch_up(self, chunk_size=None, throttle=None, passes=3, checkpoint=None):
+        """Copy the rows a SKIP LOCKED copy skipped, chunk_size pks at a time.
+        The first passes skip the rows still locked, the last one waits for their locks.
+        Return the skipped pks left, which are none unless the last pass failed to copy them.
+        """
+        chunk_size = chunk_size if chunk_size else self.db.config['DEFAULT_CHUNK_SIZE']
+        throttle = throttle if throttle else self.db.config['DEFAULT_THROTTLE']
+        dest_cols, origin_cols = self._copy_columns()
+        for attempt in range(passes + 1):
+            if not self.skipped_pks:
+                break
+            pks = sorted(self.skipped_pks)
+            for i in range(0, len(pks), chunk_size):
+                batch = pks[i:i + chunk_size]
+                chunk_start = time.time()
+                self.execute(self.commands.copy_rows(
+                    self.name,
+                    dest_cols,
+                    origin_cols,
+                    self.source.name,
+                    self.primary_key_column,
+                    self._join_values(batch),
+                    attempt < passes and self.commands.SKIP_LOCKED,
+                    self._condition(self.source.name)
+                ))
+                self.commit()
+                rows, latency = self.db.last_rowcount, time.time() - chunk_start
+                left = set(self._uncopied_pks(pks=batch))
+                copied = [pk for pk in batch if pk not in left]
+                self.skipped_pks.difference_update(copied)
+                if checkpoint:
+                    checkpoint.resolve(copied)
+                time.sleep(throttle)
+                self.progress.chunk(rows, latency, throttle, position=batch[-1])
+        return sorted(self.skipped_pks)
+
+    def plan(self, chunk_size=None, throttle=None, samples=3):
+        """Estimate the cost of the migration without running it.
+        Sampled chunks are timed as real copies and rolled back once the destination table exists,
+        otherwise only the reads are timed.
+        """
+        chunk_size = chunk_size if chunk_size else self.db.config['DEFAULT_CHUNK_SIZE']
+        throttle = throttle if throttle else self.db.config['DEFAULT_THROTTLE']
+        plan = MigrationPlan(self.source.name, self.db.config['DIALECT'], chunk_size, throttle)
+        plan.table_bytes, plan.estimated_rows = self.source.size_estimate
+        plan.index_bytes = self.source.index_size
+        plan.index_count = len(set(x.name for x in self.source.indexes))
+        plan.min_pk, plan.max_pk = self.source.min_pk, self.source.max_pk
+        plan.log_name = self.commands.LOG_NAME
+
+        for start in self._sample_points(plan.min_pk, plan.max_pk, samples):
+            plan.samples.append(self._sample_chunk(start, chunk_size))
+
+        referencing = sorted(set(x.table_name for x in self.source.foreign_keys
+                                 if x.referenced and not x.self_referential))
+        steps = [
+            ('create_triggers', [self.source.name]),
+            ('add_foreign_keys', [self.name] + referencing if referencing else []),
+            ('rename_tables', [self.source.name, self.name]),
+        ]
+        plan.locking_steps = [{'step': step, 'lock': self.commands.LOCKS[step], 'tables': tables}
+                              for step, tables in steps if tables and step in self.commands.LOCKS]
+        return plan
+
+    def preflight(self, headroom=1.2, transaction_seconds=60):
+        """Check the database for what would make the migration fail, without changing anything.
+        The extra space is the plan's estimate of the migrate_ table and its indexes, times headroom.
+        Transactions open for over transaction_seconds would block the trigger DDL.
+        """
+        report = PreflightReport(self.source.name, self.db.config['DIALECT'])
+        with self.profiled('preflight'):
+            self._check_primary_key(report)
+            self._check_triggers(report)
+            self._check_transactions(report, transaction_seconds)
+            self._check_disk(report, headroom)
+            self._check_settings(report)
+        return report
+
+    def _check_primary_key(self, report):
+        pk = self.primary_key_column
+        if any(x.type == 'PRIMARY KEY' and x.column == pk for x in self.source.constraints):
+            return
+        if any(x.column == pk and x.unique for x in self.source.indexes):
+            report.add(report.WARNING, 'primary_key', 'No primary key, chunks use the unique index on {}'.format(pk))
+        else:
+            report.add(report.BLOCKING, 'primary_key',
+                       'No primary key or unique index on {}, every chunk would scan the table'.format(pk))
+
+    def _check_triggers(self, report):
+        existing = self.get_source_triggers()
+        ours = set(self.triggers.values())
+        others = [x for x in existing if x not in ours]
+        if others:
+            report.add(report.BLOCKING, 'triggers',
+                       'The table has triggers, create_triggers would not install the capture triggers',
+                       triggers=others)
+        elif existing:
+            report.add(report.WARNING, 'triggers', 'Capture triggers of an earlier run exist, the copy resumes',
+                       triggers=existing, missing=sorted(ours - set(existing)))
+        if self.db.table_exists(self.name):
+            report.add(report.WARNING, 'migrate_table', '{} exists, the copy resumes into it'.format(self.name))
+
+    def _check_transactions(self, report, seconds):
+        long_running = self.execute(self.commands.long_transactions(seconds))
+        if long_running:
+            report.add(report.BLOCKING, 'long_transactions',
+                       '{} transactions open for over {}s would block the trigger DDL'.format(len(long_running), seconds),
+                       transactions=[{'id': x[0], 'seconds': x[1], 'state': x[2], 'query': (x[3] or '')[:200]}
+                                     for x in long_running])
+
+    def _check_disk(self, report, headroom):
+        sizes = MigrationPlan(self.source.name, report.dialect, 0, 0)
+        sizes.table_bytes = self.source.size_estimate[0]
+        sizes.index_bytes = self.source.index_size
+        report.extra_disk_bytes = int(sizes.extra_disk_bytes * headroom)
+        report.log_bytes = sizes.log_bytes
+        report.free_disk_bytes = self.db.free_disk_bytes
+        if report.free_disk_bytes is None:
+            report.add(report.WARNING, 'disk', 'Free disk space could not be read, {} extra bytes are needed'.format(
+                report.extra_disk_bytes))
+        elif report.free_disk_bytes < report.extra_disk_bytes:
+            report.add(report.BLOCKING, 'disk', '{} extra bytes are needed, {} are free'.format(
+                report.extra_disk_bytes, report.free_disk_bytes))
+        elif report.free_disk_bytes < report.extra_disk_bytes + report.log_bytes:
+            report.add(report.WARNING, 'disk', 'The {} written by the copy only fits if it is recycled'.format(
+                self.commands.LOG_NAME))
+
+    def _check_settings(self, report):
+        """Dialect settings the migration depends on"""
+        pass
+
+    @staticmethod
+    def _sample_points(min_pk, max_pk, samples):
+        """Spread sample start points over the primary key range"""
+        if min_pk is None:
+            return []
+        if not isinstance(min_pk, int) or not isinstance(max_pk, int) or samples < 2:
+            return [min_pk]
+        step = (max_pk - min_pk) / float(samples)
+        return sorted(set(min_pk + int(step * i) for i in range(samples)))
+
+    def _sample_chunk(self, start, chunk_size):
+        """Time a single chunk starting at start"""
+        if self.db.table_exists(self.name):
+            dest_cols, origin_cols = self._copy_columns()
+            sql = self.commands.copy_chunk(
+                self.name,
+                dest_cols,
+                origin_cols,
+                self.source.name,
+                self.primary_key_column,
+                start,
+                chunk_size
+            )
+            sample_start = time.time()
+            self.execute(sql)
+            rows = self.db.last_rowcount
+            seconds = time.time() - sample_start
+            self.db.rollback()
+            kind = 'copy'
+        else:
+            sql = self.commands.sample_chunk(
+                self.source.name,
+                self._qualify(self.source.name, self.source.columns),
+                self.primary_key_column,
+                start,
+                chunk_size
+            )
+            sample_start = time.time()
+            rows = len(self.execute(sql))
+            seconds = time.time() - sample_start
+            kind = 'read'
+        return {'start': start, 'rows': rows, 'seconds': seconds, 'kind': kind}
 
     def _trigger_name(self, type):
         """Create trigger name"""
         name = 'migration_trigger_{}_{}'.format(type.lower(), self.source.name)
         return name[:self.db.config['MAX_LENGTH_NAME']]
 
-    def rename_tables(self):
-        """Rename the tables"""
+    def _reverse_trigger_name(self, type):
+        """Create reverse trigger name"""
+        name = 'reverse_trigger_{}_{}'.format(type.lower(), self.source.name)
+        return name[:self.db.config['MAX_LENGTH_NAME']]
+
+    def _reverse_columns(self):
+        """Return the archive columns and the new table columns they are written from, renames undone"""
+        shared = sorted(set(self.columns).intersection(self.source.columns))
+        renames = sorted(self.renames)
+        return shared + [x[0] for x in renames], shared + [x[1] for x in renames]
+
+    def reverse_sync_statements(self, table, archive):
+        """Statements creating the triggers copying the writes on table into archive.
+        Trigger bodies only resolve archive when they fire, so they can be created before the rename.
+        """
+        dest_cols, origin_cols = self._reverse_columns()
+        return [
+            self.commands.insert_function(archive, self._join_cols(dest_cols), self._qualify('NEW', origin_cols)),
+            self.commands.insert_trigger(self._reverse_trigger_name('INSERT'), table, archive),
+            self.commands.update_function(archive, self._equals(dest_cols, 'NEW', origin_cols),
+                                          self.primary_key_column),
+            self.commands.update_trigger(self._reverse_trigger_name('UPDATE'), table, archive),
+            self.commands.delete_function(archive, self.primary_key_column),
+            self.commands.delete_trigger(self._reverse_trigger_name('DELETE'), table, archive),
+        ]
+
+    def drop_reverse_sync_statements(self, table, archive):
+        """Statements dropping the reverse triggers on table"""
+        statements = []
+        for type in ['INSERT', 'UPDATE', 'DELETE']:
+            statements.append(self.commands.drop_trigger(self._reverse_trigger_name(type), table))
+            statements.append(self.commands.drop_function('{}_{}'.format(type.lower(), archive)))
+        return statements
+
+    def rename_tables(self, schedule=None, reverse_sync=None):
+        """Rename the tables, waiting for a window of schedule first when there is one.
+        With reverse_sync, triggers on the new table copy its writes into the archive table for a grace
+        period of reverse_sync seconds, so rollback can swap the archive back in without losing any.
+        """
+        if schedule:
+            schedule.wait()
         self.delete_triggers()
         success = False
         source_name, archive_name, migrate_name = self.source.name, self.source.archive_name, self.name
-        try:
-            self.execute(self.commands.BEGIN)
-            self.execute(self.commands.rename_table(source_name, archive_name))
-            self.execute(self.commands.rename_table(migrate_name, source_name))
-            self.execute(self.commands.COMMIT)
-            success = True
-        except Exception as e:
-            print('Rename Error', e)
+        with self.progress.phase('cutover'), self.profiled('cutover'):
+            try:
+                self.execute(self.commands.BEGIN)
+                if reverse_sync is not None:
+                    for sql in self.reverse_sync_statements(migrate_name, archive_name):
+                        self.execute(sql)
+                self.execute(self.commands.rename_table(source_name, archive_name))
+                self.execute(self.commands.rename_table(migrate_name, source_name))
+                self.execute(self.commands.COMMIT)
+                success = True
+            except Exception as e:
+                print('Rename Error', e)
         if success:
             print('Rename complete!')
+            self.cutover_names = (source_name, archive_name, migrate_name)
+            if reverse_sync is not None:
+                self.grace_ends = time.time() + reverse_sync
             new = self.db.table(source_name)
             archive = self.db.table(archive_name)
             self.move_sequences(archive, new.name)
@@ -604,25 +1363,49 @@ class MigrationTable(Table):
         else:
             raise Exception('Unable to Rename')
 
-    def move_sequences(self, archive, new_table_name):
+    def rollback(self):
+        """Undo rename_tables during the grace period of a reverse sync:
+        the archive table takes back its name, the new table goes back to the migrate name.
+        Returns the restored and the migrated tables.
+        """
+        if self.grace_ends is None:
+            raise Exception('No reverse sync to roll back to, the archive table is stale')
+        source_name, archive_name, migrate_name = self.cutover_names
+        self.commit()
+        with self.progress.phase('cutover'):
+            self.execute(self.commands.BEGIN)
+            self.execute(self.commands.rename_table(source_name, migrate_name))
+            self.execute(self.commands.rename_table(archive_name, source_name))
+            for sql in self.drop_reverse_sync_statements(migrate_name, archive_name):
+                self.execute(sql)
+            self.execute(self.commands.COMMIT)
+        self.grace_ends = None
+        print('Rollback complete!')
+        restored = self.db.table(source_name)
+        migrated = self.db.table(migrate_name)
+        self.move_sequences(migrated, restored.name, restore_default=True)
+        return restored, migrated
+
+    def end_reverse_sync(self, force=False):
+        """Drop the reverse triggers once the grace period is over, or right away with force.
+        Returns True if they were dropped, after which rollback is no longer possible.
+        """
+        if self.grace_ends is None or (not force and time.time() < self.grace_ends):
+            return False
+        source_name, archive_name, migrate_name = self.cutover_names
+        for sql in self.drop_reverse_sync_statements(source_name, archive_name):
+            self.execute(sql)
+        self.commit()
+        self.grace_ends = None
+        return True
+
+    def move_sequences(self, archive, new_table_name, restore_default=False):
         archive_sequence_cols = archive.sequence_cols
         for seq, col in archive_sequence_cols:
             archive.remove_sequence_from_col(col)
             archive.set_sequence_owner(seq, new_table_name, col)
-
-    def log(self, start, current, last):
-        """Prints status logs"""
-        try:
-            percent_complete = ((current - start) / (float(last) - start))
-            if percent_complete == 0:
-                return
-            run_time = (datetime.datetime.now() - self.start_time).total_seconds()
-            remaining = (run_time / percent_complete) - run_time
-            time_remaining = datetime.timedelta(seconds=remaining)
-            print('Processed %d/%d %.2f%% - time left: %s' % (
-            current, last, percent_complete * 100, str(time_remaining)))
-        except TypeError:
-            print('Processed pk {} limit is {}'.format(current, last))
+            if restore_default:
+                self.db.table(new_table_name).set_sequence_default(seq, col)
 
 
 class Intersection(object):
@@ -655,10 +1438,42 @@ class Intersection(object):
         except AttributeError:
             return []
 
+    @property
+    def transforms(self):
+        """Return the destination column transforms"""
+        try:
+            return self.destination.transforms
+        except AttributeError:
+            return {}
+
+    @property
+    def computed_columns(self):
+        """The destination columns only written from a transform"""
+        mapped = self.intersection + self.dest_renames
+        return sorted(c for c in self.transforms if c not in mapped)
+
     @property
     def dest_columns(self):
         """The columns written to the destination table"""
-        return self.intersection + self.dest_renames
+        return self.intersection + self.dest_renames + self.computed_columns
+
+    def origin_values(self, row):
+        """The values written to the destination columns, read from row, the origin table or a trigger record"""
+        transforms = self.transforms
+        values = []
+        for dest, origin in zip_longest(self.dest_columns, self.origin_columns):
+            if dest in transforms:
+                values.append(transforms[dest].format(row=row))
+            else:
+                values.append(self._qualify(row, origin))
+        return values
+
+    def _qualify(self, row, column):
+        """Column of row, quoted as the destination dialect quotes it"""
+        try:
+            return self.destination._qualify(row, [column])
+        except AttributeError:
+            return '{}.{}'.format(row, column)
 
     @property
     def intersection(self):
@@ -0,0 +1,197 @@
+"""Statement level tracing for Database.execute"""
+import re
+import threading
+from collections import deque
+from contextlib import contextmanager
+from src.core.progress import ProgressEvent
+
+
+CATALOG_PATTERN = re.compile(
+    r'information_schema|pg_catalog|pg_class|pg_index|pg_attribute|pg_stat|pg_inherits|'
+    r'pg_relation_size|sqlite_master|pragma_|^\s*SHOW\s',
+    re.IGNORECASE
+)
+
+
+class LabelledSql(str):
+    """A sql string that remembers which commands method built it"""
+
+    def __new__(cls, sql, label):
+        obj = super(LabelledSql, cls).__new__(cls, sql)
+        obj.label = label
+        return obj
+
+
+class TracedCommands(object):
+    """Wraps a *Commands class so every sql string it builds is labelled with its origin"""
+
+    def __init__(self, commands):
+        """Wrap the commands class"""
+        self.wrapped = commands
+
+    def __getattr__(self, name):
+        attr = getattr(self.wrapped, name)
+        label = '{}.{}'.format(self.wrapped.__name__, name)
+        if isinstance(attr, str):
+            return LabelledSql(attr, label)
+        if not callable(attr):
+            return attr
+
+        def labelled(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return LabelledSql(result, label) if isinstance(result, str) else result
+        return labelled
+
+
+class StatementTrace(object):
+    """A single traced statement"""
+
+    def __init__(self, sql, duration, rows=None, round_trips=1, label=None, phase=None, error=None):
+        """Set the trace data"""
+        self.sql = sql
+        self.duration = duration
+        self.rows = rows if rows is not None and rows >= 0 else None
+        self.round_trips = round_trips
+        self.label = label or 'unlabelled'
+        self.phase = phase
+        self.error = error
+        self.command = self.command_type(sql)
+        self.catalog = bool(CATALOG_PATTERN.search(sql))
+
+    @staticmethod
+    def command_type(sql):
+        """Return the leading sql keyword, i.e. SELECT, INSERT, ALTER"""
+        match = re.match(r'\s*\(?\s*([A-Za-z]+)', sql)
+        return match.group(1).upper() if match else ''
+
+    def as_dict(self):
+        """Return the trace as a plain dictionary"""
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        """String representation"""
+        return '{} [{}] {} {:.4f}s rows={}'.format(self.phase, self.label, self.command, self.duration, self.rows)
+
+
+class QueryTracer(object):
+    """
+    Records command type, duration, rows and round-trips per statement, aggregated
+    per phase and per commands method, and keeps a log of statements slower than slow_threshold.
+    Register it as a progress listener to have migration phases label the statements.
+    """
+
+    def __init__(self, slow_threshold=1.0, slow_log_size=1000, slow_log_path=None):
+        """Initialize the tracer"""
+        self.slow_threshold = slow_threshold
+        self.slow_log = deque(maxlen=slow_log_size)
+        self.slow_log_path = slow_log_path
+        self.stats = {}
+        self._open = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @property
+    def current_phase(self):
+        """The innermost phase of this thread. A thread without one, such as a pooled copy worker,
+        runs in the latest phase still open on another thread
+        """
+        if self._stack:
+            return self._stack[-1]
+        with self._lock:
+            return self._open[-1][1] if self._open else None
+
+    def _push(self, name):
+        entry = (threading.get_ident(), name)
+        self._stack.append(entry[1])
+        with self._lock:
+            self._open.append(entry)
+
+    def _pop(self):
+        entry = (threading.get_ident(), self._stack.pop())
+        with self._lock:
+            index = len(self._open) - 1 - self._open[::-1].index(entry)
+            del self._open[index]
+
+    @contextmanager
+    def phase(self, name):
+        """Label the statements run inside the block with a phase name"""
+        self._push(name)
+        try:
+            yield self
+        finally:
+            self._pop()
+
+    def __call__(self, event):
+        """Progress listener, follows the migration phases of the thread running them"""
+        if event.kind == ProgressEvent.PHASE_START:
+            self._push(event.phase)
+        elif event.kind == ProgressEvent.PHASE_END and self._stack:
+            self._pop()
+
+    def record(self, sql, duration, rows=None, round_trips=1, label=None, error=None):
+        """Record an executed statement"""
+        trace = StatementTrace(sql, duration, rows, round_trips, label, self.current_phase, error)
+        with self._lock:
+            stat = self.stats.setdefault((trace.phase, trace.label), {
+                'command': trace.command,
+                'catalog': trace.catalog,
+                'statements': 0,
+                'round_trips': 0,
+                'rows': 0,
+                'errors': 0,
+                'duration': 0.0,
+                'max_duration': 0.0,
+            })
+            stat['statements'] += 1
+            stat['round_trips'] += round_trips
+            stat['rows'] += trace.rows or 0
+            stat['errors'] += 1 if error else 0
+            stat['duration'] += duration
+            stat['max_duration'] = max(stat['max_duration'], duration)
+            if duration >= self.slow_threshold:
+                self.slow_log.append(trace)
+                if self.slow_log_path:
+                    with open(self.slow_log_path, 'a') as f:
+                        f.write('{:.4f}s {} [{}] {}\n'.format(
+                            duration, trace.phase, trace.label, re.sub(r'\s+', ' ', sql).strip()))
+        return trace
+
+    def summary(self):
+        """Return totals per phase, with a breakdown per commands method"""
+        phases = {}
+        with self._lock:
+            for (phase, label), stat in self.stats.items():
+                totals = phases.setdefault(phase, {
+                    'statements': 0,
+                    'round_trips': 0,
+                    'duration': 0.0,
+                    'catalog_statements': 0,
+                    'catalog_duration': 0.0,
+                    'by_label': {},
+                })
+                totals['statements'] += stat['statements']
+                totals['round_trips'] += stat['round_trips']
+                totals['duration'] += stat['duration']
+                if stat['catalog']:
+                    totals['catalog_statements'] += stat['statements']
+                    totals['catalog_duration'] += stat['duration']
+                totals['by_label'][label] = dict(stat)
+        return phases
+
+    def top(self, n=10, key='duration'):
+        """Return the n (phase, label, stats) entries with the highest key, i.e. duration or round_trips"""
+        with self._lock:
+            entries = [(phase, label, dict(stat)) for (phase, label), stat in self.stats.items()]
+        return sorted(entries, key=lambda entry: entry[2][key], reverse=True)[:n]
+
+    def reset(self):
+        """Clear the collected statistics"""
+        with self._lock:
+            self.stats = {}
+            self.slow_log.clear()
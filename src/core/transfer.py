@@ -0,0 +1,227 @@
+"""Copies of a table between databases of different dialects"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from src.core.chunking import ChunkPlanner, Checkpoint
+from src.core.progress import Progress, ConsoleReporter
+
+
+class TableTransfer(object):
+    """
+    Copies a table of one database into a new table of a database of another dialect.
+    The table is created from the translated source schema, then each primary key range is streamed
+    from the source into the target, batch_size rows at a time, and the indexes and foreign keys
+    are added once the rows are in. Subclasses translate the schema and the values for a pair of dialects.
+
+    There is no change capture across databases, the source must not be written to while it is copied,
+    or the ranges written to copied again with copy_ranges.
+    """
+
+    def __init__(self, source, target_db, name=None, batch_size=1000):
+        """Initialize the transfer of the source table into the table name of target_db"""
+        self.source = source
+        self.source_db = source.db
+        self.target_db = target_db
+        self.name = name or source.name
+        self.primary_key_column = source.primary_key_column
+        self.batch_size = batch_size
+        self.columns = source.columns
+        self.ranges = []
+        self.warnings = []
+        self.progress = Progress(self.name)
+        if self.source_db.config.get('PROGRESS_CONSOLE', True):
+            self.progress.add_listener(ConsoleReporter())
+
+    @property
+    def target(self):
+        return self.target_db.table(self.name, self.primary_key_column)
+
+    def profiled(self, section):
+        """Account the block to section when either database is profiling"""
+        profiler = self.target_db.profiler or self.source_db.profiler
+        return profiler.section(section) if profiler else nullcontext()
+
+    def warn(self, message):
+        """Record something the target cannot reproduce"""
+        self.warnings.append(message)
+        print('Warning: {}'.format(message))
+
+    def create_statement(self):
+        """Return the create statement of the target table, with its primary key"""
+        raise NotImplementedError
+
+    def index_statements(self):
+        """Return the statements adding the secondary indexes to the target table"""
+        return []
+
+    def prepare(self, source_db, target_db):
+        """Set up a pair of connections before they copy rows"""
+        pass
+
+    def read_range(self, chunk, source_db):
+        """Yield the source rows of the range in primary key order"""
+        sql = source_db.commands.select_range(
+            self.source.name, ', '.join(self.columns), self.primary_key_column, chunk.start, chunk.end)
+        return source_db.stream(sql, self.batch_size)
+
+    def write_range(self, chunk, rows, target_db):
+        """Replace the range of the target table with rows, return the rows written"""
+        raise NotImplementedError
+
+    def normalize(self, column, value):
+        """Return value of column in a form equal on both sides when the rows match"""
+        return value
+
+    def run(self, chunk_size=None, throttle=None, workers=1, checkpoint=None, method='auto', samples=100):
+        """Create the target table if it does not exist, copy the rows, add the indexes and foreign keys,
+        then verify the copy. Returns the verification result.
+        """
+        self.prepare(self.source_db, self.target_db)
+        if not self.target_db.table_exists(self.name):
+            with self.progress.phase('ddl'), self.profiled('setup'):
+                self.target_db.execute(self.create_statement())
+                self.target_db.commit()
+        self.copy(chunk_size, throttle, workers, checkpoint, method)
+        self.finish()
+        return self.verify(samples)
+
+    def copy(self, chunk_size=None, throttle=None, workers=1, checkpoint=None, method='auto'):
+        """Copy the source rows range by range, planned as in ChunkPlanner.
+        checkpoint is a Checkpoint or a path, a restarted copy skips the ranges it recorded.
+        """
+        chunk_size = chunk_size if chunk_size else self.source_db.config['DEFAULT_CHUNK_SIZE']
+        throttle = throttle if throttle else self.source_db.config['DEFAULT_THROTTLE']
+        if isinstance(checkpoint, str):
+            checkpoint = Checkpoint(checkpoint)
+        if checkpoint and checkpoint.ranges:
+            self.ranges = checkpoint.ranges
+        else:
+            self.ranges = ChunkPlanner(self.source, chunk_size).plan(method)
+            if checkpoint:
+                checkpoint.start(self.ranges)
+        pending = [r for r in self.ranges if not (checkpoint and checkpoint.is_done(r))]
+        self.progress.expect(self.source.size_estimate[1], self.source.average_row_size)
+        with self.progress.phase('copy'), self.profiled('copy'):
+            self.copy_ranges(pending, throttle, checkpoint, workers)
+        if checkpoint:
+            checkpoint.clear()
+
+    def copy_ranges(self, ranges, throttle=0, checkpoint=None, workers=1):
+        """Copy the ranges in order, or on up to workers pairs of pooled sessions"""
+        work = deque(ranges)
+        lock = threading.Lock()
+        parallel = workers > 1 and len(work) > 1
+        if parallel and not (self.source_db.pool and self.target_db.pool):
+            raise ValueError('Copying with {} workers needs a connection pool on both databases'.format(workers))
+
+        def take():
+            with lock:
+                return work.popleft() if work else None
+
+        def drain(source_db, target_db):
+            chunk = take()
+            while chunk is not None:
+                self.copy_range(chunk, source_db, target_db, throttle, checkpoint, lock)
+                chunk = take()
+
+        def run():
+            with self.source_db.session() as source_db, self.target_db.session() as target_db:
+                self.prepare(source_db, target_db)
+                drain(source_db, target_db)
+
+        if not parallel:
+            return drain(self.source_db, self.target_db)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run) for _ in range(workers)]
+            for future in futures:
+                future.result()
+
+    def copy_range(self, chunk, source_db, target_db, throttle=0, checkpoint=None, lock=None):
+        """Copy one range, then checkpoint it, throttle and report progress"""
+        chunk_start = time.time()
+        with self.profiled('chunk'):
+            try:
+                rows = self.write_range(chunk, self.read_range(chunk, source_db), target_db)
+            except Exception:
+                target_db.rollback()
+                raise
+            # End the read snapshot, it holds back the purge of the source
+            source_db.commit()
+        latency = time.time() - chunk_start
+        with lock or nullcontext():
+            if checkpoint:
+                checkpoint.mark(chunk)
+        time.sleep(throttle)
+        with lock or nullcontext():
+            self.progress.chunk(rows, latency, throttle, position=chunk.end)
+
+    def finish(self):
+        """Add the secondary indexes and foreign keys once the rows are in"""
+        with self.progress.phase('ddl'):
+            with self.profiled('indexes'):
+                for sql in self.index_statements():
+                    self.target_db.execute(sql)
+                    self.target_db.commit()
+            with self.profiled('foreign_keys'):
+                self.add_foreign_keys()
+
+    def add_foreign_keys(self):
+        """Add the foreign keys of the source whose referenced table exists in the target"""
+        target = self.target
+        for key in self.source.foreign_keys:
+            if not key.fk_table_name:
+                continue
+            fk_table = self.name if key.fk_table_name == self.source.name else key.fk_table_name
+            if not self.target_db.table_exists(fk_table):
+                self.warn('Foreign key {} not added, {} is not in the target database'.format(key.name, fk_table))
+                continue
+            target.add_foreign_key(self.name, key.column_name, fk_table, key.fk_column, name=key.name)
+
+    def sample_pks(self, samples):
+        """Return about samples pks spread over the source, from its sample or seeks along the pk span"""
+        pks = self.source.pk_sample(samples)
+        if pks:
+            return pks
+        min_pk, max_pk = self.source.min_pk, self.source.max_pk
+        if not isinstance(min_pk, int) or not isinstance(max_pk, int):
+            return [min_pk] if min_pk is not None else []
+        planner = ChunkPlanner(self.source, 1)
+        step = (max_pk - min_pk) / float(max(samples, 1))
+        points = sorted(set(min_pk + int(step * i) for i in range(samples)))
+        return sorted(set(pk for pk in (planner.pk_after(point - 1) for point in points) if pk is not None))
+
+    def verify(self, samples=100):
+        """Compare the row counts of every range of both tables, then the values of a sample of rows.
+        Returns a dictionary of the mismatches found, ok when there are none.
+        """
+        source, target = self.source, self.target
+        ranges = self.ranges or ChunkPlanner(source, self.source_db.config['DEFAULT_CHUNK_SIZE']).plan()
+        with self.progress.phase('verify'), self.profiled('verify'):
+            count_mismatches = []
+            for chunk in ranges:
+                counts = [t.execute(t.commands.count_range(t.name, self.primary_key_column, chunk.start, chunk.end))[0][0]
+                          for t in (source, target)]
+                if counts[0] != counts[1]:
+                    count_mismatches.append({'start': chunk.start, 'end': chunk.end,
+                                             'source': counts[0], 'target': counts[1]})
+            pks = self.sample_pks(samples)
+            row_mismatches = []
+            if pks:
+                cols = ', '.join(self.columns)
+                index = self.columns.index(self.primary_key_column)
+                rows = [dict((row[index], row) for row in t.execute(t.commands.get_rows(
+                    cols, t.name, self.primary_key_column, source._join_values(pks)))) for t in (source, target)]
+                for pk in pks:
+                    values = [[self.normalize(c, v) for c, v in zip(self.columns, r[pk])] if pk in r else None
+                              for r in rows]
+                    if values[0] != values[1]:
+                        row_mismatches.append(pk)
+        return {
+            'ranges': len(ranges),
+            'count_mismatches': count_mismatches,
+            'sampled': len(pks),
+            'row_mismatches': row_mismatches,
+            'ok': not count_mismatches and not row_mismatches,
+        }
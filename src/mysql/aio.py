@@ -0,0 +1,23 @@
+from src.core.aio import AsyncDatabase
+from src.mysql.commands import MySqlCommands
+
+
+class AsyncMySqlDatabase(AsyncDatabase):
+    '''MySql database reached through an aiomysql pool'''
+
+    def __init__(self, name, pool, config):
+        '''Initialize the database'''
+        super(AsyncMySqlDatabase, self).__init__(name, pool, config)
+        self.commands = MySqlCommands
+
+    async def _fetch(self, connection, sql):
+        async with connection.cursor() as dbc:
+            await dbc.execute(sql)
+            return [tuple(row) for row in await dbc.fetchall()]
+
+    async def _execute(self, connection, sql):
+        async with connection.cursor() as dbc:
+            await dbc.execute(sql)
+            rowcount = dbc.rowcount
+        await connection.commit()
+        return rowcount
@@ -1,18 +1,68 @@
-from src.core.base import Database
+import importlib
+import time
+from src.core.base import Database, StatementResult
 from src.mysql.commands import MySqlCommands
-from src.mysql.tables import MysqlTable, MySqlMigrationTable
+from src.mysql.tables import MysqlTable, MySqlMigrationTable, MySqlShadowColumn
 
 
 class MySqlDatabase(Database):
     '''Model representing a MySql database'''
 
-    def __init__(self, name, connection, config):
+    def __init__(self, name, connection, config, pool=None):
         '''Initialize the database'''
-        super(MySqlDatabase, self).__init__(name, connection, config)
+        super(MySqlDatabase, self).__init__(name, connection, config, pool)
         self.commands = MySqlCommands
         self.table_class = MysqlTable
         self.migration_table_class = MySqlMigrationTable
+        self.shadow_column_class = MySqlShadowColumn
+
+    def error_code(self, error):
+        '''Error number, the first argument of a MySql driver error'''
+        if error.args and isinstance(error.args[0], int):
+            return error.args[0]
+        return None
+
+    @property
+    def is_local(self):
+        '''MySQLdb describes its connection as "Localhost via UNIX socket" or "<host> via TCP/IP",
+        PyMySQL keeps its host and socket
+        '''
+        if hasattr(self.connection, 'get_host_info'):
+            host_info = self.connection.get_host_info()
+            if isinstance(host_info, bytes):
+                host_info = host_info.decode('utf-8')
+            host = host_info.split(' via ')[0]
+            return 'UNIX socket' in host_info or self._local_host(host.lower())
+        if getattr(self.connection, 'unix_socket', None):
+            return True
+        return self._local_host(getattr(self.connection, 'host', None))
 
     def set_foreign_key_checks(self, state=True):
         '''Set foreign key checks on database'''
         self.execute(self.commands.set_foreign_key_checks(state))
+
+    def stream_cursor(self):
+        '''Unbuffered cursor of the driver, rows come from the server as they are fetched.
+        The connection runs no other statement until they are all read.
+        '''
+        cursors = importlib.import_module(type(self.connection).__module__.split('.')[0] + '.cursors')
+        return self.connection.cursor(cursors.SSCursor)
+
+    def send_pipeline(self, sql_list, previous=()):
+        '''Send the statements as one multi-statement query, then read the result of each in turn.
+        The server stops at the first failed statement. Needs the MULTI_STATEMENTS client flag,
+        which MySQLdb sets by default, and statements returning one result each, so no CALL.
+        '''
+        results = []
+        started = time.time()
+        with self.cursor() as dbc:
+            try:
+                dbc.execute(';\n'.join(sql.rstrip().rstrip(';') for sql in sql_list))
+                for sql in sql_list:
+                    results.append(StatementResult(sql, dbc.fetchall() if dbc.description else None, dbc.rowcount))
+                    if not dbc.nextset():
+                        break
+            except Exception as e:
+                results.append(StatementResult(sql_list[len(results)], error=e))
+        self._trace_pipeline(results, started)
+        return results
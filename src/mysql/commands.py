@@ -1,6 +1,20 @@
+import math
+
 
 class MySqlCommands(object):
 
+    LOG_NAME = 'binlog'
+    # Strongest lock taken by each migration step that blocks the application
+    LOCKS = {
+        'create_triggers': 'EXCLUSIVE METADATA',
+        'add_foreign_keys': 'SHARED_NO_WRITE METADATA',
+        'rename_tables': 'EXCLUSIVE METADATA',
+    }
+    # Error numbers worth retrying a chunk for: lock wait timeout, deadlock, max_execution_time exceeded
+    RETRIABLE_ERRORS = {1205, 1213, 3024}
+    TIMEOUT_ERRORS = {1205, 3024}
+    SKIP_LOCKED = True
+
     @staticmethod
     def get_tables(database_name):
         return 'SHOW TABLES IN {}'.format(database_name)
@@ -35,6 +49,13 @@ class MySqlCommands(object):
                   WHERE {}={}
                '''.format(cols, table, pk_col, pk)
 
+    @staticmethod
+    def get_rows(cols, table, pk_col, pk_list):
+        return '''SELECT {}
+                  FROM {}
+                  WHERE {} IN ({})
+                  ORDER BY {}'''.format(cols, table, pk_col, pk_list, pk_col)
+
     @staticmethod
     def insert_row(table, cols, vals):
         return '''INSERT INTO {} (
@@ -58,6 +79,39 @@ class MySqlCommands(object):
     def table_count(tablename):
         return 'SELECT COUNT(1) FROM {}'.format(tablename)
 
+    @staticmethod
+    def table_size(database_name, tablename):
+        return '''SELECT DATA_LENGTH, TABLE_ROWS
+                  FROM INFORMATION_SCHEMA.TABLES
+                  WHERE TABLE_SCHEMA = '{}'
+                  AND TABLE_NAME = '{}';'''.format(database_name, tablename)
+
+    @staticmethod
+    def table_bloat(database_name, tablename):
+        return '''SELECT DATA_LENGTH, TABLE_ROWS, DATA_FREE
+                  FROM INFORMATION_SCHEMA.TABLES
+                  WHERE TABLE_SCHEMA = '{}'
+                  AND TABLE_NAME = '{}';'''.format(database_name, tablename)
+
+    @staticmethod
+    def analyze(tablename):
+        return 'ANALYZE TABLE `{}`'.format(tablename)
+
+    @staticmethod
+    def set_storage(tablename, params):
+        """params are table options, like ROW_FORMAT or KEY_BLOCK_SIZE"""
+        return 'ALTER TABLE `{}` {}'.format(
+            tablename,
+            ' '.join('{}={}'.format(k, v) for k, v in sorted(params.items()))
+        )
+
+    @staticmethod
+    def index_size(database_name, tablename):
+        return '''SELECT INDEX_LENGTH
+                  FROM INFORMATION_SCHEMA.TABLES
+                  WHERE TABLE_SCHEMA = '{}'
+                  AND TABLE_NAME = '{}';'''.format(database_name, tablename)
+
     @staticmethod
     def table_columns(tablename):
         return '''SHOW COLUMNS IN {};'''.format(tablename)
@@ -70,6 +124,22 @@ class MySqlCommands(object):
                  AND TABLE_NAME = '{}'
                  AND COLUMN_NAME = '{}';'''.format(database_name, tablename, column_name)
 
+    @staticmethod
+    def column_definitions(database_name, tablename):
+        return '''SELECT COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_DEFAULT, EXTRA
+                 FROM INFORMATION_SCHEMA.COLUMNS
+                 WHERE TABLE_SCHEMA = '{}'
+                 AND TABLE_NAME = '{}'
+                 ORDER BY ORDINAL_POSITION;'''.format(database_name, tablename)
+
+    @staticmethod
+    def index_definitions(database_name, tablename):
+        return '''SELECT INDEX_NAME, NON_UNIQUE, COLUMN_NAME, INDEX_TYPE
+                 FROM INFORMATION_SCHEMA.STATISTICS
+                 WHERE TABLE_SCHEMA = '{}'
+                 AND TABLE_NAME = '{}'
+                 ORDER BY INDEX_NAME, SEQ_IN_INDEX;'''.format(database_name, tablename)
+
     @staticmethod
     def add_column(tablename, column_name, definition):
         return 'ALTER TABLE {} ADD COLUMN `{}` {}'.format(tablename, column_name, definition)
@@ -172,6 +242,19 @@ class MySqlCommands(object):
     def drop_foreign_key(fk_tablename, fk_name):
         return 'ALTER TABLE {} DROP FOREIGN KEY IF EXISTS {}'.format(fk_tablename, fk_name)
 
+    @staticmethod
+    def get_partitions(database_name, tablename):
+        return '''SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS
+                  FROM information_schema.PARTITIONS
+                  WHERE TABLE_SCHEMA = '{}'
+                  AND TABLE_NAME = '{}'
+                  AND PARTITION_NAME IS NOT NULL
+                  ORDER BY PARTITION_ORDINAL_POSITION;'''.format(database_name, tablename)
+
+    @staticmethod
+    def partition_relation(tablename, partition):
+        return '{} PARTITION ({})'.format(tablename, partition)
+
     @staticmethod
     def get_indexes(tablename):
         return '''SHOW INDEX FROM {}'''.format(tablename)
@@ -215,22 +298,29 @@ class MySqlCommands(object):
 
 
     @staticmethod
-    def insert_trigger(trigger_name, source_table, dest_table, columns, values):
+    def insert_trigger(trigger_name, source_table, dest_table, columns, values, condition=None):
+        """With a condition on NEW, only the rows matching it are inserted"""
         return '''CREATE TRIGGER {trigger_name}
               AFTER INSERT ON {source_table}
               FOR EACH ROW
-              INSERT INTO {dest_table} ({columns}) VALUES {values}
+              INSERT INTO {dest_table} ({columns}) SELECT {values} FROM DUAL{where}
               '''.format(
             trigger_name=trigger_name,
             source_table=source_table,
             dest_table=dest_table,
             columns=columns,
-            values=values
+            values=values,
+            where=' WHERE ' + condition if condition else ''
         )
 
     @staticmethod
-    def update_trigger(trigger_name, source_table, dest_table, equalities, pk_col):
-        return '''CREATE TRIGGER {trigger_name}
+    def update_trigger(trigger_name, source_table, dest_table, equalities, pk_col,
+                       condition=None, old_condition=None, columns=None, values=None):
+        """With a condition on NEW, rows updated out of it are deleted from dest_table,
+        and rows updated into it, not matching old_condition on OLD, are inserted from columns and values
+        """
+        if not condition:
+            return '''CREATE TRIGGER {trigger_name}
                  AFTER UPDATE ON {source_table}
                  FOR EACH ROW
                  UPDATE {dest_table} SET {equalities}
@@ -241,6 +331,30 @@ class MySqlCommands(object):
                           equalities=equalities,
                           pk_col=pk_col
                           )
+        return '''CREATE TRIGGER {trigger_name}
+                 AFTER UPDATE ON {source_table}
+                 FOR EACH ROW
+                 BEGIN
+                   IF {condition} THEN
+                     UPDATE {dest_table} SET {equalities}
+                     WHERE `{pk_col}`=`NEW`.`{pk_col}`;
+                     IF {old_condition} IS NOT TRUE THEN
+                       INSERT IGNORE INTO {dest_table} ({columns}) VALUES ({values});
+                     END IF;
+                   ELSE
+                     DELETE IGNORE FROM {dest_table} WHERE `{pk_col}`=`NEW`.`{pk_col}`;
+                   END IF;
+                 END
+               '''.format(trigger_name=trigger_name,
+                          source_table=source_table,
+                          dest_table=dest_table,
+                          equalities=equalities,
+                          pk_col=pk_col,
+                          condition=condition,
+                          old_condition=old_condition,
+                          columns=columns,
+                          values=values
+                          )
 
     @staticmethod
     def delete_trigger(trigger_name, source_table, dest_table, pk_col):
@@ -256,6 +370,44 @@ class MySqlCommands(object):
             pk_col=pk_col
         )
 
+    @staticmethod
+    def shadow_trigger(trigger_name, table, event, shadow_col, value):
+        return '''CREATE TRIGGER {trigger_name}
+              BEFORE {event} ON {table}
+              FOR EACH ROW
+              SET NEW.`{shadow_col}` = {value}
+              '''.format(
+            trigger_name=trigger_name,
+            event=event,
+            table=table,
+            shadow_col=shadow_col,
+            value=value
+        )
+
+    @staticmethod
+    def lock_table(tablename):
+        return 'LOCK TABLES {} WRITE'.format(tablename)
+
+    @staticmethod
+    def unlock_tables():
+        return 'UNLOCK TABLES'
+
+    @staticmethod
+    def swap_columns(tablename, column, old_name, shadow_col, old_definition, new_definition):
+        """Both renames in one ALTER"""
+        return [
+            '''ALTER TABLE {table}
+               CHANGE COLUMN `{column}` `{old_name}` {old_definition},
+               CHANGE COLUMN `{shadow_col}` `{column}` {new_definition}'''.format(
+                table=tablename,
+                column=column,
+                old_name=old_name,
+                old_definition=old_definition,
+                shadow_col=shadow_col,
+                new_definition=new_definition
+            ),
+        ]
+
     @staticmethod
     def drop_trigger(trigger_name, source_table):
         return 'DROP TRIGGER IF EXISTS `{}`'.format(
@@ -276,6 +428,114 @@ class MySqlCommands(object):
             limit=limit
         )
 
+    @staticmethod
+    def sample_chunk(source_table, origin_cols, pk_col, last_pk, limit):
+        return '''SELECT {origin_cols} FROM {source}
+                  WHERE {source}.{pk_col} >= {last_pk}
+                  ORDER BY {source}.{pk_col}
+                  LIMIT {limit};
+              '''.format(
+            origin_cols=origin_cols,
+            source=source_table,
+            pk_col=pk_col,
+            last_pk=last_pk,
+            limit=limit
+        )
+
+    @staticmethod
+    def _pk_range(pk_col, start, end):
+        """Conditions bounding pk_col to [start, end), either end may be open"""
+        conditions = []
+        if start is not None:
+            conditions.append('{} >= {}'.format(pk_col, start))
+        if end is not None:
+            conditions.append('{} < {}'.format(pk_col, end))
+        return conditions
+
+    @staticmethod
+    def seek_pk(table, pk_col, pk):
+        return 'SELECT MIN({pk_col}) FROM {table} WHERE {pk_col} > {pk}'.format(
+            pk_col=pk_col,
+            table=table,
+            pk=pk
+        )
+
+    @staticmethod
+    def long_transactions(seconds):
+        return '''SELECT trx_mysql_thread_id, TIMESTAMPDIFF(SECOND, trx_started, NOW()), trx_state, trx_query
+                  FROM information_schema.INNODB_TRX
+                  WHERE trx_started < NOW() - INTERVAL {} SECOND
+                  AND trx_mysql_thread_id <> CONNECTION_ID()
+                  ORDER BY trx_started;'''.format(int(seconds))
+
+    @staticmethod
+    def data_directory():
+        return 'SELECT @@datadir'
+
+    @staticmethod
+    def binlog_settings():
+        return 'SELECT @@log_bin, @@binlog_format'
+
+    @staticmethod
+    def explain(sql):
+        return 'EXPLAIN FORMAT=JSON {}'.format(sql.rstrip().rstrip(';'))
+
+    @classmethod
+    def count_range(cls, table, pk_col, start, end):
+        return 'SELECT COUNT(*) FROM {} WHERE {}'.format(table, ' AND '.join(cls._pk_range(pk_col, start, end)) or '1=1')
+
+    @classmethod
+    def select_range(cls, table, cols, pk_col, start, end):
+        return '''SELECT {cols} FROM {table}
+                  WHERE {conditions}
+                  ORDER BY {pk_col}'''.format(
+            cols=cols,
+            table=table,
+            conditions=' AND '.join(cls._pk_range(pk_col, start, end)) or '1=1',
+            pk_col=pk_col
+        )
+
+    @staticmethod
+    def set_time_zone():
+        return "SET time_zone = '+00:00'"
+
+    @staticmethod
+    def statement_timeout(seconds):
+        """max_execution_time only applies to SELECT, INSERT ... SELECT is bounded by its lock waits"""
+        return 'SET SESSION innodb_lock_wait_timeout = {}'.format(max(int(math.ceil(seconds)), 1))
+
+    @staticmethod
+    def current_timeout():
+        """The session setting statement_timeout changes, saved to restore after the chunk"""
+        return 'SELECT @@SESSION.innodb_lock_wait_timeout'
+
+    @staticmethod
+    def restore_timeout(previous):
+        return 'SET SESSION innodb_lock_wait_timeout = {}'.format(previous)
+
+    @classmethod
+    def chunk_boundaries(cls, table, pk_col, chunk_size, start=None, end=None):
+        conditions = cls._pk_range(pk_col, start, end)
+        return '''SELECT T1.{pk_col} FROM (
+                  SELECT {pk_col}, ROW_NUMBER() OVER (ORDER BY {pk_col}) AS chunk_row
+                  FROM {table}
+                  {where}) AS T1
+                  WHERE (T1.chunk_row - 1) % {chunk_size} = 0
+                  ORDER BY T1.{pk_col};'''.format(
+            pk_col=pk_col,
+            table=table,
+            where='WHERE ' + ' AND '.join(conditions) if conditions else '',
+            chunk_size=chunk_size
+        )
+
+    @staticmethod
+    def pk_histogram(database_name, tablename, pk_col):
+        return '''SELECT HISTOGRAM
+                  FROM information_schema.COLUMN_STATISTICS
+                  WHERE SCHEMA_NAME = '{}'
+                  AND TABLE_NAME = '{}'
+                  AND COLUMN_NAME = '{}';'''.format(database_name, tablename, pk_col)
+
     @staticmethod
     def copy_chunk(table, dest_cols, origin_cols, source_table, pk_col, last_pk, limit):
         return '''INSERT IGNORE INTO {table} ({dest_cols}) (
@@ -297,6 +557,106 @@ class MySqlCommands(object):
             limit=limit
         )
 
+    @classmethod
+    def delete_range(cls, table, pk_col, where, start, end):
+        conditions = cls._pk_range(pk_col, start, end) + (['({})'.format(where)] if where else [])
+        return '''DELETE FROM {table}
+                  WHERE {conditions};'''.format(
+            table=table,
+            conditions=' AND '.join(conditions) or '1=1'
+        )
+
+    @classmethod
+    def update_range(cls, table, col_val, pk_col, where, start, end):
+        conditions = cls._pk_range(pk_col, start, end) + (['({})'.format(where)] if where else [])
+        return '''UPDATE {table}
+                  SET {col_val}
+                  WHERE {conditions};'''.format(
+            table=table,
+            col_val=col_val,
+            conditions=' AND '.join(conditions) or '1=1'
+        )
+
+    @classmethod
+    def copy_range(cls, table, dest_cols, origin_cols, source_table, pk_col, start, end,
+                   source_partition=None, dest_partition=None, skip_locked=False, order_by=None,
+                   condition=None):
+        """Partitions are selected with the PARTITION clause.
+        With skip_locked (MySql 8), source rows locked by other transactions are left for a later pass.
+        order_by are qualified source columns the rows are inserted in the order of.
+        Only the source rows matching condition are copied.
+        """
+        conditions = cls._pk_range('{}.{}'.format(source_table, pk_col), start, end)
+        if condition:
+            conditions.append(condition)
+        source = '{} PARTITION ({})'.format(source_table, source_partition) if source_partition else source_table
+        dest = '{} PARTITION ({})'.format(table, dest_partition) if dest_partition else table
+        return '''INSERT IGNORE INTO {dest} ({dest_cols}) (
+                  SELECT {origin_cols} FROM {source_rel}
+                  LEFT OUTER JOIN {dest}
+                  ON {source}.{pk_col}={table}.{pk_col}
+                  WHERE {table}.{pk_col} IS NULL
+                  {range}
+                  {order}
+                  {lock}
+                  );
+              '''.format(
+            table=table,
+            dest_cols=dest_cols,
+            origin_cols=origin_cols,
+            source=source_table,
+            source_rel=source,
+            dest=dest,
+            pk_col=pk_col,
+            range=''.join(' AND ' + c for c in conditions),
+            order='ORDER BY ' + order_by if order_by else '',
+            lock='FOR SHARE OF {} SKIP LOCKED'.format(source_table) if skip_locked else ''
+        )
+
+    @staticmethod
+    def copy_rows(table, dest_cols, origin_cols, source_table, pk_col, pk_list, skip_locked=False, condition=None):
+        return '''INSERT IGNORE INTO {table} ({dest_cols}) (
+                  SELECT {origin_cols} FROM {source}
+                  LEFT OUTER JOIN {table}
+                  ON {source}.{pk_col}={table}.{pk_col}
+                  WHERE {table}.{pk_col} IS NULL
+                  AND {source}.{pk_col} IN ({pk_list}){condition}
+                  {lock}
+                  );
+              '''.format(
+            table=table,
+            dest_cols=dest_cols,
+            origin_cols=origin_cols,
+            source=source_table,
+            pk_col=pk_col,
+            pk_list=pk_list,
+            condition=' AND ' + condition if condition else '',
+            lock='FOR SHARE OF {} SKIP LOCKED'.format(source_table) if skip_locked else ''
+        )
+
+    @classmethod
+    def uncopied_pks(cls, table, source_table, pk_col, start=None, end=None, pk_list=None, source_partition=None,
+                     condition=None):
+        """Pks of the source rows in [start, end), or in pk_list, matching condition and missing from table"""
+        conditions = cls._pk_range('{}.{}'.format(source_table, pk_col), start, end)
+        if pk_list:
+            conditions.append('{}.{} IN ({})'.format(source_table, pk_col, pk_list))
+        if condition:
+            conditions.append(condition)
+        source = '{} PARTITION ({})'.format(source_table, source_partition) if source_partition else source_table
+        return '''SELECT {source}.{pk_col} FROM {source_rel}
+                  LEFT OUTER JOIN {table}
+                  ON {source}.{pk_col}={table}.{pk_col}
+                  WHERE {table}.{pk_col} IS NULL
+                  {range}
+              '''.format(
+            table=table,
+            source=source_table,
+            source_rel=source,
+            pk_col=pk_col,
+            range=''.join(' AND ' + c for c in conditions)
+        )
+
     @staticmethod
     def rename_table(source_name, archive_name, migration_name):
         return '''RENAME TABLE `{source_name}`
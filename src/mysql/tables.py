@@ -1,11 +1,18 @@
+import json
 import time
 import re
 from src.core.tables import Table, MigrationTable
 from src.core.constraints import Index
+from src.core.shadow import ShadowColumn
 
 
 class MysqlTable(Table):
 
+    @staticmethod
+    def _quote(name):
+        '''Escape an identifier'''
+        return '`{}`'.format(name)
+
     @staticmethod
     def _join_cols(cols):
         '''Join and escape a list'''
@@ -61,6 +68,18 @@ class MysqlTable(Table):
             return ans[0]
 
 
+    def get_full_column_definition(self, column_name):
+        '''The whole column definition as SHOW CREATE TABLE gives it, with its charset and collation,
+        DEFAULT, AUTO_INCREMENT, ON UPDATE and COMMENT, which CHANGE COLUMN drops unless restated
+        '''
+        statement = self.execute(self.commands.get_table_create_statement(self.name))[0][1]
+        prefix = '`{}` '.format(column_name)
+        for line in statement.splitlines():
+            line = line.strip()
+            if line.startswith(prefix):
+                return line[len(prefix):].rstrip(',')
+        raise ValueError('Column {} not found in {}'.format(column_name, self.name))
+
     def rename_column(self, old_name, new_name):
         '''Rename a column'''
         self.execute(self.commands.rename_column(
@@ -87,21 +106,59 @@ class MysqlTable(Table):
         indexes = self.execute(self.commands.get_indexes(self.name))
         return [Index(tup[0], tup[2], tup[1], tup[4]) for tup in indexes]
 
+    @property
+    def pk_histogram(self):
+        """Return the bucket bounds of a MySQL 8 histogram on the primary key,
+        built by ANALYZE TABLE ... UPDATE HISTOGRAM ON
+        """
+        ans = self.execute(self.commands.pk_histogram(self.db.name, self.name, self.primary_key_column))
+        if not ans or not ans[0][0]:
+            return []
+        histogram = ans[0][0]
+        if not isinstance(histogram, dict):
+            histogram = json.loads(histogram)
+        buckets = histogram.get('buckets', [])
+        if histogram.get('histogram-type') == 'equi-height':
+            return [buckets[0][0]] + [b[1] for b in buckets] if buckets else []
+        return [b[0] for b in buckets]
+
+    def full_scans(self, sql, db=None):
+        """Tables the json plan reads with a full table or full index scan"""
+        ans = (db or self.db).execute(self.commands.explain(sql))
+        nodes = [json.loads(ans[0][0])]
+        scanned = []
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, dict):
+                if node.get('access_type') in ('ALL', 'index'):
+                    scanned.append(node.get('table_name'))
+                nodes += node.values()
+            elif isinstance(node, list):
+                nodes += node
+        return scanned
+
 
 class MySqlMigrationTable(MysqlTable, MigrationTable):
 
     def create_from_source(self):
         """Create new table like source_table"""
-        create_statement = self.source.create_statement.replace(
-            'CREATE TABLE `{}`'.format(self.source.name),
-            'CREATE TABLE `{}`'
-        )
-        self.create_from_statement(create_statement)
+        with self.profiled('setup'):
+            create_statement = self.source.create_statement.replace(
+                'CREATE TABLE `{}`'.format(self.source.name),
+                'CREATE TABLE `{}`'
+            )
+            self.create_from_statement(create_statement)
 
-    def _trigger_name(self, method_type):
-        'Create trigger name'
-        name = 'migration_trigger_{}_{}'.format(method_type, self.source.name)
-        return name[:self.db.config['MAX_LENGTH_NAME']]
+    def _check_settings(self, report):
+        'Statement based replication replays the chunks and trigger writes unsafely'
+        log_bin, binlog_format = self.execute(self.commands.binlog_settings())[0]
+        if not log_bin:
+            return
+        if binlog_format == 'STATEMENT':
+            report.add(report.BLOCKING, 'binlog_format',
+                       'binlog_format is STATEMENT, replicas can diverge from INSERT ... SELECT chunks and triggers')
+        elif binlog_format == 'MIXED':
+            report.add(report.WARNING, 'binlog_format', 'binlog_format is MIXED, ROW is safest for the copy')
 
     def create_insert_trigger(self):
         '''Set insert Triggers.
@@ -113,11 +170,8 @@ class MySqlMigrationTable(MysqlTable, MigrationTable):
             self.source.name,
             self.name,
             self._join_cols(self.intersection.dest_columns),
-            self._qualify('NEW', self.intersection.origin_columns))
-        import pdb
-        pdb.set_trace()
-
-        print(sql)
+            self._values('NEW'),
+            self._condition('NEW'))
         self.execute(sql)
 
     def create_delete_trigger(self):
@@ -142,28 +196,119 @@ class MySqlMigrationTable(MysqlTable, MigrationTable):
             self._trigger_name('update'),
             self.source.name,
             self.name,
-            self._equals(self.intersection.dest_columns, 'NEW', self.intersection.origin_columns),
-            self.primary_key_column
+            self._assign(self.intersection.dest_columns, self.intersection.origin_values('NEW')),
+            self.primary_key_column,
+            self._condition('NEW'),
+            self._condition('OLD'),
+            self._join_cols(self.intersection.dest_columns),
+            self._values('NEW')
         )
         self.execute(sql)
 
-    def rename_tables(self):
-        'Rename the tables'
+    def reverse_sync_statements(self, table, archive):
+        'Statements creating the triggers copying the writes on table into archive'
+        dest_cols, origin_cols = self._reverse_columns()
+        return [
+            self.commands.insert_trigger(self._reverse_trigger_name('INSERT'), table, archive,
+                                         self._join_cols(dest_cols), self._qualify('NEW', origin_cols)),
+            self.commands.update_trigger(self._reverse_trigger_name('UPDATE'), table, archive,
+                                         self._equals(dest_cols, 'NEW', origin_cols), self.primary_key_column),
+            self.commands.delete_trigger(self._reverse_trigger_name('DELETE'), table, archive,
+                                         self.primary_key_column),
+        ]
+
+    def drop_reverse_sync_statements(self, table, archive):
+        'Statements dropping the reverse triggers, which have no separate functions'
+        return [self.commands.drop_trigger(self._reverse_trigger_name(type), table)
+                for type in ['INSERT', 'UPDATE', 'DELETE']]
+
+    def rename_tables(self, schedule=None, reverse_sync=None):
+        '''Rename the tables, waiting for a window of schedule first when there is one.
+        DDL commits on its own in mysql, the reverse triggers go on the migrate table before
+        the single RENAME TABLE, nothing writes to it until it takes the source name.
+        '''
+        if schedule:
+            schedule.wait()
         self.delete_triggers()
         retries = 0
         source_name, archive_name, migrate_name = self.source.name, self.source.archive_name, self.name
-        while True:
-            try:
-                self.execute(self.commands.rename_table(source_name, archive_name, migrate_name))
-                break
-            except Exception as e:
-                retries += 1
-                if retries > self.db.config['MAX_RENAME_RETRIES']:
-                    self.create_triggers()
-                    return False
-                # TODO: make sure this is a Lock wait timeout error before retrying
-                print('Rename retry %d, error: %s' % (retries, e))
-                time.sleep(self.db.donfig['RETRY_SLEEP_TIME'])
+        with self.progress.phase('cutover'), self.profiled('cutover'):
+            if reverse_sync is not None:
+                for sql in self.reverse_sync_statements(migrate_name, archive_name):
+                    self.execute(sql)
+            while True:
+                try:
+                    self.execute(self.commands.rename_table(source_name, archive_name, migrate_name))
+                    break
+                except Exception as e:
+                    retries += 1
+                    lock_wait = self.db.classify_error(e) == 'timeout'
+                    if not lock_wait or retries > self.db.config['MAX_RENAME_RETRIES']:
+                        # Capture the writes again before giving up, the source stays in place
+                        for sql in self.drop_reverse_sync_statements(migrate_name, archive_name):
+                            self.execute(sql)
+                        self.create_triggers()
+                        if not lock_wait:
+                            raise
+                        return False
+                    print('Rename retry %d, error: %s' % (retries, e))
+                    time.sleep(self.db.config['RETRY_SLEEP_TIME'])
+        self.cutover_names = (source_name, archive_name, migrate_name)
+        if reverse_sync is not None:
+            self.grace_ends = time.time() + reverse_sync
         self.name, self.source.name = self.source.name, self.archive_name
         print("Rename complete!")
         return True
+
+    def rollback(self):
+        '''Undo rename_tables during the grace period of a reverse sync, in one RENAME TABLE.
+        The reverse triggers move with the new table and are dropped after,
+        auto increment counters move with their tables.
+        '''
+        if self.grace_ends is None:
+            raise Exception('No reverse sync to roll back to, the archive table is stale')
+        source_name, archive_name, migrate_name = self.cutover_names
+        with self.progress.phase('cutover'):
+            self.execute(self.commands.rename_table(source_name, migrate_name, archive_name))
+            for sql in self.drop_reverse_sync_statements(migrate_name, archive_name):
+                self.execute(sql)
+        self.grace_ends = None
+        self.name, self.source.name = migrate_name, source_name
+        print("Rollback complete!")
+        return self.db.table(source_name), self.db.table(migrate_name)
+
+
+class MySqlShadowColumn(ShadowColumn):
+
+    SEQUENCE = 'auto_increment'
+
+    def create_triggers(self):
+        """Keep the shadow column in sync, one BEFORE trigger per event"""
+        triggers = self.table.get_triggers()
+        for event in ['INSERT', 'UPDATE']:
+            trigger_name = self.trigger_name(event.lower())
+            if trigger_name not in triggers:
+                self.table.execute(self.commands.shadow_trigger(
+                    trigger_name, self.table.name, event, self.name, self.value('NEW')))
+        self.table.commit()
+
+    def drop_triggers_statements(self):
+        return [self.commands.drop_trigger(self.trigger_name(event), self.table.name)
+                for event in ['insert', 'update']]
+
+    def old_default(self):
+        """The default from the schema, or auto_increment for a column filled by it"""
+        sql = self.commands.column_definitions(self.db.name, self.table.name)
+        for name, _, _, default, extra in self.table.execute(sql):
+            if name == self.column:
+                return extra if 'auto_increment' in extra.lower() else default
+        return None
+
+    def old_definition(self):
+        """CHANGE COLUMN replaces the whole definition, restate all of it"""
+        return self.table.get_full_column_definition(self.column)
+
+    def swap_statements(self):
+        """DDL commits on its own in MySql, a write lock keeps writes out between the trigger drop and the swap"""
+        statements = super(MySqlShadowColumn, self).swap_statements()
+        return [self.commands.lock_table(self.table.name)] + statements + [self.commands.unlock_tables()]
@@ -0,0 +1,23 @@
+from src.core.aio import AsyncDatabase
+from src.postgres.commands import PostgresCommands
+
+
+class AsyncPostgresDatabase(AsyncDatabase):
+    '''Postgres database reached through an asyncpg pool'''
+
+    def __init__(self, name, pool, config):
+        '''Initialize the database'''
+        super(AsyncPostgresDatabase, self).__init__(name, pool, config)
+        self.commands = PostgresCommands
+
+    async def _fetch(self, connection, sql):
+        return [tuple(record) for record in await connection.fetch(sql)]
+
+    async def _execute(self, connection, sql):
+        # asyncpg runs outside a transaction block, so each statement commits on its own.
+        # The status is the command tag, e.g. 'INSERT 0 1000'
+        status = await connection.execute(sql)
+        try:
+            return int(status.split()[-1])
+        except (AttributeError, IndexError, ValueError):
+            return None
@@ -1,19 +1,58 @@
-from src.core.base import Database
+import re
+import time
+from src.core.base import Database, StatementResult
 from src.postgres.commands import PostgresCommands
 from src.postgres.tables import PostgresTable, MigrationTable
 
+# Statements psycopg2 may return rows of, they end a multi-statement send
+ROWS_PATTERN = re.compile(r'^\s*\(?\s*(SELECT|WITH|SHOW|VALUES|TABLE|EXPLAIN|FETCH)\b|\bRETURNING\b', re.IGNORECASE)
+
+
+class LineStream(object):
+    """File-like reader over an iterator of COPY text lines, only one chunk of lines is held at a time"""
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = b''
+        self.count = 0
+
+    def read(self, size=-1):
+        """Return up to size bytes, b'' once the lines are exhausted"""
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.count += 1
+            self.buffer += line.encode('utf-8')
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
 
 class PostgresDatabase(Database):
 
-    def __init__(self, name, connection, config):
+    def __init__(self, name, connection, config, pool=None):
         '''Initialize the database'''
-        super(PostgresDatabase, self).__init__(name, connection, config)
+        super(PostgresDatabase, self).__init__(name, connection, config, pool)
         self.commands = PostgresCommands
         self.add_show_create_table()
         self.table_class = PostgresTable
 
     def __del__(self):
-        self.drop_show_create_table()
+        # Sessions share the function with the database they were bound from
+        if self.parent is None and self.connection is not None:
+            self.drop_show_create_table()
+
+    @property
+    def is_local(self):
+        '''psycopg2 gives the host libpq connected to, none or a directory for a unix socket'''
+        host = self.connection.get_dsn_parameters().get('host')
+        return self._local_host(host.split(',')[0] if host else None)
+
+    def error_code(self, error):
+        '''SQLSTATE of a psycopg2 error'''
+        return getattr(error, 'pgcode', None)
 
     def add_show_create_table(self):
         """
@@ -21,10 +60,73 @@ class PostgresDatabase(Database):
         from http://stackoverflow.com/questions/2593803/how-to-generate-the-create-table-sql-statement-for-an-existing-table-in-postgr
         """
         self.execute(self.commands.show_table_function)
+        self.commit()
 
     def drop_show_create_table(self):
         self.execute(self.commands.drop_show_create_table)
 
+    def copy_from(self, tablename, columns, lines):
+        '''Load COPY text lines into columns of the table, return the rows loaded'''
+        sql = self.commands.copy_from_stdin(tablename, columns)
+        stream = LineStream(lines)
+        started = time.time()
+        with self.cursor() as dbc:
+            try:
+                dbc.copy_expert(sql, stream)
+            except Exception as e:
+                self._trace(sql, started, label=getattr(sql, 'label', None), error=e)
+                raise
+        self.last_rowcount = stream.count
+        self._trace(sql, started, stream.count, label=getattr(sql, 'label', None))
+        return stream.count
+
+    def send_pipeline(self, sql_list, previous=()):
+        '''
+        Send the statements joined in multi-statement queries. psycopg2 only returns the rows and count
+        of the last statement of a query, so a statement returning rows ends its query,
+        and the other statements have no rowcount.
+        '''
+        results = []
+        for group in self._sends(sql_list):
+            started = time.time()
+            try:
+                with self.cursor() as dbc:
+                    dbc.execute(self._join_statements(group))
+                    last = StatementResult(group[-1], dbc.fetchall() if dbc.description else None, dbc.rowcount)
+            except Exception:
+                return results + self._locate_error(group, list(previous) + results)
+            sent = [StatementResult(sql) for sql in group[:-1]] + [last]
+            self._trace_pipeline(sent, started)
+            results += sent
+        return results
+
+    def _locate_error(self, group, done):
+        '''Find the failed statement of a query by running its statements one at a time,
+        after the statements of the batch done before it when the failure rolled them back
+        '''
+        self.rollback()
+        if not getattr(self.connection, 'autocommit', False):
+            with self.cursor() as dbc:
+                for statements in self._sends([x.sql for x in done]):
+                    dbc.execute(self._join_statements(statements))
+        return super(PostgresDatabase, self).send_pipeline(group)
+
+    @staticmethod
+    def _sends(sql_list):
+        '''Split statements into queries, each ending at the first statement that may return rows'''
+        group = []
+        for sql in sql_list:
+            group.append(sql)
+            if ROWS_PATTERN.search(sql):
+                yield group
+                group = []
+        if group:
+            yield group
+
+    @staticmethod
+    def _join_statements(sql_list):
+        return ';\n'.join(sql.rstrip().rstrip(';') for sql in sql_list)
+
     @property
     def sequences(self):
         sql = self.commands.get_database_sequences(self.name)
@@ -5,6 +5,17 @@ class PostgresCommands(object):
 
     BEGIN = 'BEGIN;'
     COMMIT = 'COMMIT;'
+    LOG_NAME = 'WAL'
+    # Strongest lock taken by each migration step that blocks the application
+    LOCKS = {
+        'create_triggers': 'SHARE ROW EXCLUSIVE',
+        'add_foreign_keys': 'SHARE ROW EXCLUSIVE',
+        'rename_tables': 'ACCESS EXCLUSIVE',
+    }
+    # SQLSTATEs worth retrying a chunk for: serialization failure, deadlock, lock and statement timeouts
+    RETRIABLE_ERRORS = {'40001', '40P01', '55P03', '57014'}
+    TIMEOUT_ERRORS = {'55P03', '57014'}
+    SKIP_LOCKED = True
 
     @staticmethod
     def get_tables(database_name):
@@ -127,6 +138,13 @@ class PostgresCommands(object):
                   WHERE {}={}
                '''.format(cols, table, pk_col, pk)
 
+    @staticmethod
+    def get_rows(cols, table, pk_col, pk_list):
+        return '''SELECT {}
+                  FROM {}
+                  WHERE {} IN ({})
+                  ORDER BY {}'''.format(cols, table, pk_col, pk_list, pk_col)
+
     @staticmethod
     def insert_row(table, cols, vals):
         return '''INSERT INTO {} (
@@ -151,6 +169,45 @@ class PostgresCommands(object):
     def table_count(tablename):
         return 'SELECT COUNT(1) FROM {}'.format(tablename)
 
+    @staticmethod
+    def table_size(database_name, tablename):
+        return '''SELECT pg_relation_size(c.oid), c.reltuples
+                  FROM pg_class c
+                  WHERE c.relname = '{}'
+                  AND c.relkind IN ('r', 'p')
+                  AND pg_catalog.pg_table_is_visible(c.oid);'''.format(tablename)
+
+    @staticmethod
+    def table_bloat(database_name, tablename):
+        """Bytes, live rows and bytes beyond the live rows at their average width, with tuple header and line pointer"""
+        return '''SELECT pg_relation_size(c.oid), s.n_live_tup,
+                  GREATEST(pg_relation_size(c.oid) - s.n_live_tup * (28 + COALESCE((
+                    SELECT SUM(avg_width) FROM pg_stats
+                    WHERE pg_stats.schemaname = s.schemaname
+                    AND pg_stats.tablename = c.relname), 0)), 0)
+                  FROM pg_class c
+                  JOIN pg_stat_user_tables s ON s.relid = c.oid
+                  WHERE c.relname = '{}'
+                  AND pg_catalog.pg_table_is_visible(c.oid);'''.format(tablename)
+
+    @staticmethod
+    def analyze(tablename):
+        return 'ANALYZE {}'.format(tablename)
+
+    @staticmethod
+    def set_storage(tablename, params):
+        return 'ALTER TABLE {} SET ({})'.format(
+            tablename,
+            ', '.join('{}={}'.format(k, v) for k, v in sorted(params.items()))
+        )
+
+    @staticmethod
+    def index_size(database_name, tablename):
+        return '''SELECT pg_indexes_size(c.oid)
+                  FROM pg_class c
+                  WHERE c.relname = '{}'
+                  AND pg_catalog.pg_table_is_visible(c.oid);'''.format(tablename)
+
     @staticmethod
     def table_columns(tablename):
         return '''SELECT column_name
@@ -278,6 +335,22 @@ class PostgresCommands(object):
     def drop_foreign_key(fk_tablename, fk_name):
         return 'ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}'.format(fk_tablename, fk_name)
 
+    @staticmethod
+    def get_partitions(database_name, tablename):
+        return '''SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples
+                  FROM pg_inherits i
+                  JOIN pg_class c ON c.oid = i.inhrelid
+                  JOIN pg_class p ON p.oid = i.inhparent
+                  WHERE p.relname = '{}'
+                  AND p.relkind = 'p'
+                  ORDER BY pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT',
+                  pg_get_expr(c.relpartbound, c.oid);'''.format(tablename)
+
+    @staticmethod
+    def partition_relation(tablename, partition):
+        """Partitions are tables in their own right"""
+        return partition
+
     @staticmethod
     def get_indexes(tablename):
         return '''
@@ -360,6 +433,20 @@ class PostgresCommands(object):
             column
         )
 
+    @staticmethod
+    def set_sequence_default(tablename, column, sequence_name):
+        return "ALTER TABLE {} ALTER COLUMN {} SET DEFAULT nextval('{}')".format(
+            tablename,
+            column,
+            sequence_name
+        )
+
+    @staticmethod
+    def restart_identity(tablename, column):
+        """Move the identity of column past the largest value copied into it"""
+        return '''SELECT setval(pg_get_serial_sequence('{table}', '{column}'),
+                  COALESCE(MAX({column}), 0) + 1, false) FROM {table}'''.format(table=tablename, column=column)
+
     @staticmethod
     def set_sequence_owner(sequence_name, tablename, column):
         return 'ALTER SEQUENCE {} OWNED BY {}.{}'.format(
@@ -369,13 +456,14 @@ class PostgresCommands(object):
         )
 
     @staticmethod
-    def insert_function(destination_table, cols, vals):
+    def insert_function(destination_table, cols, vals, condition=None):
+        """With a condition on NEW, only the rows matching it are inserted"""
         return '''CREATE OR REPLACE FUNCTION insert_{dest_table}() RETURNS TRIGGER AS
                   $BODY$
                   BEGIN
                       INSERT INTO
                         {dest_table}({cols})
-                        VALUES({vals});
+                        SELECT {vals}{where};
                        RETURN NEW;
                   END;
                   $BODY$
@@ -383,7 +471,8 @@ class PostgresCommands(object):
         '''.format(
             dest_table=destination_table,
             cols=cols,
-            vals=vals
+            vals=vals,
+            where=' WHERE ' + condition if condition else ''
         )
 
     @staticmethod
@@ -399,8 +488,13 @@ class PostgresCommands(object):
         )
 
     @staticmethod
-    def update_function(dest_table, cols_vals, pk_col):
-        return '''CREATE OR REPLACE FUNCTION update_{dest_table}() RETURNS TRIGGER AS
+    def update_function(dest_table, cols_vals, pk_col, condition=None, old_condition=None, cols=None, vals=None):
+        """With a condition on NEW, rows updated out of it are deleted from dest_table,
+        and rows updated into it, not matching old_condition on OLD, are inserted from cols and vals.
+        The copy reads the old version of those, which it skips.
+        """
+        if not condition:
+            return '''CREATE OR REPLACE FUNCTION update_{dest_table}() RETURNS TRIGGER AS
                 $BODY$
                 BEGIN
                   UPDATE {dest_table} SET {cols_vals}
@@ -410,6 +504,25 @@ class PostgresCommands(object):
                 $BODY$
                 language plpgsql;
                 '''.format(dest_table=dest_table, cols_vals=cols_vals, pk_col=pk_col)
+        return '''CREATE OR REPLACE FUNCTION update_{dest_table}() RETURNS TRIGGER AS
+                $BODY$
+                BEGIN
+                  IF {condition} THEN
+                    UPDATE {dest_table} SET {cols_vals}
+                    WHERE {pk_col}=NEW.{pk_col};
+                    IF {old_condition} IS NOT TRUE THEN
+                      INSERT INTO {dest_table}({cols}) VALUES({vals})
+                      ON CONFLICT ({pk_col}) DO NOTHING;
+                    END IF;
+                  ELSE
+                    DELETE FROM {dest_table} WHERE {pk_col}=NEW.{pk_col};
+                  END IF;
+                  RETURN NEW;
+                END;
+                $BODY$
+                language plpgsql;
+                '''.format(dest_table=dest_table, cols_vals=cols_vals, pk_col=pk_col, condition=condition,
+                           old_condition=old_condition, cols=cols, vals=vals)
 
     @staticmethod
     def update_trigger(trigger_name, source_table, dest_table):
@@ -450,6 +563,41 @@ class PostgresCommands(object):
             dest_table=dest_table
         )
 
+    @staticmethod
+    def shadow_function(function_name, shadow_col, value):
+        return '''CREATE OR REPLACE FUNCTION {function_name}() RETURNS TRIGGER AS
+                  $BODY$
+                  BEGIN
+                      NEW.{shadow_col} := {value};
+                      RETURN NEW;
+                  END;
+                  $BODY$
+                  language plpgsql;
+        '''.format(
+            function_name=function_name,
+            shadow_col=shadow_col,
+            value=value
+        )
+
+    @staticmethod
+    def shadow_trigger(trigger_name, table, function_name):
+        return '''CREATE TRIGGER {trigger_name}
+              BEFORE INSERT OR UPDATE ON {table}
+              FOR EACH ROW
+              EXECUTE PROCEDURE {function_name}();
+              '''.format(
+            trigger_name=trigger_name,
+            table=table,
+            function_name=function_name
+        )
+
+    @staticmethod
+    def swap_columns(tablename, column, old_name, shadow_col, old_definition, new_definition):
+        return [
+            'ALTER TABLE {} RENAME COLUMN {} TO {}'.format(tablename, column, old_name),
+            'ALTER TABLE {} RENAME COLUMN {} TO {}'.format(tablename, shadow_col, column),
+        ]
+
     @staticmethod
     def drop_trigger(trigger_name, source_table):
         return 'DROP TRIGGER IF EXISTS {} ON {}'.format(
@@ -477,6 +625,110 @@ class PostgresCommands(object):
             limit=limit
         )
 
+    @staticmethod
+    def sample_chunk(source_table, origin_cols, pk_col, last_pk, limit):
+        return '''SELECT {origin_cols} FROM {source}
+                  WHERE {source}.{pk_col} >= {last_pk}
+                  ORDER BY {source}.{pk_col}
+                  LIMIT {limit};
+              '''.format(
+            origin_cols=origin_cols,
+            source=source_table,
+            pk_col=pk_col,
+            last_pk=last_pk,
+            limit=limit
+        )
+
+    @staticmethod
+    def _pk_range(pk_col, start, end):
+        """Conditions bounding pk_col to [start, end), either end may be open"""
+        conditions = []
+        if start is not None:
+            conditions.append('{} >= {}'.format(pk_col, start))
+        if end is not None:
+            conditions.append('{} < {}'.format(pk_col, end))
+        return conditions
+
+    @staticmethod
+    def seek_pk(table, pk_col, pk):
+        return 'SELECT MIN({pk_col}) FROM {table} WHERE {pk_col} > {pk}'.format(
+            pk_col=pk_col,
+            table=table,
+            pk=pk
+        )
+
+    @staticmethod
+    def long_transactions(seconds):
+        return '''SELECT pid, EXTRACT(EPOCH FROM now() - xact_start)::integer, state, query
+                  FROM pg_stat_activity
+                  WHERE xact_start < now() - interval '{} seconds'
+                  AND pid <> pg_backend_pid()
+                  ORDER BY xact_start;'''.format(int(seconds))
+
+    @staticmethod
+    def data_directory():
+        """Only readable by superusers and pg_read_all_settings members"""
+        return "SELECT setting FROM pg_settings WHERE name = 'data_directory'"
+
+    @staticmethod
+    def explain(sql):
+        return 'EXPLAIN (FORMAT JSON) {}'.format(sql.rstrip().rstrip(';'))
+
+    @classmethod
+    def count_range(cls, table, pk_col, start, end):
+        return 'SELECT COUNT(*) FROM {} WHERE {}'.format(table, ' AND '.join(cls._pk_range(pk_col, start, end)) or '1=1')
+
+    @staticmethod
+    def copy_from_stdin(tablename, columns):
+        return 'COPY {} ({}) FROM STDIN'.format(tablename, columns)
+
+    @staticmethod
+    def set_time_zone():
+        return "SET TIME ZONE 'UTC'"
+
+    @staticmethod
+    def statement_timeout(seconds):
+        """Timeout of the statements of the current transaction only"""
+        return "SET LOCAL statement_timeout = '{}ms'".format(int(seconds * 1000))
+
+    @staticmethod
+    def current_timeout():
+        """SET LOCAL ends with the transaction, there is nothing to restore"""
+        return None
+
+    @staticmethod
+    def restore_timeout(previous):
+        return None
+
+    @classmethod
+    def chunk_boundaries(cls, table, pk_col, chunk_size, start=None, end=None):
+        conditions = cls._pk_range(pk_col, start, end)
+        return '''SELECT T1.{pk_col} FROM (
+                  SELECT {pk_col}, ROW_NUMBER() OVER (ORDER BY {pk_col}) AS chunk_row
+                  FROM {table}
+                  {where}) AS T1
+                  WHERE (T1.chunk_row - 1) % {chunk_size} = 0
+                  ORDER BY T1.{pk_col};'''.format(
+            pk_col=pk_col,
+            table=table,
+            where='WHERE ' + ' AND '.join(conditions) if conditions else '',
+            chunk_size=chunk_size
+        )
+
+    @staticmethod
+    def pk_histogram(tablename, pk_col):
+        return '''SELECT histogram_bounds::text
+                  FROM pg_stats
+                  WHERE schemaname = current_schema()
+                  AND tablename = '{}'
+                  AND attname = '{}';'''.format(tablename, pk_col)
+
+    @staticmethod
+    def sample_pks(tablename, pk_col, percent):
+        return '''SELECT {pk_col} FROM {table}
+                  TABLESAMPLE SYSTEM ({percent})
+                  ORDER BY {pk_col};'''.format(pk_col=pk_col, table=tablename, percent=percent)
+
     @staticmethod
     def copy_chunk(table, dest_cols, origin_cols, source_table, pk_col, last_pk, limit):
         return '''INSERT INTO {table} ({dest_cols}) (
@@ -500,6 +752,106 @@ class PostgresCommands(object):
 
 
 
+    @classmethod
+    def delete_range(cls, table, pk_col, where, start, end):
+        conditions = cls._pk_range(pk_col, start, end) + (['({})'.format(where)] if where else [])
+        return '''DELETE FROM {table}
+                  WHERE {conditions};'''.format(
+            table=table,
+            conditions=' AND '.join(conditions) or '1=1'
+        )
+
+    @classmethod
+    def update_range(cls, table, col_val, pk_col, where, start, end):
+        conditions = cls._pk_range(pk_col, start, end) + (['({})'.format(where)] if where else [])
+        return '''UPDATE {table}
+                  SET {col_val}
+                  WHERE {conditions};'''.format(
+            table=table,
+            col_val=col_val,
+            conditions=' AND '.join(conditions) or '1=1'
+        )
+
+    @classmethod
+    def copy_range(cls, table, dest_cols, origin_cols, source_table, pk_col, start, end,
+                   source_partition=None, dest_partition=None, skip_locked=False, order_by=None,
+                   condition=None):
+        """Partitions are read and written directly, aliased to their parent table.
+        With skip_locked, source rows locked by other transactions are left for a later pass.
+        order_by are qualified source columns the rows are inserted in the order of.
+        Only the source rows matching condition are copied.
+        """
+        conditions = cls._pk_range('{}.{}'.format(source_table, pk_col), start, end)
+        if condition:
+            conditions.append(condition)
+        source = '{} AS {}'.format(source_partition, source_table) if source_partition else source_table
+        dest = '{} AS {}'.format(dest_partition, table) if dest_partition else table
+        return '''INSERT INTO {dest} ({dest_cols}) (
+                  SELECT {origin_cols} FROM {source_rel}
+                  LEFT OUTER JOIN {dest}
+                  ON {source}.{pk_col}={table}.{pk_col}
+                  WHERE {table}.{pk_col} IS NULL
+                  {range}
+                  {order}
+                  {lock}
+                  );
+              '''.format(
+            table=table,
+            dest_cols=dest_cols,
+            origin_cols=origin_cols,
+            source=source_table,
+            source_rel=source,
+            dest=dest,
+            pk_col=pk_col,
+            range=''.join(' AND ' + c for c in conditions),
+            order='ORDER BY ' + order_by if order_by else '',
+            lock='FOR SHARE OF {} SKIP LOCKED'.format(source_table) if skip_locked else ''
+        )
+
+    @staticmethod
+    def copy_rows(table, dest_cols, origin_cols, source_table, pk_col, pk_list, skip_locked=False, condition=None):
+        return '''INSERT INTO {table} ({dest_cols}) (
+                  SELECT {origin_cols} FROM {source}
+                  LEFT OUTER JOIN {table}
+                  ON {source}.{pk_col}={table}.{pk_col}
+                  WHERE {table}.{pk_col} IS NULL
+                  AND {source}.{pk_col} IN ({pk_list}){condition}
+                  {lock}
+                  );
+              '''.format(
+            table=table,
+            dest_cols=dest_cols,
+            origin_cols=origin_cols,
+            source=source_table,
+            pk_col=pk_col,
+            pk_list=pk_list,
+            condition=' AND ' + condition if condition else '',
+            lock='FOR SHARE OF {} SKIP LOCKED'.format(source_table) if skip_locked else ''
+        )
+
+    @classmethod
+    def uncopied_pks(cls, table, source_table, pk_col, start=None, end=None, pk_list=None, source_partition=None,
+                     condition=None):
+        """Pks of the source rows in [start, end), or in pk_list, matching condition and missing from table"""
+        conditions = cls._pk_range('{}.{}'.format(source_table, pk_col), start, end)
+        if pk_list:
+            conditions.append('{}.{} IN ({})'.format(source_table, pk_col, pk_list))
+        if condition:
+            conditions.append(condition)
+        source = '{} AS {}'.format(source_partition, source_table) if source_partition else source_table
+        return '''SELECT {source}.{pk_col} FROM {source_rel}
+                  LEFT OUTER JOIN {table}
+                  ON {source}.{pk_col}={table}.{pk_col}
+                  WHERE {table}.{pk_col} IS NULL
+                  {range}
+              '''.format(
+            table=table,
+            source=source_table,
+            source_rel=source,
+            pk_col=pk_col,
+            range=''.join(' AND ' + c for c in conditions)
+        )
+
     @staticmethod
     def rename_table(old_name, new_name):
         return '''ALTER TABLE {} RENAME TO {};'''.format(old_name, new_name)
@@ -1,3 +1,4 @@
+import json
 from src.core.tables import Table, MigrationTable, Intersection
 
 class PostgresTable(Table):
@@ -23,3 +24,50 @@ class PostgresTable(Table):
         if ans[3]:
             char_def = '{} default {}'.format(char_def, ans[3])
         return char_def
+
+    @staticmethod
+    def _parse_array(text):
+        """Parse a text array literal such as {1,5,"a b"}, converting numbers"""
+        values = []
+        for item in text.strip('{}').split(','):
+            item = item.strip('"')
+            for convert in (int, float):
+                try:
+                    item = convert(item)
+                    break
+                except ValueError:
+                    pass
+            values.append(item)
+        return values
+
+    @property
+    def pk_histogram(self):
+        """Return the histogram bounds ANALYZE keeps for the primary key"""
+        ans = self.execute(self.commands.pk_histogram(self.name, self.primary_key_column))
+        if not ans or not ans[0][0]:
+            return []
+        return self._parse_array(ans[0][0])
+
+    def pk_sample(self, size):
+        """Sample primary keys page by page with TABLESAMPLE SYSTEM"""
+        rows = self.size_estimate[1]
+        if not rows:
+            return []
+        percent = min(100.0, size * 100.0 / rows)
+        ans = self.execute(self.commands.sample_pks(self.name, self.primary_key_column, percent))
+        return [x[0] for x in ans]
+
+    def full_scans(self, sql, db=None):
+        """Relations and aliases read by a Seq Scan node of the plan"""
+        ans = (db or self.db).execute(self.commands.explain(sql))
+        plan = ans[0][0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        scanned = []
+        nodes = [x['Plan'] for x in plan]
+        while nodes:
+            node = nodes.pop()
+            if node.get('Node Type') == 'Seq Scan':
+                scanned += [node.get('Relation Name'), node.get('Alias')]
+            nodes += node.get('Plans', [])
+        return scanned
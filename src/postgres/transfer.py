@@ -0,0 +1,225 @@
+import datetime
+import json
+import re
+from collections import OrderedDict
+from src.core.transfer import TableTransfer
+
+# MySql integer types to their Postgres type, signed and unsigned
+INTEGER_TYPES = {
+    'tinyint': ('smallint', 'smallint'),
+    'smallint': ('smallint', 'integer'),
+    'mediumint': ('integer', 'integer'),
+    'int': ('integer', 'bigint'),
+    'integer': ('integer', 'bigint'),
+    'bigint': ('bigint', 'numeric(20)'),
+}
+TEXT_TYPES = ('tinytext', 'text', 'mediumtext', 'longtext', 'enum', 'set')
+BINARY_TYPES = ('binary', 'varbinary', 'tinyblob', 'blob', 'mediumblob', 'longblob')
+OTHER_TYPES = {
+    'float': 'real',
+    'double': 'double precision',
+    'real': 'double precision',
+    'date': 'date',
+    'datetime': 'timestamp',
+    'timestamp': 'timestamp with time zone',
+    'time': 'time',
+    'year': 'smallint',
+    'json': 'jsonb',
+}
+NUMERIC_TYPES = ('smallint', 'integer', 'bigint', 'numeric', 'real', 'double precision')
+COPY_ESCAPES = {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'}
+
+
+def postgres_type(column_type):
+    '''Postgres type storing the values of a MySql COLUMN_TYPE, raises ValueError for a type it cannot store'''
+    match = re.match(r'^(\w+)(?:\((.*)\))?\s*(.*)$', column_type.strip().lower())
+    if not match:
+        raise ValueError('Cannot parse MySql column type {}'.format(column_type))
+    base, args, rest = match.groups()
+    if base in ('tinyint', 'bit') and args == '1':
+        return 'boolean'
+    if base in INTEGER_TYPES:
+        return INTEGER_TYPES[base]['unsigned' in rest]
+    if base in ('decimal', 'numeric'):
+        return 'numeric({})'.format(args) if args else 'numeric'
+    if base == 'char':
+        return 'character({})'.format(args or 1)
+    if base == 'varchar':
+        return 'character varying({})'.format(args)
+    if base == 'bit':
+        return 'bit({})'.format(args or 1)
+    if base in TEXT_TYPES:
+        return 'text'
+    if base in BINARY_TYPES:
+        return 'bytea'
+    if base in OTHER_TYPES:
+        return OTHER_TYPES[base]
+    raise ValueError('No Postgres type for MySql column type {}'.format(column_type))
+
+
+def _bits(value):
+    '''Integer of a MySql BIT value, which the driver returns as big endian bytes'''
+    return int.from_bytes(value, 'big') if isinstance(value, bytes) else int(value)
+
+
+def copy_text(value, pg_type):
+    '''Value of a MySql row as a field of the Postgres COPY text format'''
+    if value is None:
+        return '\\N'
+    if isinstance(value, memoryview):
+        value = bytes(value)
+    if pg_type == 'boolean':
+        return 't' if _bits(value) else 'f'
+    if pg_type.startswith('bit('):
+        text = format(_bits(value), '0{}b'.format(int(pg_type[4:-1])))
+    elif pg_type == 'bytea':
+        text = '\\x' + (value.encode('utf-8') if isinstance(value, str) else bytes(value)).hex()
+    elif isinstance(value, datetime.timedelta):
+        seconds = int(value.total_seconds())
+        text = '{}{:02d}:{:02d}:{:02d}'.format('-' if seconds < 0 else '', abs(seconds) // 3600,
+                                               abs(seconds) // 60 % 60, abs(seconds) % 60)
+        if value.microseconds:
+            text += '.{:06d}'.format(value.microseconds)
+    elif isinstance(value, datetime.datetime):
+        text = value.isoformat(' ')
+    elif isinstance(value, bytes):
+        text = value.decode('utf-8')
+    elif isinstance(value, (dict, list)):
+        text = json.dumps(value)
+    else:
+        text = str(value)
+    return ''.join(COPY_ESCAPES.get(c, c) for c in text)
+
+
+class MySqlToPostgres(TableTransfer):
+    '''
+    Copies a MySql table into a Postgres database.
+    Column types are mapped with postgres_type, auto increment columns become identity columns
+    and enums text with a check of their values. Rows are streamed from an unbuffered MySql cursor
+    into COPY FROM STDIN. Both sessions run in UTC, so TIMESTAMP values keep their instant.
+
+    Fulltext and spatial indexes, ON UPDATE clauses and expression defaults have no translation,
+    they are reported in warnings and left out.
+    '''
+
+    def __init__(self, source, target_db, name=None, batch_size=1000):
+        '''Initialize the transfer, reading the column and index definitions of the source'''
+        super(MySqlToPostgres, self).__init__(source, target_db, name, batch_size)
+        self.definitions = self.source_db.execute(
+            self.source_db.commands.column_definitions(self.source_db.name, source.name))
+        self.types = OrderedDict((x[0], postgres_type(x[1])) for x in self.definitions)
+        self.identity = [x[0] for x in self.definitions if 'auto_increment' in (x[4] or '').lower()]
+        for column in self.identity:
+            # An identity is at most a bigint, which holds every value an auto increment reaches
+            if self.types[column].startswith('numeric'):
+                self.types[column] = 'bigint'
+        self.columns = list(self.types)
+        self.indexes = OrderedDict()
+        for index_name, non_unique, column, index_type in self.source_db.execute(
+                self.source_db.commands.index_definitions(self.source_db.name, source.name)):
+            self.indexes.setdefault(index_name, (not int(non_unique), index_type, []))[2].append(column)
+
+    def prepare(self, source_db, target_db):
+        '''Read and write TIMESTAMP values in UTC'''
+        source_db.execute(source_db.commands.set_time_zone())
+        target_db.execute(target_db.commands.set_time_zone())
+        target_db.commit()
+
+    def default_value(self, column, default, pg_type, extra):
+        '''Postgres default of a MySql COLUMN_DEFAULT, None when it has no translation'''
+        if default is None or default.upper() == 'NULL':
+            return None
+        if default.upper().startswith('CURRENT_TIMESTAMP'):
+            return 'CURRENT_TIMESTAMP'
+        if 'DEFAULT_GENERATED' in extra.upper():
+            self.warn('Default {} of {} not translated'.format(default, column))
+            return None
+        if pg_type == 'boolean':
+            return 'false' if default.strip("'") in ('0', "b'0") else 'true'
+        if pg_type.split('(')[0] in NUMERIC_TYPES:
+            return default
+        if len(default) > 1 and default[0] == default[-1] == "'":
+            return default
+        return "'{}'".format(default.replace("'", "''"))
+
+    def create_statement(self):
+        '''Create statement of the target table, the primary key included, other indexes come after the copy'''
+        lines = []
+        for column, column_type, nullable, default, extra in self.definitions:
+            pg_type = self.types[column]
+            extra = extra or ''
+            if column in self.identity:
+                definition = '{} {} GENERATED BY DEFAULT AS IDENTITY'.format(column, pg_type)
+            else:
+                definition = '{} {}'.format(column, pg_type)
+                pg_default = self.default_value(column, default, pg_type, extra)
+                if pg_default is not None:
+                    definition += ' DEFAULT {}'.format(pg_default)
+            if nullable == 'NO':
+                definition += ' NOT NULL'
+            if column_type.lower().startswith('enum('):
+                definition += ' CHECK ({} IN {})'.format(column, column_type[4:])
+            if 'on update' in extra.lower():
+                self.warn('ON UPDATE of {} not translated'.format(column))
+            if 'generated' in extra.lower() and 'default_generated' not in extra.lower():
+                self.warn('Generated column {} copied as a plain column'.format(column))
+            lines.append(definition)
+        if 'PRIMARY' in self.indexes:
+            lines.append('PRIMARY KEY ({})'.format(', '.join(self.indexes['PRIMARY'][2])))
+        return 'CREATE TABLE {} (\n  {}\n)'.format(self.name, ',\n  '.join(lines))
+
+    def index_statements(self):
+        '''Secondary indexes named after the target table, those the target already has are skipped'''
+        existing = [x.name for x in self.target.indexes]
+        statements = []
+        for index_name, (unique, index_type, columns) in self.indexes.items():
+            name = '{}_{}'.format(self.name, index_name)
+            if index_name == 'PRIMARY' or name in existing:
+                continue
+            if index_type in ('FULLTEXT', 'SPATIAL'):
+                self.warn('{} index {} not translated'.format(index_type, index_name))
+                continue
+            statements.append(self.target_db.commands.add_index(self.name, name, ', '.join(columns), unique))
+        return statements
+
+    def write_range(self, chunk, rows, target_db):
+        '''Replace the range of the target table with a COPY of rows'''
+        types = list(self.types.values())
+        target_db.execute(target_db.commands.delete_range(self.name, self.primary_key_column, None,
+                                                          chunk.start, chunk.end))
+        lines = ('\t'.join(copy_text(v, t) for v, t in zip(row, types)) + '\n' for row in rows)
+        count = target_db.copy_from(self.name, ', '.join(self.columns), lines)
+        target_db.commit()
+        return count
+
+    def finish(self):
+        '''Add the indexes and foreign keys, then move the identities past the copied values'''
+        super(MySqlToPostgres, self).finish()
+        for column in self.identity:
+            self.target_db.execute(self.target_db.commands.restart_identity(self.name, column))
+        self.target_db.commit()
+
+    def normalize(self, column, value):
+        '''Values of both databases as the same python values'''
+        if value is None:
+            return None
+        pg_type = self.types[column]
+        if isinstance(value, memoryview):
+            value = bytes(value)
+        if pg_type == 'boolean':
+            return bool(_bits(value))
+        if pg_type.startswith('bit('):
+            return copy_text(value, pg_type)
+        if pg_type.startswith('character('):
+            return value.rstrip(' ')
+        if pg_type == 'jsonb':
+            return json.dumps(json.loads(value) if isinstance(value, (str, bytes)) else value, sort_keys=True)
+        if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+            return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        if isinstance(value, datetime.timedelta):
+            return copy_text(value, pg_type)
+        if isinstance(value, datetime.time):
+            return value.isoformat()
+        if isinstance(value, float) and pg_type == 'real':
+            return float('{:.6g}'.format(value))
+        return value
@@ -0,0 +1,44 @@
+import sqlite3
+from contextlib import closing
+from src.core.base import Database
+from src.sqlite.commands import SqliteCommands
+from src.sqlite.tables import SqliteTable, SqliteMigrationTable, SqliteShadowColumn
+
+
+class SqliteDatabase(Database):
+    '''Model representing an in-process Sqlite database'''
+
+    def __init__(self, name, connection, config, pool=None):
+        '''Initialize the database'''
+        super(SqliteDatabase, self).__init__(name, connection, config, pool)
+        self.commands = SqliteCommands
+        self.table_class = SqliteTable
+        self.migration_table_class = SqliteMigrationTable
+        self.shadow_column_class = SqliteShadowColumn
+        # Keep foreign keys in other tables pointing at the table name, not the renamed table
+        self.execute(self.commands.legacy_alter_table(True))
+
+    def bind(self, connection):
+        '''Pragmas are per connection, set them on pooled connections too'''
+        bound = super(SqliteDatabase, self).bind(connection)
+        bound.execute(self.commands.legacy_alter_table(True))
+        return bound
+
+    def error_code(self, error):
+        '''Result code name of a sqlite3 error, from its message before Python 3.11'''
+        name = getattr(error, 'sqlite_errorname', None)
+        if name is None and isinstance(error, sqlite3.OperationalError):
+            if 'database is locked' in str(error):
+                name = 'SQLITE_BUSY'
+            elif 'is locked' in str(error):
+                name = 'SQLITE_LOCKED'
+        return name
+
+    @property
+    def is_local(self):
+        '''Sqlite runs in this process'''
+        return True
+
+    def cursor(self):
+        '''Sqlite cursors are not context managers'''
+        return closing(self.connection.cursor())
@@ -0,0 +1,549 @@
+
+class SqliteCommands(object):
+
+    BEGIN = 'BEGIN;'
+    COMMIT = 'COMMIT;'
+    LOG_NAME = 'journal'
+    # Strongest lock taken by each migration step that blocks the application
+    LOCKS = {
+        'create_triggers': 'RESERVED',
+        'rename_tables': 'RESERVED',
+    }
+    # Result codes worth retrying a chunk for, a busy database is a lock wait that timed out
+    RETRIABLE_ERRORS = {'SQLITE_BUSY', 'SQLITE_LOCKED'}
+    TIMEOUT_ERRORS = {'SQLITE_BUSY'}
+    # Sqlite locks the whole database, there are no row locks to skip
+    SKIP_LOCKED = False
+
+    @staticmethod
+    def get_tables(database_name):
+        return '''SELECT name FROM sqlite_master
+                  WHERE type = 'table'
+                  AND name NOT LIKE 'sqlite_%'
+               '''
+
+    @staticmethod
+    def legacy_alter_table(state=True):
+        return 'PRAGMA legacy_alter_table = {}'.format('ON' if state else 'OFF')
+
+    @staticmethod
+    def create_table(tablename, primary_key_col):
+        return '''CREATE TABLE
+                  IF NOT EXISTS {}
+                  ({} INTEGER PRIMARY KEY)
+               '''.format(tablename, primary_key_col)
+
+    @staticmethod
+    def get_table_create_statement(tablename):
+        return '''SELECT sql FROM sqlite_master
+                  WHERE type = 'table'
+                  AND name = '{}'
+               '''.format(tablename)
+
+    @staticmethod
+    def drop_table(tablename, cascade=False):
+        return 'DROP TABLE {}'.format(tablename)
+
+    @staticmethod
+    def get_row(cols, table, pk_col, pk):
+        return '''SELECT {}
+                  FROM {}
+                  WHERE {}={}
+               '''.format(cols, table, pk_col, pk)
+
+    @staticmethod
+    def insert_row(table, cols, vals):
+        return '''INSERT INTO {} (
+                  {}) VALUES ({});
+               '''.format(table, cols, vals)
+
+    @staticmethod
+    def update_row(table, col_val, pk_col, pk):
+        return '''UPDATE {}
+                  SET {}
+                  WHERE {}={}
+               '''.format(table, col_val, pk_col, pk)
+
+    @staticmethod
+    def delete_row(table, pk_col, pk):
+        return '''DELETE FROM {}
+                  WHERE {}={}
+               '''.format(table, pk_col, pk)
+
+    @staticmethod
+    def table_count(tablename):
+        return 'SELECT COUNT(1) FROM {}'.format(tablename)
+
+    @staticmethod
+    def row_estimate(tablename):
+        """Span of the rowids, an upper bound of the rows read from both ends of the table b-tree.
+        One MIN or MAX per SELECT, together they would scan the table
+        """
+        return '''SELECT (SELECT MAX(rowid) FROM {table}) - (SELECT MIN(rowid) FROM {table}) + 1'''.format(
+            table=tablename)
+
+    @classmethod
+    def table_size(cls, database_name, tablename):
+        """dbstat only exists in builds with SQLITE_ENABLE_DBSTAT_VTAB, see database_size"""
+        return '''SELECT SUM(pgsize), ({rows})
+                  FROM dbstat
+                  WHERE name = '{table}';'''.format(table=tablename, rows=cls.row_estimate(tablename))
+
+    @staticmethod
+    def table_bloat(database_name, tablename):
+        """Unused bytes are free space left inside the pages of the table, rows are counted,
+        deleted rows leave gaps in the rowids
+        """
+        return '''SELECT SUM(pgsize), (SELECT COUNT(1) FROM {table}), SUM(unused)
+                  FROM dbstat
+                  WHERE name = '{table}';'''.format(table=tablename)
+
+    @staticmethod
+    def database_size():
+        """Bytes and free bytes of the whole database file, where there is no dbstat to tell tables apart"""
+        return '''SELECT page_count * page_size, freelist_count * page_size
+                  FROM pragma_page_count, pragma_page_size, pragma_freelist_count'''
+
+    @staticmethod
+    def analyze(tablename):
+        return 'ANALYZE {}'.format(tablename)
+
+    @staticmethod
+    def index_size(database_name, tablename):
+        return '''SELECT COALESCE(SUM(pgsize), 0)
+                  FROM dbstat
+                  WHERE name IN (
+                    SELECT name FROM sqlite_master
+                    WHERE type = 'index'
+                    AND tbl_name = '{}');'''.format(tablename)
+
+    @staticmethod
+    def table_columns(tablename):
+        return '''SELECT name
+                  FROM pragma_table_info('{}')
+                  ORDER BY cid;'''.format(tablename)
+
+    @staticmethod
+    def column_definition(database_name, tablename, column_name):
+        return '''SELECT type, "notnull", dflt_value
+                  FROM pragma_table_info('{}')
+                  WHERE name = '{}';'''.format(tablename, column_name)
+
+    @staticmethod
+    def add_column(tablename, column_name, definition):
+        return 'ALTER TABLE {} ADD COLUMN {} {}'.format(tablename, column_name, definition)
+
+    @staticmethod
+    def drop_column(tablename, col_name):
+        return 'ALTER TABLE {} DROP COLUMN {}'.format(tablename, col_name)
+
+    @staticmethod
+    def rename_column(tablename, old_name, new_name):
+        return 'ALTER TABLE {} RENAME COLUMN {} TO {}'.format(tablename, old_name, new_name)
+
+    @staticmethod
+    def get_constraints(database_name, tablename):
+        return '''SELECT '{table}_pkey', '{table}', 'PRIMARY KEY', name, NULL
+                  FROM pragma_table_info('{table}')
+                  WHERE pk > 0
+                  UNION ALL
+                  SELECT il.name, '{table}', 'UNIQUE', ii.name, NULL
+                  FROM pragma_index_list('{table}') AS il
+                  JOIN pragma_index_info(il.name) AS ii
+                  WHERE il."unique" = 1
+                  AND il.origin != 'pk';'''.format(table=tablename)
+
+    @staticmethod
+    def add_constraint(tablename, constraint_name, type, column):
+        if type.upper() != 'UNIQUE':
+            raise NotImplementedError('Sqlite can only add UNIQUE constraints to an existing table')
+        return 'CREATE UNIQUE INDEX {} ON {} ({})'.format(constraint_name, tablename, column)
+
+    @staticmethod
+    def drop_constraint(tablename, constraint_name):
+        return 'DROP INDEX IF EXISTS {}'.format(constraint_name)
+
+    @staticmethod
+    def foreign_keys(database_name, tablename):
+        return '''SELECT 'fk_' || m.name || '_' || fk.id,
+                  m.name,
+                  fk."from",
+                  fk."table",
+                  fk."to",
+                  CASE WHEN fk."table" = '{table}' THEN 1 ELSE 0 END
+                  FROM sqlite_master AS m
+                  JOIN pragma_foreign_key_list(m.name) AS fk
+                  WHERE m.type = 'table'
+                  AND (m.name = '{table}' OR fk."table" = '{table}');'''.format(table=tablename)
+
+    @staticmethod
+    def foreign_key_exists(database_name, table_name, column_name, referenced_table, referenced_column):
+        return '''SELECT *
+                  FROM pragma_foreign_key_list('{}')
+                  WHERE "from" = '{}'
+                  AND "table" = '{}'
+                  AND "to" = '{}'
+                  '''.format(
+            table_name,
+            column_name,
+            referenced_table,
+            referenced_column
+        )
+
+    @staticmethod
+    def get_partitions(database_name, tablename):
+        """Sqlite has no partitioning"""
+        return 'SELECT NULL, NULL, NULL WHERE 0'
+
+    @staticmethod
+    def get_indexes(tablename):
+        return '''SELECT '{table}', il.name, il."unique", ii.name
+                  FROM pragma_index_list('{table}') AS il
+                  JOIN pragma_index_info(il.name) AS ii
+                  ORDER BY il.name;'''.format(table=tablename)
+
+    @staticmethod
+    def add_index(tablename, index_name, columns, unique=False):
+        unique_str = 'UNIQUE' if unique else ''
+        return '''CREATE {}
+                  INDEX {}
+                  ON {} ({});
+               '''.format(
+            unique_str,
+            index_name,
+            tablename,
+            columns)
+
+    @staticmethod
+    def drop_index(tablename, index_name):
+        return 'DROP INDEX IF EXISTS {}'.format(index_name)
+
+    @staticmethod
+    def min_pk(tablename, primary_key_col):
+        return 'SELECT MIN({}) FROM {}'.format(
+            primary_key_col,
+            tablename
+        )
+
+    @staticmethod
+    def max_pk(tablename, primary_key_col):
+        return 'SELECT MAX({}) FROM {}'.format(
+            primary_key_col,
+            tablename
+        )
+
+    @staticmethod
+    def get_triggers(databasename, tablename):
+        return '''SELECT name FROM sqlite_master
+                  WHERE type = 'trigger'
+                  AND tbl_name = '{}'
+               '''.format(tablename)
+
+    @staticmethod
+    def insert_trigger(trigger_name, source_table, dest_table, columns, values, condition=None):
+        """With a condition on NEW, only the rows matching it are inserted"""
+        return '''CREATE TRIGGER {trigger_name}
+              AFTER INSERT ON {source_table}
+              FOR EACH ROW{when}
+              BEGIN
+                INSERT INTO {dest_table} ({columns}) VALUES ({values});
+              END
+              '''.format(
+            trigger_name=trigger_name,
+            source_table=source_table,
+            dest_table=dest_table,
+            columns=columns,
+            values=values,
+            when=' WHEN ' + condition if condition else ''
+        )
+
+    @staticmethod
+    def update_trigger(trigger_name, source_table, dest_table, equalities, pk_col,
+                       condition=None, old_condition=None, columns=None, values=None):
+        """With a condition on NEW, rows updated out of it are deleted from dest_table,
+        and rows updated into it, not matching old_condition on OLD, are inserted from columns and values
+        """
+        if not condition:
+            return '''CREATE TRIGGER {trigger_name}
+                 AFTER UPDATE ON {source_table}
+                 FOR EACH ROW
+                 BEGIN
+                   UPDATE {dest_table} SET {equalities}
+                   WHERE {pk_col}=NEW.{pk_col};
+                 END
+               '''.format(trigger_name=trigger_name,
+                          source_table=source_table,
+                          dest_table=dest_table,
+                          equalities=equalities,
+                          pk_col=pk_col
+                          )
+        return '''CREATE TRIGGER {trigger_name}
+                 AFTER UPDATE ON {source_table}
+                 FOR EACH ROW
+                 BEGIN
+                   DELETE FROM {dest_table}
+                   WHERE {pk_col}=NEW.{pk_col} AND {condition} IS NOT TRUE;
+                   UPDATE {dest_table} SET {equalities}
+                   WHERE {pk_col}=NEW.{pk_col};
+                   INSERT OR IGNORE INTO {dest_table} ({columns})
+                   SELECT {values} WHERE {condition} AND {old_condition} IS NOT TRUE;
+                 END
+               '''.format(trigger_name=trigger_name,
+                          source_table=source_table,
+                          dest_table=dest_table,
+                          equalities=equalities,
+                          pk_col=pk_col,
+                          condition=condition,
+                          old_condition=old_condition,
+                          columns=columns,
+                          values=values
+                          )
+
+    @staticmethod
+    def delete_trigger(trigger_name, source_table, dest_table, pk_col):
+        return '''CREATE TRIGGER {trigger_name}
+                 AFTER DELETE ON {source_table}
+                 FOR EACH ROW
+                 BEGIN
+                   DELETE FROM {dest_table}
+                   WHERE {dest_table}.{pk_col} = OLD.{pk_col};
+                 END
+                 '''.format(
+            trigger_name=trigger_name,
+            source_table=source_table,
+            dest_table=dest_table,
+            pk_col=pk_col
+        )
+
+    @staticmethod
+    def shadow_trigger(trigger_name, table, event, shadow_col, value, pk_col):
+        return '''CREATE TRIGGER {trigger_name}
+                 AFTER {event} ON {table}
+                 FOR EACH ROW
+                 BEGIN
+                   UPDATE {table} SET {shadow_col} = {value}
+                   WHERE {pk_col} = NEW.{pk_col};
+                 END
+               '''.format(
+            trigger_name=trigger_name,
+            event=event,
+            table=table,
+            shadow_col=shadow_col,
+            value=value,
+            pk_col=pk_col
+        )
+
+    @staticmethod
+    def swap_columns(tablename, column, old_name, shadow_col, old_definition, new_definition):
+        return [
+            'ALTER TABLE {} RENAME COLUMN {} TO {}'.format(tablename, column, old_name),
+            'ALTER TABLE {} RENAME COLUMN {} TO {}'.format(tablename, shadow_col, column),
+        ]
+
+    @staticmethod
+    def drop_trigger(trigger_name, source_table):
+        return 'DROP TRIGGER IF EXISTS {}'.format(trigger_name)
+
+    @staticmethod
+    def next_pk(table, pk_col, last_pk, limit):
+        return '''SELECT MAX(T1.{pk_col}) FROM (
+                  SELECT {pk_col}
+                  FROM {table}
+                  WHERE {pk_col}>{last_pk}
+                  ORDER BY {pk_col}
+                  LIMIT {limit}) AS T1;'''.format(
+            pk_col=pk_col,
+            table=table,
+            last_pk=last_pk,
+            limit=limit
+        )
+
+    @staticmethod
+    def sample_chunk(source_table, origin_cols, pk_col, last_pk, limit):
+        return '''SELECT {origin_cols} FROM {source}
+                  WHERE {source}.{pk_col} >= {last_pk}
+                  ORDER BY {source}.{pk_col}
+                  LIMIT {limit};
+              '''.format(
+            origin_cols=origin_cols,
+            source=source_table,
+            pk_col=pk_col,
+            last_pk=last_pk,
+            limit=limit
+        )
+
+    @staticmethod
+    def _pk_range(pk_col, start, end):
+        """Conditions bounding pk_col to [start, end), either end may be open"""
+        conditions = []
+        if start is not None:
+            conditions.append('{} >= {}'.format(pk_col, start))
+        if end is not None:
+            conditions.append('{} < {}'.format(pk_col, end))
+        return conditions
+
+    @staticmethod
+    def seek_pk(table, pk_col, pk):
+        return 'SELECT MIN({pk_col}) FROM {table} WHERE {pk_col} > {pk}'.format(
+            pk_col=pk_col,
+            table=table,
+            pk=pk
+        )
+
+    @staticmethod
+    def long_transactions(seconds):
+        """Sqlite keeps no record of the transactions of other connections"""
+        return 'SELECT NULL, NULL, NULL, NULL WHERE 0'
+
+    @staticmethod
+    def data_directory():
+        """The database file, empty for an in-memory database"""
+        return "SELECT file FROM pragma_database_list WHERE name = 'main'"
+
+    @staticmethod
+    def explain(sql):
+        return 'EXPLAIN QUERY PLAN {}'.format(sql.rstrip().rstrip(';'))
+
+    @classmethod
+    def count_range(cls, table, pk_col, start, end):
+        return 'SELECT COUNT(*) FROM {} WHERE {}'.format(table, ' AND '.join(cls._pk_range(pk_col, start, end)) or '1=1')
+
+    @staticmethod
+    def statement_timeout(seconds):
+        """Sqlite statements only wait on locks, for up to the busy timeout of the connection"""
+        return 'PRAGMA busy_timeout = {}'.format(int(seconds * 1000))
+
+    @staticmethod
+    def current_timeout():
+        """The busy timeout lasts as long as the connection, saved to restore after the chunk"""
+        return 'PRAGMA busy_timeout'
+
+    @staticmethod
+    def restore_timeout(previous):
+        return 'PRAGMA busy_timeout = {}'.format(previous)
+
+    @classmethod
+    def chunk_boundaries(cls, table, pk_col, chunk_size, start=None, end=None):
+        conditions = cls._pk_range(pk_col, start, end)
+        return '''SELECT T1.{pk_col} FROM (
+                  SELECT {pk_col}, ROW_NUMBER() OVER (ORDER BY {pk_col}) AS chunk_row
+                  FROM {table}
+                  {where}) AS T1
+                  WHERE (T1.chunk_row - 1) % {chunk_size} = 0
+                  ORDER BY T1.{pk_col};'''.format(
+            pk_col=pk_col,
+            table=table,
+            where='WHERE ' + ' AND '.join(conditions) if conditions else '',
+            chunk_size=chunk_size
+        )
+
+    @staticmethod
+    def copy_chunk(table, dest_cols, origin_cols, source_table, pk_col, last_pk, limit):
+        return '''INSERT INTO {table} ({dest_cols})
+                  SELECT {origin_cols} FROM {source}
+                  LEFT OUTER JOIN {table}
+                  ON {source}.{pk_col}={table}.{pk_col}
+                  WHERE {table}.{pk_col} IS NULL
+                  AND {source}.{pk_col} >= {last_pk}
+                  ORDER BY {source}.{pk_col}
+                  LIMIT {limit};
+              '''.format(
+            table=table,
+            dest_cols=dest_cols,
+            origin_cols=origin_cols,
+            source=source_table,
+            pk_col=pk_col,
+            last_pk=last_pk,
+            limit=limit
+        )
+
+    @classmethod
+    def delete_range(cls, table, pk_col, where, start, end):
+        conditions = cls._pk_range(pk_col, start, end) + (['({})'.format(where)] if where else [])
+        return '''DELETE FROM {table}
+                  WHERE {conditions};'''.format(
+            table=table,
+            conditions=' AND '.join(conditions) or '1=1'
+        )
+
+    @classmethod
+    def update_range(cls, table, col_val, pk_col, where, start, end):
+        conditions = cls._pk_range(pk_col, start, end) + (['({})'.format(where)] if where else [])
+        return '''UPDATE {table}
+                  SET {col_val}
+                  WHERE {conditions};'''.format(
+            table=table,
+            col_val=col_val,
+            conditions=' AND '.join(conditions) or '1=1'
+        )
+
+    @classmethod
+    def copy_range(cls, table, dest_cols, origin_cols, source_table, pk_col, start, end,
+                   source_partition=None, dest_partition=None, skip_locked=False, order_by=None,
+                   condition=None):
+        """Sqlite has no partitions or row locks, source_partition, dest_partition and skip_locked are never set.
+        order_by are qualified source columns the rows are inserted in the order of.
+        Only the source rows matching condition are copied.
+        """
+        conditions = cls._pk_range('{}.{}'.format(source_table, pk_col), start, end)
+        if condition:
+            conditions.append(condition)
+        return '''INSERT INTO {table} ({dest_cols})
+                  SELECT {origin_cols} FROM {source}
+                  LEFT OUTER JOIN {table}
+                  ON {source}.{pk_col}={table}.{pk_col}
+                  WHERE {table}.{pk_col} IS NULL
+                  {range}
+                  {order};
+              '''.format(
+            table=table,
+            dest_cols=dest_cols,
+            origin_cols=origin_cols,
+            source=source_table,
+            pk_col=pk_col,
+            range=''.join(' AND ' + c for c in conditions),
+            order='ORDER BY ' + order_by if order_by else ''
+        )
+
+    @staticmethod
+    def copy_rows(table, dest_cols, origin_cols, source_table, pk_col, pk_list, skip_locked=False, condition=None):
+        return '''INSERT INTO {table} ({dest_cols})
+                  SELECT {origin_cols} FROM {source}
+                  LEFT OUTER JOIN {table}
+                  ON {source}.{pk_col}={table}.{pk_col}
+                  WHERE {table}.{pk_col} IS NULL
+                  AND {source}.{pk_col} IN ({pk_list}){condition};
+              '''.format(
+            table=table,
+            dest_cols=dest_cols,
+            origin_cols=origin_cols,
+            source=source_table,
+            pk_col=pk_col,
+            pk_list=pk_list,
+            condition=' AND ' + condition if condition else ''
+        )
+
+    @classmethod
+    def uncopied_pks(cls, table, source_table, pk_col, start=None, end=None, pk_list=None, source_partition=None,
+                     condition=None):
+        """Pks of the source rows in [start, end), or in pk_list, matching condition and missing from table"""
+        conditions = cls._pk_range('{}.{}'.format(source_table, pk_col), start, end)
+        if pk_list:
+            conditions.append('{}.{} IN ({})'.format(source_table, pk_col, pk_list))
+        if condition:
+            conditions.append(condition)
+        return '''SELECT {source}.{pk_col} FROM {source}
+                  LEFT OUTER JOIN {table}
+                  ON {source}.{pk_col}={table}.{pk_col}
+                  WHERE {table}.{pk_col} IS NULL
+                  {range}
+              '''.format(
+            table=table,
+            source=source_table,
+            pk_col=pk_col,
+            range=''.join(' AND ' + c for c in conditions)
+        )
+
+    @staticmethod
+    def rename_table(old_name, new_name):
+        return '''ALTER TABLE {} RENAME TO {};'''.format(old_name, new_name)
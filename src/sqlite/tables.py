@@ -0,0 +1,224 @@
+import re
+import sqlite3
+from src.core.tables import Table, MigrationTable
+from src.core.shadow import ShadowColumn
+
+
+class SqliteTable(Table):
+
+    def insert_row(self, row_dict):
+        """Add a row to the table"""
+        sql = self.commands.insert_row(
+                self.name,
+                self._join_cols(row_dict.keys()),
+                self._join_values(row_dict.values())
+            )
+        self.execute(sql)
+        return self.db.last_row
+
+    def get_column_definition(self, column_name):
+        '''Get the sql column definition
+           Selects the column type, NOT NULL and the default.
+           That's enough information to re-create the column.
+        '''
+        sql = self.commands.column_definition(self.db.name, self.name, column_name)
+        ans = self.execute(sql)[0]
+        char_def = ans[0]
+        if ans[1]:
+            char_def = '{} NOT NULL'.format(char_def)
+        if ans[2] is not None:
+            char_def = '{} default {}'.format(char_def, ans[2])
+        return char_def
+
+    def _dbstat(self, sql):
+        '''Rows of a dbstat query, None on a build without the dbstat table'''
+        try:
+            return self.execute(sql)
+        except sqlite3.OperationalError as e:
+            if 'dbstat' not in str(e):
+                raise
+            return None
+
+    @property
+    def _row_estimate(self):
+        '''Rows from the rowid span, None for a WITHOUT ROWID table, which only a count would tell'''
+        try:
+            rows = self.execute(self.commands.row_estimate(self.name))[0][0]
+        except sqlite3.OperationalError:
+            return None
+        return max(int(rows or 0), 0)
+
+    @property
+    def size_estimate(self):
+        '''Bytes of the table pages, or of the whole database file on a build without dbstat,
+        and the rowid span, without scanning the table
+        '''
+        ans = self._dbstat(self.commands.table_size(self.db.name, self.name))
+        if ans is not None:
+            size, rows = ans[0]
+            return int(size or 0), max(int(rows or 0), 0)
+        return int(self.execute(self.commands.database_size())[0][0] or 0), self._row_estimate or 0
+
+    def _bloat_stats(self):
+        '''Without dbstat, the page and freelist counts of the whole database file stand for the table,
+        and the rows are the rowid span
+        '''
+        ans = self._dbstat(self.commands.table_bloat(self.db.name, self.name))
+        if ans is not None:
+            return ans[0]
+        size, free = self.execute(self.commands.database_size())[0]
+        return size, self._row_estimate, free
+
+    @property
+    def index_size(self):
+        '''0 on a build without dbstat, index pages are only told apart there'''
+        ans = self._dbstat(self.commands.index_size(self.db.name, self.name))
+        return int(ans[0][0] or 0) if ans else 0
+
+    def full_scans(self, sql, db=None):
+        '''Tables the query plan scans, or searches without an index'''
+        scanned = []
+        for row in (db or self.db).execute(self.commands.explain(sql)):
+            parts = row[3].split()
+            if parts[0] in ('SCAN', 'SEARCH') and 'USING' not in parts:
+                scanned.append(parts[2] if parts[1] == 'TABLE' else parts[1])
+        return scanned
+
+    def alter_column(self, col_name, definition):
+        '''Sqlite cannot alter a column in place'''
+        raise NotImplementedError('Sqlite cannot alter column {}, use a migration table'.format(col_name))
+
+    @property
+    def create_statement(self):
+        """Get table create statement, with the table name as a format placeholder"""
+        query = self.commands.get_table_create_statement(self.name)
+        if self.db.table_exists(self.name):
+            statement = self.execute(query)[0][0]
+            statement = re.sub('\s+', ' ', statement)
+            return re.sub(r'^CREATE TABLE ("?){}\1'.format(re.escape(self.name)), 'CREATE TABLE {}', statement)
+        raise ValueError('Table does not exist, no create statement')
+
+    def add_foreign_keys(self, foreign_keys, override_table=None):
+        '''Sqlite foreign keys are declared in the create statement, and follow the table name on rename'''
+        pass
+
+    def add_foreign_key(self, table_name, column, fk_table, fk_column, name=None):
+        '''Sqlite cannot add a foreign key to an existing table'''
+        raise NotImplementedError('Sqlite cannot add foreign keys to an existing table')
+
+    def drop_foreign_keys(self):
+        '''Foreign keys are part of the table definition, and are dropped with it'''
+        pass
+
+    @property
+    def sequence_cols(self):
+        '''Integer primary keys use the rowid, there are no sequences to move'''
+        return []
+
+    def set_storage(self, params):
+        '''Sqlite tables have no storage parameters'''
+        raise NotImplementedError('Sqlite tables have no storage parameters')
+
+
+class SqliteMigrationTable(SqliteTable, MigrationTable):
+
+    def create_from_source(self):
+        """Create new table like source_table"""
+        with self.progress.phase('ddl'), self.profiled('setup'):
+            self.create_from_statement(self.source.create_statement)
+            # Inline constraints come with the create statement, unique indexes created later do not
+            unique_indexes = [x for x in self.source.constraints
+                              if x.type == 'UNIQUE' and not x.name.startswith('sqlite_autoindex')]
+            self.add_constraints(unique_indexes)
+            with self.profiled('indexes'):
+                self.add_indexes(self.source.indexes)
+
+    def create_insert_trigger(self):
+        '''Set insert Triggers.
+        'NEW' and 'OLD' are sqlite references
+        see https://www.sqlite.org/lang_createtrigger.html
+        '''
+        self.execute(self.commands.insert_trigger(
+            self.triggers['INSERT'],
+            self.source.name,
+            self.name,
+            self._join_cols(self.intersection.dest_columns),
+            self._values('NEW'),
+            self._condition('NEW')
+        ))
+
+    def create_update_trigger(self):
+        '''Set update triggers
+        'NEW' and 'OLD' are sqlite references
+        see https://www.sqlite.org/lang_createtrigger.html
+        '''
+        self.execute(self.commands.update_trigger(
+            self.triggers['UPDATE'],
+            self.source.name,
+            self.name,
+            self._assign(self.intersection.dest_columns, self.intersection.origin_values('NEW')),
+            self.primary_key_column,
+            self._condition('NEW'),
+            self._condition('OLD'),
+            self._join_cols(self.intersection.dest_columns),
+            self._values('NEW')
+        ))
+
+    def create_delete_trigger(self):
+        '''Set delete triggers
+        'NEW' and 'OLD' are sqlite references
+        see https://www.sqlite.org/lang_createtrigger.html
+        '''
+        self.execute(self.commands.delete_trigger(
+            self.triggers['DELETE'],
+            self.source.name,
+            self.name,
+            self.primary_key_column
+        ))
+
+    def reverse_sync_statements(self, table, archive):
+        """Statements creating the triggers copying the writes on table into archive"""
+        dest_cols, origin_cols = self._reverse_columns()
+        return [
+            self.commands.insert_trigger(self._reverse_trigger_name('INSERT'), table, archive,
+                                         self._join_cols(dest_cols), self._qualify('NEW', origin_cols)),
+            self.commands.update_trigger(self._reverse_trigger_name('UPDATE'), table, archive,
+                                         self._equals(dest_cols, 'NEW', origin_cols), self.primary_key_column),
+            self.commands.delete_trigger(self._reverse_trigger_name('DELETE'), table, archive,
+                                         self.primary_key_column),
+        ]
+
+    def drop_reverse_sync_statements(self, table, archive):
+        """Statements dropping the reverse triggers, which have no separate functions"""
+        return [self.commands.drop_trigger(self._reverse_trigger_name(type), table)
+                for type in ['INSERT', 'UPDATE', 'DELETE']]
+
+    def delete_triggers(self):
+        """Delete the triggers, sqlite triggers have no separate functions"""
+        for trigger_name in self.triggers.values():
+            self.execute(self.commands.drop_trigger(trigger_name, self.source.name))
+
+
+class SqliteShadowColumn(ShadowColumn):
+
+    def create_triggers(self):
+        """Sqlite triggers cannot assign to NEW, AFTER triggers update the row instead.
+        The update trigger only fires for the original column, so it does not fire itself
+        """
+        triggers = self.table.get_triggers()
+        events = [('insert', 'INSERT'), ('update', 'UPDATE OF {}'.format(self.column))]
+        for suffix, event in events:
+            trigger_name = self.trigger_name(suffix)
+            if trigger_name not in triggers:
+                self.table.execute(self.commands.shadow_trigger(
+                    trigger_name, self.table.name, event, self.name, self.value('NEW'),
+                    self.table.primary_key_column))
+        self.table.commit()
+
+    def drop_triggers_statements(self):
+        return [self.commands.drop_trigger(self.trigger_name(suffix), self.table.name)
+                for suffix in ['insert', 'update']]
+
+    def swap_statements(self):
+        """Sqlite runs DDL outside of a transaction unless one is opened"""
+        return [self.commands.BEGIN] + super(SqliteShadowColumn, self).swap_statements()
@@ -0,0 +1,65 @@
+"""Test progress and metrics"""
+import os
+import tempfile
+import unittest
+from src.core.metrics import Ewma, Histogram, PrometheusExporter
+from src.core.progress import Progress, ProgressEvent
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_ewma(self):
+        ewma = Ewma(alpha=0.5)
+        self.assertIsNone(ewma.value)
+        self.assertEqual(ewma.update(10), 10)
+        self.assertEqual(ewma.update(20), 15)
+
+        with self.assertRaises(ValueError):
+            Ewma(alpha=0)
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(1, 2, 4))
+        self.assertIsNone(histogram.p50)
+        for value in [0.5] * 98 + [3, 3]:
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 100)
+        self.assertLessEqual(histogram.p50, 1)
+        self.assertGreater(histogram.p99, 2)
+        self.assertLessEqual(histogram.p99, 3)
+        self.assertEqual(histogram.cumulative()[-1], (float('inf'), 100))
+
+    def test_progress_events(self):
+        events = []
+        progress = Progress('users')
+        progress.add_listener(events.append)
+        progress.expect(100, row_size=10)
+        with progress.phase('copy'):
+            progress.chunk(50, 0.5, throttle=0.5, position=50)
+            self.assertEqual(progress.rate, 50)
+            self.assertEqual(progress.eta, 1)
+            progress.chunk(50, 1.0, position=100)
+
+        self.assertListEqual([e.kind for e in events], [
+            ProgressEvent.PHASE_START, ProgressEvent.CHUNK, ProgressEvent.CHUNK, ProgressEvent.PHASE_END])
+        self.assertEqual(events[1].bytes, 500)
+        self.assertEqual(events[2].eta, 0)
+        summary = progress.summary()
+        self.assertEqual(summary['phases']['copy']['rows'], 100)
+        self.assertEqual(summary['phases']['copy']['throttle'], 0.5)
+
+    def test_prometheus_file(self):
+        progress = Progress('users')
+        path = os.path.join(tempfile.mkdtemp(), 'migration.prom')
+        PrometheusExporter(path=path).watch(progress)
+        with progress.phase('copy'):
+            progress.chunk(10, 0.02)
+
+        with open(path) as f:
+            text = f.read()
+        self.assertIn('sooty_rows_total{phase="copy",table="users"} 10.0', text)
+        self.assertIn('sooty_chunk_latency_seconds_bucket{le="0.025",phase="copy",table="users"} 1.0', text)
+        self.assertIn('sooty_chunk_latency_seconds_count{phase="copy",table="users"} 1.0', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@ import MySQLdb
 import unittest
 import configparser
 from src import DatabaseFactory
+from src.core.base import StatementSkipped
 from src.core.constraints import Constraint, Index
 from src.core.tables import Table
 
@@ -75,6 +76,25 @@ class TestMySQLTable(unittest.TestCase):
         self.assertEqual(len(ans[0]), 2)
         self.assertEqual(ans[1][0][0], 2)
 
+    def test_db_batch_execute_pipeline(self):
+        ans = self.db.batch_execute([
+            "INSERT INTO users (name) VALUES ('Solange Knowles')",
+            "UPDATE users SET name = 'Jeffrey Bridges' WHERE name = 'Jeff Bridges'",
+            'SELECT COUNT(1) FROM users',
+        ], pipeline=True, depth=2)
+        self.assertTrue(all(x.ok for x in ans))
+        self.assertEqual(ans[2].rows[0][0], 3)
+
+        ans = self.db.batch_execute([
+            "INSERT INTO users (name) VALUES ('Tina Knowles')",
+            'SELECT missing FROM users',
+            'SELECT COUNT(1) FROM users',
+        ], pipeline=True)
+        self.assertEqual([x.ok for x in ans], [True, False, False])
+        self.assertIsInstance(ans[2].error, StatementSkipped)
+        # The failed batch is rolled back
+        self.assertEqual(self.db.execute("SELECT COUNT(1) FROM users WHERE name = 'Tina Knowles'")[0][0], 0)
+
     def test_create(self):
         addresses = self.db.table('addresses')
         addresses.create()
@@ -135,6 +155,27 @@ class TestMySQLTable(unittest.TestCase):
 
         self.users.drop_column('active')
 
+    def test_shadow_column_keeps_definition(self):
+        self.users.add_column('zip', "varchar(10) CHARACTER SET latin1 NOT NULL DEFAULT '00000' COMMENT 'postal'")
+        shadow = self.users.shadow_column('zip', "varchar(20) NOT NULL DEFAULT '00000'")
+        shadow.add()
+        shadow.create_triggers()
+        shadow.backfill(chunk_size=1)
+        shadow.swap(drop_old=False)
+        definition = self.users.get_full_column_definition('zip_old')
+        self.assertIn('latin1', definition)
+        self.assertIn("DEFAULT '00000'", definition)
+        self.assertIn("COMMENT 'postal'", definition)
+        self.users.drop_column('zip_old')
+        self.assertIn("DEFAULT '00000'", self.users.get_full_column_definition('zip'))
+
+        with self.assertRaises(ValueError):
+            self.users.shadow_column('zip', 'varchar(30)').add()
+        with self.assertRaises(ValueError):
+            self.users.shadow_column('id', 'bigint').add()
+        self.assertNotIn('zip_shadow', self.users.columns)
+        self.users.drop_column('zip')
+
     # def test_foreign_key(self):
     #     """Foreign keys that affect a table can be on
     #     the table, or reference that table.
@@ -268,6 +309,19 @@ class TestMySQLMigrationTable(unittest.TestCase):
     def tearDown(self):
         self.users.drop(cascade=True)
 
+    def test_preflight_resumed(self):
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+        new_users.create_triggers()
+        self.assertEqual(len(new_users.get_source_triggers()), 3)
+        # Its own capture triggers are a resumed run, not triggers of someone else
+        report = self.db.migration_table(self.users).preflight()
+        self.assertNotIn('triggers', [x['check'] for x in report.blocking])
+        self.assertIn('triggers', [x['check'] for x in report.warnings])
+        new_users.delete_triggers()
+        self.assertListEqual(new_users.get_source_triggers(), [])
+        new_users.drop()
+
     def test_migrate(self):
         new_users = self.db.migration_table(self.users)
         new_users.create_from_source()
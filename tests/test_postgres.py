@@ -1,10 +1,13 @@
 """Test model migration tool"""
+import datetime
 import psycopg2
 import unittest
 import configparser
-from src import DatabaseFactory
+from src import DatabaseFactory, CONFIG
+from src.core.base import StatementSkipped
 from src.core.constraints import Constraint, Index
 from src.core.tables import Table
+from src.postgres.transfer import MySqlToPostgres, postgres_type, copy_text
 
 # pylint: disable=print-statement
 
@@ -67,6 +70,25 @@ class TestPostgresTable(unittest.TestCase):
         self.assertEqual(len(ans[0]), 2)
         self.assertEqual(ans[1][0][0], 2)
 
+    def test_db_batch_execute_pipeline(self):
+        ans = self.db.batch_execute([
+            "INSERT INTO users (name) VALUES ('Solange Knowles')",
+            "UPDATE users SET name = 'Jeffrey Bridges' WHERE name = 'Jeff Bridges'",
+            'SELECT COUNT(1) FROM users',
+        ], pipeline=True, depth=2)
+        self.assertTrue(all(x.ok for x in ans))
+        self.assertEqual(ans[2].rows[0][0], 3)
+
+        ans = self.db.batch_execute([
+            "INSERT INTO users (name) VALUES ('Tina Knowles')",
+            'SELECT missing FROM users',
+            'SELECT COUNT(1) FROM users',
+        ], pipeline=True)
+        self.assertEqual([x.ok for x in ans], [True, False, False])
+        self.assertIsInstance(ans[2].error, StatementSkipped)
+        # The failed batch is rolled back
+        self.assertEqual(self.db.execute("SELECT COUNT(1) FROM users WHERE name = 'Tina Knowles'")[0][0], 0)
+
     def test_create(self):
         addresses = self.db.table('addresses')
         addresses.create()
@@ -318,6 +340,125 @@ class TestPostgresMigrationTable(unittest.TestCase):
         self.users, archive = new_users.rename_tables()
         archive.drop()
 
+    def test_async_copy_in_chunks(self):
+        import asyncio
+        import asyncpg
+        from src.postgres.aio import AsyncPostgresDatabase
+
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+        new_users.rename_column('zip', 'zipcode')
+        new_users.create_triggers()
+
+        async def copy():
+            pool = await asyncpg.create_pool(database=TEST_DB['dbname'], user=TEST_DB['user'],
+                                             host=TEST_DB['host'], password=TEST_DB['password'])
+            try:
+                adb = AsyncPostgresDatabase(TEST_DB['dbname'], pool, self.db.config)
+                migration = adb.migration_table(adb.table('users'))
+                migration.rename_column('zip', 'zipcode')
+                await migration.copy_in_chunks(chunk_size=1, throttle=0.001)
+                return await migration.count()
+            finally:
+                await pool.close()
+
+        self.assertEqual(asyncio.run(copy()), self.users.count)
+        self.users, archive = new_users.rename_tables()
+        archive.drop()
+
+
+    def test_partitioned_copy(self):
+        events = self.db.table('events')
+        events.drop(cascade=True)
+        statement = 'CREATE TABLE {} (id integer PRIMARY KEY, name varchar(20)) PARTITION BY RANGE (id)'
+        partitions = [('{}_low', 1, 100), ('{}_high', 100, 200)]
+        for table in ['events', 'migrate_events']:
+            self.db.execute(statement.format(table))
+            for name, low, high in partitions:
+                self.db.execute('CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})'.format(
+                    name.format(table), table, low, high))
+        self.db.commit()
+        for i in range(1, 200, 7):
+            events.insert_row({'id': i, 'name': 'event {}'.format(i)})
+
+        self.assertListEqual([p.name for p in events.partitions], ['events_low', 'events_high'])
+        new_events = self.db.migration_table(events)
+        ranges = new_events.chunk_ranges(chunk_size=5)
+        self.assertSetEqual(set(r.partition for r in ranges), {'events_low', 'events_high'})
+
+        new_events.copy_in_chunks(chunk_size=5)
+        self.assertDictEqual(new_events.partition_map, {'events_low': 'migrate_events_low',
+                                                        'events_high': 'migrate_events_high'})
+        self.assertEqual(new_events.count, events.count)
+        self.assertListEqual(sorted(new_events.copied_partitions()), ['events_high', 'events_low'])
+        self.assertEqual(new_events.hot_partition([r.partition for r in ranges]), 'events_high')
+        self.assertEqual(len(set(events.partitions)), 2)
+        new_events.delete_triggers()
+        new_events.drop(cascade=True)
+        events.drop(cascade=True)
+
+    def test_partitioned_resync(self):
+        events = self.db.table('events')
+        statement = 'CREATE TABLE {} (id integer PRIMARY KEY, name varchar(20)) PARTITION BY RANGE (id)'
+        partitions = [('{}_low', 1, 100), ('{}_high', 100, 200)]
+        for partitioned_destination in [True, False]:
+            events.drop(cascade=True)
+            self.db.table('migrate_events').drop(cascade=True)
+            self.db.execute(statement.format('events'))
+            if partitioned_destination:
+                self.db.execute(statement.format('migrate_events'))
+            else:
+                self.db.execute('CREATE TABLE migrate_events (id integer PRIMARY KEY, name varchar(20))')
+            for name, low, high in partitions:
+                self.db.execute('CREATE TABLE {} PARTITION OF events FOR VALUES FROM ({}) TO ({})'.format(
+                    name.format('events'), low, high))
+                if partitioned_destination:
+                    self.db.execute('CREATE TABLE {} PARTITION OF migrate_events FOR VALUES FROM ({}) TO ({})'.format(
+                        name.format('migrate_events'), low, high))
+            self.db.commit()
+            for i in range(1, 200, 7):
+                events.insert_row({'id': i, 'name': 'event {}'.format(i)})
+            new_events = self.db.migration_table(events)
+            new_events.copy_in_chunks(chunk_size=5)
+            new_events.delete_triggers()
+
+            # Writes made while nothing captures them, in both partitions
+            events.update_row(8, {'name': 'changed'})
+            events.update_row(106, {'name': 'changed'})
+            events.delete_row(15)
+            events.delete_row(113)
+            new_events = self.db.migration_table(events)
+            new_events.copy_in_chunks(chunk_size=5, resync=True)
+            self.assertEqual(new_events.count, events.count)
+            self.assertEqual(new_events.get_row(8)['name'], 'changed')
+            self.assertEqual(new_events.get_row(106)['name'], 'changed')
+            self.assertIsNone(new_events.get_row(15))
+            self.assertIsNone(new_events.get_row(113))
+            new_events.delete_triggers()
+            new_events.drop(cascade=True)
+            events.drop(cascade=True)
+
+    def test_skip_locked_copy(self):
+        import threading
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+        new_users.create_triggers()
+
+        # An application transaction holds a lock on the first user for a second
+        locker = psycopg2.connect(**TEST_DB)
+        locker.cursor().execute('SELECT * FROM users WHERE id = 1 FOR UPDATE')
+        release = threading.Timer(1.0, locker.commit)
+        release.start()
+
+        new_users.copy_in_chunks(chunk_size=1, skip_locked=True)
+        release.join()
+        locker.close()
+        self.assertEqual(new_users.count, self.users.count)
+        self.assertSetEqual(new_users.skipped_pks, set())
+        # Two chunks, then at least one catch-up batch for the locked row
+        self.assertGreater(new_users.progress.chunks['copy'], 2)
+        new_users.delete_triggers()
+        new_users.drop()
 
 class TestPostgresComplexMigrations(unittest.TestCase):
 
@@ -443,5 +584,81 @@ class TestPostgresUtils(unittest.TestCase):
         self.assertEqual(ans, "('this', 'that'), ('something', 'something''s else')")
 
 
+class TestMySqlToPostgres(unittest.TestCase):
+    """Test the MySql to Postgres transfer"""
+
+    def setUp(self):
+        """Create a MySql table to transfer"""
+        import MySQLdb
+        section = 'MYSQL_TEST_DB'
+        self.mysql_connection = MySQLdb.connect(
+            db=Config.get(section, 'dbname'), user=Config.get(section, 'user'),
+            host=Config.get(section, 'host'), password=Config.get(section, 'password'))
+        config = dict(CONFIG, DIALECT='mysql', PROGRESS_CONSOLE=False)
+        self.mysql = DatabaseFactory(Config.get(section, 'dbname'), self.mysql_connection, config).fetch()
+        self.connection = psycopg2.connect(**TEST_DB)
+        self.db = DatabaseFactory(TEST_DB['dbname'], self.connection).fetch()
+        self.db.table('orders').drop()
+        self.mysql.execute('DROP TABLE IF EXISTS orders')
+        self.mysql.execute("""
+            CREATE TABLE orders (
+            id int unsigned NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            paid tinyint(1) NOT NULL DEFAULT 0,
+            status enum('new','shipped') NOT NULL DEFAULT 'new',
+            note text,
+            payload blob,
+            created timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+            KEY status_idx (status, paid)
+            )""")
+        for i in range(20):
+            self.mysql.execute("""INSERT INTO orders (paid, status, note, payload)
+                                  VALUES ({}, '{}', 'line\\tone\\ntwo', x'00ff')""".format(i % 2, ['new', 'shipped'][i % 2]))
+        self.mysql.commit()
+
+    def tearDown(self):
+        self.db.table('orders').drop()
+        self.mysql.execute('DROP TABLE IF EXISTS orders')
+
+    def test_postgres_type(self):
+        self.assertEqual(postgres_type('tinyint(1)'), 'boolean')
+        self.assertEqual(postgres_type('int(10) unsigned'), 'bigint')
+        self.assertEqual(postgres_type('bigint(20) unsigned'), 'numeric(20)')
+        self.assertEqual(postgres_type('decimal(10,2)'), 'numeric(10,2)')
+        self.assertEqual(postgres_type("enum('a','b')"), 'text')
+        self.assertEqual(postgres_type('timestamp'), 'timestamp with time zone')
+        with self.assertRaises(ValueError):
+            postgres_type('geometry')
+
+    def test_copy_text(self):
+        self.assertEqual(copy_text(None, 'text'), '\\N')
+        self.assertEqual(copy_text(1, 'boolean'), 't')
+        self.assertEqual(copy_text(b'\x05', 'bit(4)'), '0101')
+        self.assertEqual(copy_text(b'\x00\xff', 'bytea'), '\\\\x00ff')
+        self.assertEqual(copy_text('a\tb\n', 'text'), 'a\\tb\\n')
+        self.assertEqual(copy_text(datetime.timedelta(hours=30, seconds=5), 'time'), '30:00:05')
+
+    def test_transfer(self):
+        transfer = MySqlToPostgres(self.mysql.table('orders'), self.db, batch_size=7)
+        result = transfer.run(chunk_size=6, samples=5)
+        self.assertTrue(result['ok'])
+        self.assertEqual(result['ranges'], 4)
+
+        orders = self.db.table('orders')
+        self.assertEqual(orders.count, 20)
+        self.assertEqual([x.name for x in orders.indexes if x.name == 'orders_status_idx'], ['orders_status_idx'])
+        self.assertEqual(self.db.execute('SELECT paid, note FROM orders WHERE id = 2')[0], (True, 'line\tone\ntwo'))
+
+        # The identity continues past the copied ids
+        self.db.execute("INSERT INTO orders (status) VALUES ('new')")
+        self.assertEqual(self.db.execute('SELECT MAX(id) FROM orders')[0][0], 21)
+
+        # A rerun replaces the copied ranges
+        self.mysql.execute('DELETE FROM orders WHERE id = 3')
+        self.db.execute('DELETE FROM orders WHERE id = 21')
+        self.db.commit()
+        self.assertFalse(transfer.verify()['ok'])
+        self.assertTrue(transfer.run(chunk_size=6)['ok'])
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
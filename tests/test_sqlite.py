@@ -0,0 +1,947 @@
+"""Test model migration tool"""
+import datetime
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from src import DatabaseFactory
+from src.core.base import StatementSkipped
+from src.core.breaker import CircuitBreaker, MigrationDetached
+from src.core.chunking import ChunkPlanner, ChunkRange, Checkpoint
+from src.core.constraints import Constraint, Index
+from src.core.control import Controller, MigrationAborted, send
+from src.core.guard import PlanGuard, UnsafePlan
+from src.core.progress import ProgressEvent
+from src.core.pool import ConnectionPool, PoolTimeout
+from src.core.schedule import Schedule, Window
+
+CONFIG = {
+    "DEFAULT_CHUNK_SIZE": 10000,
+    "DEFAULT_THROTTLE": 0.001,
+    "MAX_LENGTH_NAME": 60,
+    "MAX_RENAME_RETRIES": 10,
+    "RETRY_SLEEP_TIME": 10,
+    "PROGRESS_CONSOLE": False,
+    "DIALECT": 'sqlite'
+}
+
+
+class TestSqliteTable(unittest.TestCase):
+    """Test for migration models"""
+
+    def setUp(self):
+        """Create a test table"""
+        self.connection = sqlite3.connect(':memory:')
+        dbf = DatabaseFactory('main', self.connection, CONFIG)
+        self.db = dbf.fetch()
+        self.employers = self.db.table('employers')
+        self.users = self.db.table('users')
+
+        self.users.create_from_statement("""
+            CREATE TABLE users (
+            id INTEGER PRIMARY KEY,
+            name varchar(20)
+            );""")
+        self.employers.create_from_statement('''
+            CREATE TABLE employers (
+            id INTEGER PRIMARY KEY,
+            name VARCHAR(50),
+            users_id integer REFERENCES users (id)
+            );
+            ''')
+
+        id = self.users.insert_row({'name': 'Beyonce Knowles'})
+        self.employers.insert_row({'users_id': id, 'name': 'Parkwood Entertainment'})
+        id = self.users.insert_row({'name': 'Jeff Bridges'})
+        self.employers.insert_row({'users_id': id, 'name': 'Marv Films'})
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_db_tables(self):
+        """Test get tables"""
+        tables = self.db.tables
+        self.assertIn('users', tables)
+        self.assertTrue(self.db.table_exists('users'))
+
+    def test_db_batch_execute(self):
+        ans = self.db.batch_execute(['SELECT * FROM users', 'SELECT COUNT(1) FROM employers'])
+        self.assertEqual(len(ans[0]), 2)
+        self.assertEqual(ans[1][0][0], 2)
+
+    def test_db_batch_execute_pipeline(self):
+        ans = self.db.batch_execute([
+            "INSERT INTO users (name) VALUES ('Solange Knowles')",
+            "UPDATE users SET name = 'Jeffrey Bridges' WHERE name = 'Jeff Bridges'",
+            'SELECT COUNT(1) FROM users',
+        ], pipeline=True, depth=2)
+        self.assertTrue(all(x.ok for x in ans))
+        self.assertEqual(ans[2].rows[0][0], 3)
+
+        ans = self.db.batch_execute([
+            "INSERT INTO users (name) VALUES ('Tina Knowles')",
+            'SELECT missing FROM users',
+            'SELECT COUNT(1) FROM users',
+        ], pipeline=True)
+        self.assertEqual([x.ok for x in ans], [True, False, False])
+        self.assertIsInstance(ans[2].error, StatementSkipped)
+        # The failed batch is rolled back
+        self.assertEqual(self.db.execute("SELECT COUNT(1) FROM users WHERE name = 'Tina Knowles'")[0][0], 0)
+
+    def test_create(self):
+        addresses = self.db.table('addresses')
+        addresses.create()
+        self.assertTrue(self.db.table_exists(addresses.name))
+        addresses.drop()
+        self.assertFalse(self.db.table_exists(addresses.name))
+
+    def test_table(self):
+        """Test base table"""
+        b = self.db.table('users')
+        create = b.create_statement
+        self.assertEqual(create, 'CREATE TABLE {} ( id INTEGER PRIMARY KEY, name varchar(20) )')
+
+        self.assertEqual(b.min_pk, 1)
+        self.assertEqual(b.max_pk, 2)
+
+    def test_rows(self):
+        self.users.insert_row({'name': 'Bob Ross'})
+        row = self.users.get_row(3)
+        self.assertEqual(row['name'], 'Bob Ross')
+        self.users.update_row(3, {'name': 'Robert Ross'})
+        row = self.users.get_row(3)
+        self.assertEqual(row['name'], 'Robert Ross')
+        self.users.delete_row(3)
+        row = self.users.get_row(3)
+        self.assertIsNone(row)
+
+    def test_chunked_dml(self):
+        for i in range(3, 31):
+            self.users.insert_row({'name': 'user {}'.format(i)})
+        self.assertEqual(self.users.update_where({'name': 'even'}, 'id % 2 = 0', chunk_size=4), 15)
+        self.assertEqual(self.users.update_where("name = name || '!'", "name = 'even'", chunk_size=7), 15)
+        self.assertEqual(self.users.get_row(4)['name'], 'even!')
+        self.assertEqual(self.users.progress.chunks['update'], 8 + 5)
+
+        self.assertEqual(self.users.delete_where("name = 'even!'", chunk_size=4), 15)
+        self.assertEqual(self.users.count, 15)
+
+        archive = self.db.table('archive_users')
+        archive.create_from_statement(self.users.create_statement)
+        self.db.execute('INSERT INTO archive_users SELECT * FROM users')
+        archive.drop_in_chunks(chunk_size=4)
+        self.assertFalse(self.db.table_exists('archive_users'))
+        self.assertEqual(archive.progress.chunks['delete'], 4)
+
+    def test_shadow_column(self):
+        self.users.add_column('zip', 'integer')
+        self.users.add_index(['zip'])
+        for i in range(3, 21):
+            self.users.insert_row({'name': 'user {}'.format(i), 'zip': 90000 + i})
+
+        shadow = self.users.shadow_column('zip', 'text', "'0' || CAST({column} AS text)")
+        shadow.add()
+        shadow.create_triggers()
+        self.users.insert_row({'name': 'during backfill', 'zip': 90210})
+        self.assertEqual(self.users.get_row(21)['zip_shadow'], '090210')
+        self.assertEqual(shadow.backfill(chunk_size=5), 21)
+        self.users.update_row(3, {'zip': 10001})
+        shadow.add_indexes()
+        shadow.swap()
+
+        self.assertNotIn('zip_shadow', self.users.columns)
+        self.assertNotIn('zip_old', self.users.columns)
+        self.assertEqual(self.users.get_column_definition('zip').upper(), 'TEXT')
+        self.assertEqual(self.users.get_row(3)['zip'], '010001')
+        self.assertEqual(self.users.get_row(4)['zip'], '090004')
+        self.assertListEqual([x.column for x in self.users.indexes], ['zip'])
+        self.assertListEqual(self.users.get_triggers(), [])
+
+        # The primary key and an unrestated default would be lost in the swap
+        with self.assertRaises(ValueError):
+            self.users.shadow_column('id', 'bigint').add()
+        self.users.add_column('plan', "text NOT NULL default 'free'")
+        with self.assertRaises(ValueError):
+            self.users.shadow_column('plan', 'varchar(10)').add()
+        self.assertNotIn('plan_shadow', self.users.columns)
+        shadow = self.users.shadow_column('plan', "varchar(10) NOT NULL default 'free'")
+        shadow.run()
+        self.assertEqual(self.users.get_column_definition('plan'), "varchar(10) NOT NULL default 'free'")
+
+        # Long names are cut after their suffix, and stay apart when they share a start
+        prefix = 'c' * 60
+        names = [self.users.shadow_column(prefix + x, 'text').trigger_name(event)
+                 for x in ['_a', '_b'] for event in ['insert', 'update']]
+        self.assertEqual(len(set(names)), 4)
+        self.assertTrue(all(len(x) <= CONFIG['MAX_LENGTH_NAME'] for x in names))
+
+    def test_count(self):
+        self.assertEqual(self.users.count, 2)
+        size, rows = self.users.size_estimate
+        self.assertGreater(size, 0)
+        self.assertEqual(rows, 2)
+
+    def test_size_without_dbstat(self):
+        commands = self.db.commands
+
+        class NoDbstatCommands(commands):
+            """Commands of a build compiled without SQLITE_ENABLE_DBSTAT_VTAB"""
+
+        for name in ['table_size', 'table_bloat', 'index_size']:
+            sql = getattr(commands, name)
+            setattr(NoDbstatCommands, name, staticmethod(
+                lambda *args, sql=sql: sql(*args).replace('FROM dbstat', 'FROM missing_dbstat')))
+        self.db.commands = NoDbstatCommands
+        try:
+            size, rows = self.users.size_estimate
+            self.assertGreater(size, 0)
+            self.assertEqual(rows, 2)
+            self.assertEqual(self.users.index_size, 0)
+            tracer = self.db.enable_tracing()
+            self.assertEqual(self.users.bloat['rows'], 2)
+            # A WITHOUT ROWID table has no rowid span to estimate from, its rows are unknown rather than counted
+            self.db.execute('CREATE TABLE tags (name text PRIMARY KEY) WITHOUT ROWID')
+            self.db.execute("INSERT INTO tags VALUES ('a'), ('b')")
+            tags = self.db.table('tags')
+            self.assertIsNone(tags.bloat['rows'])
+            self.assertEqual(tags.size_estimate[1], 0)
+            labels = [label for (_, label) in tracer.stats]
+            self.assertNotIn('NoDbstatCommands.table_count', labels)
+            self.db.disable_tracing()
+            new_users = self.db.migration_table(self.users)
+            new_users.create_from_source()
+            new_users.copy_in_chunks(chunk_size=1)
+            self.assertEqual(new_users.count, 2)
+            new_users.drop()
+        finally:
+            self.db.commands = commands
+
+    def test_columns(self):
+        cols = self.users.columns
+        self.assertListEqual(cols, ['id', 'name'])
+
+        self.users.add_column('email', 'varchar(255)')
+        cols = self.users.columns
+        self.assertListEqual(cols, ['id', 'name', 'email'])
+
+        definition = self.users.get_column_definition('email')
+        self.assertEqual(definition, 'varchar(255)')
+
+        self.users.rename_column('email', 'email_address')
+        cols = self.users.columns
+        self.assertListEqual(cols, ['id', 'name', 'email_address'])
+
+        self.users.drop_column('email_address')
+        cols = self.users.columns
+        self.assertListEqual(cols, ['id', 'name'])
+
+        self.users.add_column('active', 'bool NOT NULL default 1')
+        definition = self.users.get_column_definition('active')
+        self.assertEqual(definition, 'bool NOT NULL default 1')
+
+    def test_foreign_key(self):
+        employer_fks = self.employers.foreign_keys
+        self.assertEqual(len(employer_fks), 1)
+        employer_fk = employer_fks[0]
+        self.assertEqual(employer_fk.table_name, 'employers')
+        self.assertEqual(employer_fk.fk_table_name, 'users')
+        self.assertFalse(employer_fk.referenced)
+
+        user_fks = self.users.foreign_keys
+        self.assertEqual(employer_fk, user_fks[0])
+        self.assertTrue(user_fks[0].referenced)
+
+        ans = self.employers.check_foreign_key_exists(employer_fk.table_name,
+                                                      employer_fk.column_name,
+                                                      employer_fk.fk_table_name,
+                                                      employer_fk.fk_column)
+        self.assertTrue(ans)
+
+    def test_constraints(self):
+        constraints = self.users.constraints
+        self.assertEqual(len(constraints), 1)
+        self.assertEqual(self.users.primary_key.column, 'id')
+
+        self.users.add_constraint('UNIQUE', 'name')
+        self.assertEqual(len(self.users.constraints), 2)
+
+        for constraint in self.users.constraints:
+            if constraint.type == 'UNIQUE':
+                self.users.drop_constraint(constraint.name)
+        self.assertEqual(len(self.users.constraints), 1)
+
+    def test_indexes(self):
+        self.assertListEqual(self.users.indexes, [])
+        self.users.add_index(['name'])
+
+        indices = self.users.indexes
+        self.assertEqual(len(indices), 1)
+        self.assertEqual(self.users.get_index(indices[0].name), indices[0])
+
+        self.users.drop_index(indices[0].name)
+        self.assertListEqual(self.users.indexes, [])
+
+    def test_triggers(self):
+        triggers = self.users.get_triggers()
+        self.assertListEqual(triggers, [])
+
+
+class TestSqliteMigrationTable(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:')
+        dbf = DatabaseFactory('main', self.connection, CONFIG)
+        self.db = dbf.fetch()
+        self.users = self.db.table('users')
+        self.users.create_from_statement('''
+            CREATE TABLE users (
+            id INTEGER PRIMARY KEY,
+            name varchar(20) UNIQUE,
+            address text,
+            city varchar(20),
+            state varchar(2),
+            zip integer
+            );'''
+        )
+        self.users.add_index(['city'])
+        self.address = self.db.table('address')
+        self.address.create_from_statement('''
+            CREATE TABLE address (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id)
+            )''')
+
+        self.users.insert_row({'name': 'J.J Abrams', 'address': '1221 Olympic Boulevard',
+                               'city': 'Santa Monica', 'state': 'CA', 'zip': 90404})
+
+        self.users.insert_row({'name': 'Joss Whedon', 'address': 'P.O. Box 988',
+                               'city': 'Malibu', 'state': 'CA', 'zip': 90265})
+        self.address.insert_row({'user_id': 1})
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_migrate(self):
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+
+        self.assertEqual(len(new_users.indexes), 2)
+        self.assertTrue(isinstance(new_users.indexes[0], Index))
+
+        primary_key = new_users.primary_key
+        self.assertEqual(primary_key.column, 'id')
+        self.assertTrue(isinstance(primary_key, Constraint))
+        new_users.drop()
+
+    def test_rename_triggers(self):
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+
+        new_users.rename_column('zip', 'zipcode')
+        self.assertListEqual(new_users.intersection.dest_columns, ['address', 'city', 'id', 'name', 'state', 'zipcode'])
+
+        new_users.create_triggers()
+        self.assertEqual(len(new_users.get_source_triggers()), 3)
+
+        id = self.users.insert_row({'name': 'Damien Chazelle', 'address': '1223 Wilshire Blvd.',
+                                    'city': 'Santa Monica', 'state': 'CA', 'zip': 90403})
+        row = new_users.get_row(id)
+        self.assertDictEqual(row, {'city': 'Santa Monica', 'name': 'Damien Chazelle', 'zipcode': 90403,
+                                   'state': 'CA', 'address': '1223 Wilshire Blvd.', 'id': 3})
+
+        self.users.update_row(3, {'city': 'Los Angeles'})
+        self.assertEqual(new_users.get_row(3)['city'], 'Los Angeles')
+
+        self.users.delete_row(3)
+        self.assertEqual(new_users.count, 0)
+
+        new_users.delete_triggers()
+        self.assertListEqual(new_users.get_source_triggers(), [])
+
+    def test_filter_and_transform(self):
+        self.users.add_column('deleted', 'integer')
+        self.users.update_row(2, {'deleted': 1})
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+        new_users.add_column('place', 'text')
+        new_users.filter_rows('{row}.deleted IS NULL')
+        new_users.transform_column('name', 'UPPER({row}.name)')
+        new_users.transform_column('place', "{row}.city || ', ' || {row}.state")
+        self.assertListEqual(new_users.intersection.computed_columns, ['place'])
+
+        new_users.copy_in_chunks(chunk_size=1)
+        self.assertEqual(new_users.count, 1)
+        self.assertEqual(new_users.get_row(1)['name'], 'J.J ABRAMS')
+        self.assertEqual(new_users.get_row(1)['place'], 'Santa Monica, CA')
+
+        id = self.users.insert_row({'name': 'Ava DuVernay', 'city': 'Long Beach', 'state': 'CA'})
+        self.users.insert_row({'name': 'Gone Girl', 'deleted': 1})
+        self.assertEqual(new_users.get_row(id)['name'], 'AVA DUVERNAY')
+        self.assertEqual(new_users.count, 2)
+
+        self.users.update_row(id, {'city': 'Compton'})
+        self.assertEqual(new_users.get_row(id)['place'], 'Compton, CA')
+        self.users.update_row(1, {'deleted': 1})
+        self.assertIsNone(new_users.get_row(1))
+        self.users.execute('UPDATE users SET deleted = NULL WHERE id = 2')
+        self.assertEqual(new_users.get_row(2)['name'], 'JOSS WHEDON')
+        self.assertEqual(new_users.count, 2)
+
+    def test_copy_in_chunks(self):
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+        new_users.rename_column('zip', 'zipcode')
+
+        events = []
+        new_users.progress.add_listener(events.append)
+        new_users.copy_in_chunks(chunk_size=1)
+
+        self.assertEqual(new_users.count, self.users.count)
+        self.assertEqual(new_users.progress.rows['copy'], 2)
+        self.assertEqual(new_users.progress.chunks['copy'], 2)
+        self.assertIn('copy', [e.phase for e in events])
+
+        self.users, archive = new_users.rename_tables()
+        self.assertIn('zipcode', self.users.columns)
+        self.assertEqual(self.users.get_row(2)['name'], 'Joss Whedon')
+        self.assertEqual(self.address.foreign_keys[0].fk_table_name, 'users')
+        self.assertListEqual(self.users.get_triggers(), [])
+        archive.drop()
+
+    def test_rollback(self):
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+        new_users.rename_column('zip', 'zipcode')
+        new_users.copy_in_chunks(chunk_size=1)
+        self.users, archive = new_users.rename_tables(reverse_sync=3600)
+        self.assertEqual(len(self.users.get_triggers()), 3)
+
+        id = self.users.insert_row({'name': 'Greta Gerwig', 'zipcode': 94301})
+        self.users.update_row(1, {'city': 'Oakland'})
+        self.users.delete_row(2)
+        self.assertEqual(archive.get_row(id)['zip'], 94301)
+        self.assertEqual(archive.get_row(1)['city'], 'Oakland')
+        self.assertIsNone(archive.get_row(2))
+
+        restored, migrated = new_users.rollback()
+        self.assertEqual(restored.name, 'users')
+        self.assertEqual(migrated.name, new_users.source.migrate_name)
+        self.assertIn('zip', restored.columns)
+        self.assertEqual(restored.count, 2)
+        self.assertListEqual(restored.get_triggers(), [])
+        self.assertListEqual(migrated.get_triggers(), [])
+        with self.assertRaises(Exception):
+            new_users.rollback()
+
+    def test_rebuild(self):
+        self.users.execute('CREATE INDEX users_name ON users (name)')
+        for i in range(3, 400):
+            self.users.insert_row({'id': i, 'name': 'user {}'.format(i), 'address': 'x' * 300})
+        self.users.execute('DELETE FROM users WHERE id % 3 != 0')
+        self.db.commit()
+        new_users = self.db.migration_table(self.users)
+        sql = self.db.commands.copy_range('migrate_users', 'id', 'id', 'users', 'id', 1, 10, order_by='users.name')
+        self.assertIn('ORDER BY users.name', sql)
+
+        with self.assertRaises(ValueError):
+            new_users.rebuild(order_by='users_city')
+        with self.assertRaises(NotImplementedError):
+            new_users.rebuild(storage={'fillfactor': 70})
+        new_users.drop()
+
+        new_users = self.db.migration_table(self.users)
+        report = new_users.rebuild(order_by='users_name', cutover=False, chunk_size=50)
+        self.assertListEqual(new_users.order_by, ['name'])
+        self.assertEqual(report['after']['rows'], report['before']['rows'])
+        new_users.drop()
+
+        new_users = self.db.migration_table(self.users)
+        report = new_users.rebuild(chunk_size=50)
+        self.assertLess(report['after']['bloat_bytes'], report['before']['bloat_bytes'])
+        self.assertLess(report['after']['bytes'], report['before']['bytes'])
+        self.assertEqual(self.db.table('users').count, report['before']['rows'])
+        self.assertIn('name', [x.column for x in self.db.table('users').indexes])
+
+    def test_end_reverse_sync(self):
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+        new_users.copy_in_chunks(chunk_size=1)
+        self.users, archive = new_users.rename_tables(reverse_sync=3600)
+        self.assertFalse(new_users.end_reverse_sync())
+        self.assertTrue(new_users.end_reverse_sync(force=True))
+        self.assertListEqual(self.users.get_triggers(), [])
+        self.users.insert_row({'name': 'Sofia Coppola'})
+        self.assertEqual(archive.count, 2)
+
+    def test_chunk_ranges(self):
+        for i in range(3, 26):
+            self.users.insert_row({'id': i * 2, 'name': 'user {}'.format(i)})
+        new_users = self.db.migration_table(self.users)
+
+        ranges = new_users.chunk_ranges(chunk_size=10, method='scan')
+        self.assertListEqual(ranges, [ChunkRange(None, 22), ChunkRange(22, 42), ChunkRange(42, None)])
+        ranges = new_users.chunk_ranges(chunk_size=10, method='scan', start=6, limit=30)
+        self.assertListEqual(ranges, [ChunkRange(6, 26), ChunkRange(26, 32)])
+        # Sqlite keeps no pk statistics, auto scans and sample splits the pk span evenly
+        self.assertEqual(new_users.chunk_ranges(chunk_size=10), new_users.chunk_ranges(chunk_size=10, method='scan'))
+        ranges = new_users.chunk_ranges(chunk_size=10, method='sample')
+        self.assertIsNone(ranges[0].start)
+        self.assertIsNone(ranges[-1].end)
+        self.assertListEqual(ChunkPlanner.quantiles([0, 10, 100], 4), [5, 10, 55])
+        # A bounded plan splits only its share of the pk span, in chunks of its share of the rows
+        ranges = new_users.chunk_ranges(chunk_size=10, method='sample', start=6, limit=30)
+        self.assertListEqual(ranges, [ChunkRange(6, 15), ChunkRange(15, 24), ChunkRange(24, 32)])
+        self.assertListEqual(ChunkPlanner.quantiles([0, 10, 100], 2, 1.0, 2.0), [55])
+        self.assertEqual(ChunkPlanner.position([0, 10, 100], 55), 1.5)
+
+    def test_checkpoint(self):
+        for i in range(3, 26):
+            self.users.insert_row({'id': i * 2, 'name': 'user {}'.format(i)})
+        path = os.path.join(tempfile.mkdtemp(), 'users.checkpoint')
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+
+        checkpoint = Checkpoint(path)
+        ranges = checkpoint.start(new_users.chunk_ranges(chunk_size=10))
+        checkpoint.mark(ranges[0])
+        new_users.copy_in_chunks(checkpoint=path)
+        # The first chunk was recorded as done, so only the others were copied
+        self.assertEqual(new_users.count, self.users.count - 10)
+        self.assertEqual(new_users.progress.chunks['copy'], 2)
+        self.assertFalse(os.path.exists(path))
+
+        new_users.copy_in_chunks(checkpoint=path)
+        self.assertEqual(new_users.count, self.users.count)
+        new_users.drop()
+
+    def test_control(self):
+        for i in range(3, 41):
+            self.users.insert_row({'id': i, 'name': 'user {}'.format(i)})
+        directory = tempfile.mkdtemp()
+        control_file = os.path.join(directory, 'users.control')
+        checkpoint = os.path.join(directory, 'users.checkpoint')
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+
+        with open(control_file, 'w') as f:
+            f.write('chunk_size 5\nthrottle 0\nworkers two\n')
+
+        def abort_after_three(event):
+            if event.kind == ProgressEvent.CHUNK and event.phase == 'copy' and new_users.progress.chunks['copy'] == 3:
+                with open(control_file, 'w') as f:
+                    f.write('abort\n')
+
+        new_users.progress.add_listener(abort_after_three)
+        control = Controller(control_file=control_file)
+        with self.assertRaises(MigrationAborted):
+            new_users.copy_in_chunks(chunk_size=20, checkpoint=checkpoint, control=control)
+        self.assertEqual(new_users.count, 15)
+        with open(control_file + '.status') as f:
+            status = json.load(f)
+        self.assertEqual(status['chunk_size'], 5)
+        self.assertTrue(status['aborted'])
+
+        new_users.progress.remove_listener(abort_after_three)
+        new_users.copy_in_chunks(checkpoint=checkpoint)
+        self.assertEqual(new_users.count, self.users.count)
+        # The re-planned chunks were kept, only the five remaining ones were copied
+        self.assertEqual(new_users.progress.chunks['copy'], 8)
+        new_users.drop()
+
+    def test_control_socket(self):
+        path = os.path.join(tempfile.mkdtemp(), 'control.sock')
+        control = Controller(socket_path=path)
+        control.serve()
+        self.assertTrue(send(path, 'pause')['paused'])
+        self.assertTrue(send(path, 'status')['paused'])
+        status = send(path, 'throttle 0.5')
+        self.assertEqual(status['throttle'], 0.5)
+        self.assertIn('error', send(path, 'faster'))
+        status = send(path, 'chunk_size abc')
+        self.assertIn('error', status)
+        self.assertIsNone(status['chunk_size'])
+        self.assertFalse(send(path, 'resume')['paused'])
+        control.stop()
+        self.assertFalse(os.path.exists(path))
+
+    def test_schedule(self):
+        window = Window.parse('mon-fri 22:00-04:00')
+        self.assertTrue(window.overnight)
+        self.assertEqual(window.days, {0, 1, 2, 3, 4})
+        self.assertEqual(Window.parse('fri-mon').days, {4, 5, 6, 0})
+        # Saturday 03:00 is still inside Friday night's window, Saturday 22:00 is not
+        self.assertTrue(window.contains(datetime.datetime(2026, 10, 17, 3)))
+        self.assertFalse(window.contains(datetime.datetime(2026, 10, 17, 22)))
+
+        now = [datetime.datetime(2026, 10, 17, 12)]
+        slept = []
+
+        def sleep(seconds):
+            slept.append(seconds)
+            now[0] += datetime.timedelta(seconds=seconds)
+
+        schedule = Schedule([window], blackout_dates=['2026-10-19'], poll_interval=86400,
+                            clock=lambda: now[0], sleep=sleep)
+        self.assertFalse(schedule.is_open())
+        # Monday night is blacked out until midnight
+        self.assertEqual(schedule.next_open(), datetime.datetime(2026, 10, 20))
+
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+        new_users.copy_in_chunks(chunk_size=1, schedule=schedule)
+        self.assertEqual(new_users.count, self.users.count)
+        self.assertEqual(now[0], datetime.datetime(2026, 10, 20))
+        self.assertEqual(slept, [86400, 86400, 43200])
+        new_users.drop()
+
+    def test_retry_and_split(self):
+        path = os.path.join(tempfile.mkdtemp(), 'retry.db')
+        connection = sqlite3.connect(path, check_same_thread=False)
+        db = DatabaseFactory('main', connection, dict(CONFIG, CHUNK_RETRIES=10, CHUNK_RETRY_BACKOFF=0.01)).fetch()
+        users = db.table('users')
+        users.create_from_statement('CREATE TABLE users (id INTEGER PRIMARY KEY, name text)')
+        for i in range(1, 41):
+            users.insert_row({'id': i, 'name': 'user {}'.format(i)})
+        users.commit()
+        new_users = db.migration_table(users)
+        new_users.create_from_source()
+        new_users.create_triggers()
+
+        with self.assertRaises(sqlite3.OperationalError) as fatal:
+            db.execute('SELECT * FROM no_such_table')
+        self.assertIsNone(db.classify_error(fatal.exception))
+
+        # Another connection holds the write lock, every chunk times out until it lets go
+        blocker = sqlite3.connect(path, check_same_thread=False)
+        blocker.execute('BEGIN IMMEDIATE')
+        with self.assertRaises(sqlite3.OperationalError) as busy:
+            connection.execute('PRAGMA busy_timeout = 1')
+            connection.execute("INSERT INTO users (name) VALUES ('busy')")
+        self.assertEqual(db.classify_error(busy.exception), 'timeout')
+        connection.rollback()
+        release = threading.Timer(0.2, blocker.rollback)
+        release.start()
+
+        connection.execute('PRAGMA busy_timeout = 2000')
+        new_users.copy_in_chunks(chunk_size=20, chunk_timeout=0.01)
+        release.join()
+        self.assertEqual(new_users.count, 40)
+        # The chunk timeout does not outlive the chunks
+        self.assertEqual(db.execute('PRAGMA busy_timeout')[0][0], 2000)
+        # The first chunk was split in half until it fit
+        self.assertGreater(new_users.progress.chunks['copy'], 2)
+        self.assertEqual(new_users.progress.rows['copy'], 40)
+        blocker.close()
+        connection.close()
+
+    def test_catch_up(self):
+        for i in range(3, 21):
+            self.users.insert_row({'id': i, 'name': 'user {}'.format(i)})
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+        # Sqlite has no row locks, nothing is skipped
+        new_users.copy_in_chunks(chunk_size=5, skip_locked=True)
+        self.assertEqual(new_users.count, self.users.count)
+        self.assertSetEqual(new_users.skipped_pks, set())
+
+        # Rows a SKIP LOCKED chunk left behind
+        for pk in [4, 9, 15]:
+            new_users.delete_row(pk)
+        self.assertListEqual(sorted(new_users._uncopied_pks(ChunkRange(None, 10))), [4, 9])
+        path = os.path.join(tempfile.mkdtemp(), 'users.checkpoint')
+        checkpoint = Checkpoint(path)
+        checkpoint.mark(ChunkRange(None, None), [4, 9, 15])
+        self.assertSetEqual(Checkpoint(path).skipped, {4, 9, 15})
+
+        new_users.skipped_pks = set(checkpoint.skipped)
+        self.assertListEqual(new_users.catch_up(chunk_size=2, checkpoint=checkpoint), [])
+        self.assertEqual(new_users.count, self.users.count)
+        self.assertSetEqual(Checkpoint(path).skipped, set())
+        new_users.drop()
+
+    def test_plan_guard(self):
+        guard = PlanGuard(self.users, interval=2)
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+        new_users.copy_in_chunks(chunk_size=1, guard=guard)
+        self.assertEqual(new_users.count, self.users.count)
+        # The seek and the first of the two chunks were explained, both use the primary key
+        self.assertListEqual([x['label'] for x in guard.checks], ['seek_pk users', 'copy_range'])
+        self.assertFalse(any(x['scanned'] for x in guard.checks))
+        new_users.drop()
+
+        events = self.db.table('events')
+        events.create_from_statement('CREATE TABLE events (id integer, name text)')
+        for i in range(1, 21):
+            events.insert_row({'id': i, 'name': 'event {}'.format(i)})
+        guard = PlanGuard(events)
+        # Nothing indexes id: auto samples instead of scanning, scan refuses to run
+        self.assertEqual(len(ChunkPlanner(events, 5, guard=guard).plan()), 4)
+        self.assertEqual(guard.checks[0]['scanned'], ['events'])
+        with self.assertRaises(UnsafePlan):
+            ChunkPlanner(events, 5, guard=PlanGuard(events)).plan('scan')
+
+        new_events = self.db.migration_table(events)
+        new_events.create_from_source()
+        with self.assertRaises(UnsafePlan):
+            new_events.copy_in_chunks(chunk_size=5, guard=PlanGuard(events))
+        self.assertEqual(new_events.count, 0)
+        new_events.drop()
+
+    def test_preflight(self):
+        new_users = self.db.migration_table(self.users)
+        report = new_users.preflight()
+        self.assertTrue(report.ok)
+        # An in-memory database has no file to measure free space on
+        self.assertListEqual([x['check'] for x in report.warnings], ['disk'])
+        self.assertGreater(report.extra_disk_bytes, 0)
+
+        self.db.execute("""CREATE TRIGGER audit_users AFTER UPDATE ON users
+                           BEGIN SELECT 1; END""")
+        report = new_users.preflight()
+        self.assertFalse(report.ok)
+        self.assertEqual(report.blocking[0]['check'], 'triggers')
+        self.assertListEqual(report.blocking[0]['detail']['triggers'], ['audit_users'])
+        self.assertIn('"blocking"', report.to_json())
+
+        events = self.db.table('events')
+        events.create_from_statement('CREATE TABLE events (id integer, name text)')
+        report = self.db.migration_table(events).preflight()
+        self.assertListEqual([x['check'] for x in report.blocking], ['primary_key'])
+
+        path = os.path.join(tempfile.mkdtemp(), 'preflight.db')
+        connection = sqlite3.connect(path)
+        db = DatabaseFactory('main', connection, CONFIG).fetch()
+        db.table('users').create_from_statement('CREATE TABLE users (id INTEGER PRIMARY KEY, name text)')
+        report = db.migration_table(db.table('users')).preflight()
+        self.assertListEqual(report.findings, [])
+        self.assertGreater(report.free_disk_bytes, report.extra_disk_bytes)
+        connection.close()
+
+        # A data directory path only means something on the host the server runs on
+        for host, local in [(None, True), ('/var/run/postgresql', True), ('localhost', True),
+                            ('::1', True), ('db.example.com', False), ('10.0.0.5', False)]:
+            self.assertEqual(db._local_host(host), local)
+
+    def test_circuit_breaker(self):
+        for i in range(3, 11):
+            self.users.insert_row({'id': i, 'name': 'user {}'.format(i)})
+        now = [0.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        # A spike over the SLO pauses the copy until latency recovers
+        latencies = iter([0.01, 0.5, 0.5, 0.5, 0.01, 0.01] + [0.01] * 20)
+        breaker = CircuitBreaker(0.1, latency=lambda: next(latencies), window=1, detach_after=10,
+                                 clock=lambda: now[0], sleep=sleep)
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+        new_users.copy_in_chunks(chunk_size=2, breaker=breaker)
+        self.assertEqual(new_users.count, self.users.count)
+        self.assertEqual(breaker.pauses, 1)
+        self.assertEqual(now[0], 3.0)
+        self.assertFalse(breaker.detached)
+        new_users.delete_triggers()
+        new_users.drop()
+
+        # A breach that lasts drops the capture triggers
+        path = os.path.join(tempfile.mkdtemp(), 'users.checkpoint')
+        latencies = iter([0.01, 0.01] + [0.5] * 20)
+        breaker = CircuitBreaker(0.1, latency=lambda: next(latencies), window=1, detach_after=5,
+                                 clock=lambda: now[0], sleep=sleep)
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+        with self.assertRaises(MigrationDetached):
+            new_users.copy_in_chunks(chunk_size=2, checkpoint=path, breaker=breaker)
+        self.assertEqual(new_users.count, 4)
+        self.assertListEqual(new_users.get_source_triggers(), [])
+        self.assertTrue(Checkpoint(path).needs_resync)
+
+        # Writes are no longer captured, the resync copies them anyway
+        self.users.update_row(1, {'name': 'Jeffrey Abrams'})
+        self.users.delete_row(2)
+        new_users = self.db.migration_table(self.users)
+        new_users.copy_in_chunks(chunk_size=2, checkpoint=path)
+        self.assertEqual(new_users.count, self.users.count)
+        self.assertEqual(new_users.get_row(1)['name'], 'Jeffrey Abrams')
+        self.assertEqual(len(new_users.get_source_triggers()), 3)
+        self.assertFalse(os.path.exists(path))
+        new_users.drop()
+
+    def test_plan(self):
+        new_users = self.db.migration_table(self.users)
+        plan = new_users.plan(chunk_size=1, samples=2)
+        self.assertEqual(plan.estimated_rows, 2)
+        self.assertEqual(plan.chunks, 2)
+        self.assertEqual(plan.index_count, 2)
+        self.assertEqual(plan.pk_density, 1.0)
+        self.assertEqual(plan.samples[0]['kind'], 'read')
+        self.assertListEqual([x['step'] for x in plan.locking_steps], ['create_triggers', 'rename_tables'])
+
+        new_users.create_from_source()
+        plan = new_users.plan(chunk_size=1, samples=2)
+        self.assertEqual(plan.samples[0]['kind'], 'copy')
+        self.assertEqual(plan.samples[0]['rows'], 1)
+        self.assertEqual(new_users.count, 0)
+        self.assertTrue(plan.fits(3600))
+        self.assertIn('"extra_disk_bytes"', plan.to_json())
+
+    def test_tracing(self):
+        tracer = self.db.enable_tracing(slow_threshold=0)
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+        new_users.copy_in_chunks()
+
+        summary = tracer.summary()
+        self.assertIn('SqliteCommands.copy_range', summary['copy']['by_label'])
+        self.assertGreater(summary['ddl']['catalog_statements'], 0)
+        self.assertEqual(len(tracer.slow_log), sum(p['statements'] for p in summary.values()))
+
+        # Each pipelined statement is traced under the commands method that built it
+        tracer.reset()
+        self.db.batch_execute([self.db.commands.table_count('users'),
+                               self.db.commands.max_pk('users', 'id')], pipeline=True)
+        by_label = tracer.summary()[None]['by_label']
+        self.assertEqual(by_label['SqliteCommands.table_count']['statements'], 1)
+        self.assertEqual(by_label['SqliteCommands.max_pk']['statements'], 1)
+        self.db.disable_tracing()
+
+    def test_profiling(self):
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = self.db.enable_profiling(profile='chunk', path=os.path.join(directory, 'chunk.pstats'))
+            new_users = self.db.migration_table(self.users)
+            new_users.create_from_source()
+            new_users.copy_in_chunks(chunk_size=2)
+            new_users.rename_tables()
+
+            summary = profiler.summary()
+            for section in ['setup', 'indexes', 'triggers', 'copy', 'chunk', 'foreign_keys', 'cutover']:
+                self.assertIn(section, summary)
+            chunk = summary['chunk']
+            self.assertEqual(chunk['runs'], len(new_users.chunk_ranges(2)))
+            self.assertGreater(chunk['db_wait'], 0)
+            self.assertLessEqual(chunk['db_wait'], chunk['wall'])
+            self.assertAlmostEqual(chunk['client'], chunk['wall'] - chunk['db_wait'])
+            self.assertGreaterEqual(summary['copy']['wall'], chunk['wall'])
+            self.assertEqual(self.db.disable_profiling(), profiler)
+            self.assertTrue(os.path.exists(os.path.join(directory, 'chunk.pstats')))
+            self.assertIsNone(self.db.profiler)
+
+            profiler = self.db.enable_profiling(profile='cutover', sampler=True, interval=0.0001,
+                                                path=os.path.join(directory, 'cutover.folded'))
+            deadline = time.time() + 5
+            try:
+                with new_users.profiled('cutover'):
+                    while not profiler.sampler.samples:
+                        if time.time() > deadline:
+                            self.fail('The sampler took no sample in 5s')
+                        sum(range(1000))
+            finally:
+                self.db.disable_profiling()
+            with open(os.path.join(directory, 'cutover.folded')) as f:
+                self.assertIn('test_profiling', f.read())
+
+
+class TestSqlitePool(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'pool.db')
+        self.pool = ConnectionPool(
+            lambda: sqlite3.connect(self.path, check_same_thread=False),
+            size=3,
+            session_setup=['PRAGMA busy_timeout = 5000']
+        )
+        self.db = DatabaseFactory('main', None, CONFIG, pool=self.pool).fetch()
+        self.users = self.db.table('users')
+        self.users.create()
+        for _ in range(4):
+            self.users.insert_row({'id': self.users.count + 1})
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+        self.pool.close()
+
+    def test_sessions(self):
+        self.assertEqual(self.pool.created, 1)
+        self.assertEqual(self.db.execute('PRAGMA busy_timeout')[0][0], 5000)
+
+        counts = []
+
+        def work():
+            with self.db.session() as session:
+                counts.append(session.table('users').count)
+
+        threads = [threading.Thread(target=work) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertListEqual(counts, [4, 4])
+        self.assertLessEqual(self.pool.created, 3)
+
+        with self.db.session() as first, self.db.session() as second:
+            self.assertIsNot(first.connection, second.connection)
+            self.assertIs(first.parent, self.db)
+            with self.assertRaises(PoolTimeout):
+                self.pool.acquire(timeout=0.01)
+
+    def test_parallel_copy(self):
+        for i in range(5, 101):
+            self.users.insert_row({'id': i})
+        self.db.commit()
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+        new_users.copy_in_chunks(chunk_size=7, workers=2)
+        self.assertEqual(new_users.count, 100)
+        self.assertEqual(new_users.progress.chunks['copy'], 15)
+
+    def test_parallel_detach(self):
+        for i in range(5, 101):
+            self.users.insert_row({'id': i})
+        self.db.commit()
+        path = os.path.join(tempfile.mkdtemp(), 'users.checkpoint')
+        samples = []
+
+        def latency():
+            samples.append(1)
+            return 0.01 if len(samples) < 6 else 0.5
+
+        breaker = CircuitBreaker(0.1, latency=latency, window=1, detach_after=0, sleep=lambda seconds: None)
+        new_users = self.db.migration_table(self.users)
+        new_users.create_from_source()
+        checkpoint = Checkpoint(path)
+        marked_after_detach = []
+        mark = checkpoint.mark
+
+        def record(chunk, skipped=()):
+            if breaker.detached:
+                marked_after_detach.append(chunk)
+            mark(chunk, skipped)
+
+        checkpoint.mark = record
+        with self.assertRaises(MigrationDetached):
+            new_users.copy_in_chunks(chunk_size=7, workers=3, checkpoint=checkpoint, breaker=breaker)
+        self.assertListEqual(marked_after_detach, [])
+        self.assertEqual(checkpoint.completed, set())
+        self.assertTrue(Checkpoint(path).needs_resync)
+        self.assertEqual(Checkpoint(path).completed, set())
+        # The workers stopped, only the chunks taken before the detach were copied
+        self.assertLess(new_users.progress.chunks['copy'], 15)
+
+    def test_health_check(self):
+        with self.db.session() as session:
+            broken = session.connection
+        broken.close()
+        with self.db.session() as session:
+            self.assertIsNot(session.connection, broken)
+            self.assertEqual(session.table('users').count, 4)
+        self.assertEqual(self.pool.discarded, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
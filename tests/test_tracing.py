@@ -0,0 +1,69 @@
+"""Test statement tracing"""
+import threading
+import unittest
+from src.core.progress import Progress
+from src.core.tracing import QueryTracer, TracedCommands
+from src.postgres.commands import PostgresCommands
+
+
+class TestTracing(unittest.TestCase):
+
+    def test_traced_commands(self):
+        commands = TracedCommands(PostgresCommands)
+        sql = commands.table_count('users')
+        self.assertEqual(sql, 'SELECT COUNT(1) FROM users')
+        self.assertEqual(sql.label, 'PostgresCommands.table_count')
+        self.assertEqual(commands.BEGIN.label, 'PostgresCommands.BEGIN')
+
+    def test_tracer_phases(self):
+        tracer = QueryTracer(slow_threshold=0.5)
+        progress = Progress('users')
+        progress.add_listener(tracer)
+
+        tracer.record('SELECT column_name FROM information_schema.columns', 0.1, 2, label='table_columns')
+        with progress.phase('copy'):
+            tracer.record('INSERT INTO migrate_users SELECT 1', 0.7, 1000, label='copy_chunk')
+            tracer.record('INSERT INTO migrate_users SELECT 1', 0.2, 1000, label='copy_chunk')
+
+        summary = tracer.summary()
+        self.assertEqual(summary[None]['catalog_statements'], 1)
+        copy = summary['copy']['by_label']['copy_chunk']
+        self.assertEqual(copy['command'], 'INSERT')
+        self.assertEqual(copy['statements'], 2)
+        self.assertEqual(copy['rows'], 2000)
+        self.assertEqual(summary['copy']['round_trips'], 2)
+        self.assertEqual(len(tracer.slow_log), 1)
+        self.assertEqual(tracer.slow_log[0].phase, 'copy')
+        self.assertEqual(tracer.top(1)[0][1], 'copy_chunk')
+
+    def test_tracer_thread_phases(self):
+        tracer = QueryTracer()
+        inside, outside = threading.Event(), threading.Event()
+        traces = {}
+
+        def other():
+            with tracer.phase('ddl'):
+                inside.set()
+                outside.wait(5)
+                traces['ddl'] = tracer.record('ALTER TABLE users ADD COLUMN zip text', 0.1)
+
+        with tracer.phase('copy'):
+            thread = threading.Thread(target=other)
+            thread.start()
+            inside.wait(5)
+            traces['copy'] = tracer.record('INSERT INTO migrate_users SELECT 1', 0.1)
+            outside.set()
+            thread.join()
+            # A thread without a phase of its own, like a copy worker, runs in the open one
+            worker = threading.Thread(target=lambda: traces.update(worker=tracer.record('SELECT 1', 0.1)))
+            worker.start()
+            worker.join()
+
+        self.assertEqual(traces['copy'].phase, 'copy')
+        self.assertEqual(traces['ddl'].phase, 'ddl')
+        self.assertEqual(traces['worker'].phase, 'copy')
+        self.assertIsNone(tracer.current_phase)
+
+
+if __name__ == '__main__':
+    unittest.main()